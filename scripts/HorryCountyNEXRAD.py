@@ -6,7 +6,7 @@ import optparse
 import logging.config
 import ConfigParser
 from processNEXRAD import nexradProcess  
-from xmrgFile import xmrgDB, xmrgCleanup
+from xmrgFile import xmrgDB, xmrgCleanup, radarCellWeights
 import datetime
 from datetime import tzinfo
 from pytz import timezone
@@ -27,6 +27,7 @@ class horryCountyNexradProcess(nexradProcess):
     self.ftpUser = None
     self.ftpPwd = None
     self.ftpDir = None    
+    self.watershedWeightsCurrent = False   #Set once the cell weights for the watershed_boundary polygons are built.
   
   
   """
@@ -99,12 +100,35 @@ class horryCountyNexradProcess(nexradProcess):
             self.addWatershedToDatabase(watershedName, polypoints, utcDate)
             self.polygonNames.append(watershedName)  
             pmCnt += 1      
+        #The polygons may have changed, so check the cell weights against them when the next file is processed.
+        self.watershedWeightsCurrent = False
         return(True)
       except Exception,e:
         if(self.logger):
           self.logger.exception(e)
       return(False)
     
+  """
+  Function: processData
+  Purpose: Before the first file's weighted averages are calculated, makes sure the cell weights for the watershed
+    polygons are built so calculateWeightedAvg2 doesn't have to do the spatial query every hour. The weights are only
+    rebuilt for polygons that changed since the last run.
+  Parameters:
+    result is the decoded file result from the import pipeline.
+    outputFile - file object where the results are written.
+  Return:
+    True if successful, otherwise False.
+  """
+  def processData(self, result, outputFile):
+    if(self.watershedWeightsCurrent == False):
+      mesh = self.meshCache.getMesh(result['xmrg'], self.minLatLong, self.maxLatLong)
+      if(radarCellWeights(self.dbObj.db, self.logger).buildFromTable(mesh, 'watershed_boundary', 'name', 'the_geom') == -1):
+        if(self.logger):
+          self.logger.error("Unable to build the watershed cell weights, falling back to spatial queries.")
+      else:
+        self.watershedWeightsCurrent = True
+    return(nexradProcess.processData(self, result, outputFile))
+
   """
   Function: doCalcs
   Purpose: For each file processed, this function is called. We run through the polygons for the watershed doing the weighted average
@@ -278,7 +302,9 @@ class horryCountyNexradProcess(nexradProcess):
       
       sql = "DELETE FROM watershed_boundary;"
       cursor = self.dbObj.executeQuery(sql)
-      if(cursor):
+      #The cell weights for the deleted polygons go with them.
+      if(cursor and radarCellWeights(self.dbObj.db, self.logger).deleteBoundaries('watershed_boundary')):
+        self.watershedWeightsCurrent = False
         self.dbObj.db.commit()
       else:
         self.logger.error( self.dbObj.lastErrorMsg )
@@ -38,16 +38,21 @@ import logging
 import logging.config
 import time
 import datetime
+import re
+import threading
+import Queue
 from pytz import timezone
 from suds import WebFault
 from datetime import tzinfo
 import math
+import numpy
 from dhecDB import dhecDB
+from precipStats import dateToEpoch
+from tideRangeCache import tideRangeCache, noaaTideBackend, localTideBackend
 from pprint import pformat
 from xeniatools.NOAATideData import noaaTideData
 from xeniatools.xenia import dbXenia,dbTypes,qaqcTestFlags
 from xeniatools.xmlConfigFile import xmlConfigFile
-from xeniatools.stats import vectorMagDir
 
 
 
@@ -75,6 +80,104 @@ class predictionLevels(object):
     else:
       return "NO TEST"
     
+"""
+Class: compiledFormula
+Purpose: A prediction test formula compiled into a python function. The formulas in the config file use string
+  substitution, %(name)f, to pull in the data. Instead of doing the substitution and then eval/exec of the result for
+  every station on every run, the placeholders are rewritten into lookups in the data dictionary and the formula is
+  compiled once. Running the test is then a function call.
+  The MLR formulas are compiled as an expression that returns the result. The CART decision trees are compiled as
+  a block of code that must set the cartPrediction variable, which is returned.
+"""
+class compiledFormula(object):
+  #Matches a %(name)X placeholder, along with the quotes around it if the formula treats it as a string.
+  placeholderRe = re.compile(r"""(['"]?)%\((\w+)\)([#0\- +]*\d*(?:\.\d+)?)([sridfeEgG])\1""")
+  
+  """
+  Function: __init__
+  Purpose: Parses and compiles the formula. Raises a SyntaxError if the formula is not valid python.
+  Parameters:
+    formula - the formula string from the config file.
+    isExpression - True if the formula is an expression that evaluates to the result(MLR), False if the formula is a
+      block of code that sets the cartPrediction variable(CART).
+  """
+  def __init__(self, formula, isExpression):
+    self.formula = formula
+    self.isExpression = isExpression
+    self.variables = set()
+    source = self.placeholderRe.sub(self.replacePlaceholder, formula)
+    if(isExpression):
+      source = "def formulaFunc(data):\n  return(%s)\n" % (source.strip())
+    else:
+      lines = ["  %s" % (line) for line in source.strip().splitlines()]
+      source = "def formulaFunc(data):\n%s\n  return(cartPrediction)\n" % ("\n".join(lines))
+    self.source = source
+    namespace = {}
+    exec compile(source, '<formula>', 'exec') in globals(), namespace
+    self.func = namespace['formulaFunc']
+
+  """
+  Function: replacePlaceholder
+  Purpose: re.sub callback that turns a string substitution placeholder into the python code to look up the value in
+    the data dictionary, converted the same way the substitution would have.
+  Parameters:
+    match - the re match object for the placeholder.
+  Return:
+    The code to use in place of the placeholder.
+  """
+  def replacePlaceholder(self, match):
+    quote,name,flags,conversion = match.groups()
+    self.variables.add(name)
+    if(conversion in 'sr'):
+      if(len(quote)):
+        return("str(data['%s'])" % (name))
+      return("data['%s']" % (name))
+    if(conversion in 'di'):
+      return("%sint(data['%s'])%s" % (quote, name, quote))
+    return("%sfloat(data['%s'])%s" % (quote, name, quote))
+  
+  """
+  Function: missingVariables
+  Purpose: Checks the data dictionary for the variables the formula references.
+  Parameters:
+    data - The data dictionary.
+  Return:
+    A sorted list of the variables not in the dictionary, empty if they are all there.
+  """
+  def missingVariables(self, data):
+    missing = [name for name in self.variables if name not in data]
+    missing.sort()
+    return(missing)
+
+  """
+  Function: run
+  Purpose: Runs the formula against the data.
+  Parameters:
+    data - The data dictionary keyed on the variable names.
+  Return:
+    The result of the formula, or the cartPrediction for a decision tree.
+  """
+  def run(self, data):
+    return(self.func(data))
+
+#Cache of the compiled formulas keyed on the formula type and text, so each formula is only compiled once no matter
+#how many stations or runs use it.
+compiledFormulas = {}
+"""
+Function: getCompiledFormula
+Purpose: Returns the compiledFormula for the formula, compiling it the first time it is seen.
+Parameters:
+  formula - the formula string from the config file.
+  isExpression - True for an MLR expression, False for a CART decision tree.
+Return:
+  The compiledFormula object. Raises a SyntaxError if the formula does not compile.
+"""
+def getCompiledFormula(formula, isExpression):
+  key = (isExpression, formula)
+  if(key not in compiledFormulas):
+    compiledFormulas[key] = compiledFormula(formula, isExpression)
+  return(compiledFormulas[key])
+
 """
 Class: predictionTest
 Purpose: This is the base class for our various prediction tests.
@@ -93,6 +196,20 @@ class predictionTest(object):
     self.formula = formula
     self.predictionLevel = predictionLevels.NO_TEST
     self.name = name
+    self.compiledFormula = None
+  
+  """
+  Function: checkVariables
+  Purpose: Makes sure the data has every variable the compiled formula uses, raises a wqDataError naming the
+    missing variables if not.
+  Parameters: 
+    data - the data dictionary the test is going to be run against.
+  """
+  def checkVariables(self, data):
+    missing = self.compiledFormula.missingVariables(data)
+    if(len(missing)):
+      raise wqDataError("Test: %s is missing the variables: %s" % (self.name, ", ".join(missing)))
+      
   """
   Function: runTest
   Purpose: Uses the data parameter to do the string substitutions then evaluate the formula.
@@ -133,6 +250,7 @@ class mlrPredictionTest(predictionTest):
   """
   def __init__(self, formula, name):
     predictionTest.__init__(self, formula, name)
+    self.compiledFormula = getCompiledFormula(formula, True)
     self.lowCategoryLimit = 104.0
     self.highCategoryLimit = 500.0
     self.mlrResult = None
@@ -158,8 +276,8 @@ class mlrPredictionTest(predictionTest):
     The result of evaluating the formula.
   """
   def runTest(self, data):
-    formula = self.formula % (data)
-    self.log10MLRResult = eval(formula)
+    self.checkVariables(data)
+    self.log10MLRResult = self.compiledFormula.run(data)
     self.mlrResult = math.pow(10,self.log10MLRResult)            
     self.mlrCategorize()
     return(self.predictionLevel)
@@ -205,21 +323,21 @@ Purpose: DHEC CART prediction.
 class cartPredictionTest(predictionTest):
   def __init__(self, formula, name):
     predictionTest.__init__(self, formula, name)
+    self.compiledFormula = getCompiledFormula(formula, False)
   
   """
   Function: runTest
   Purpose: Excutes the if/then decision tree code to calculate the CART prediction level. 
     NOTE: Any CART code needs to have a variable named "cartPrediction" which contains the predicted level
-    after the exec function is run on the code.
+    after the compiled code is run.
   Parameter:
     data - A dictionary populated with all the variables needed for the string substitutions.
   Return:
     Prediction level: LOW, MEDIUM, or HIGH.
   """
   def runTest(self, data):
-    decisionTree = self.formula % (data)
-    exec decisionTree
-    self.predictionLevel = cartPrediction                         
+    self.checkVariables(data)
+    self.predictionLevel = self.compiledFormula.run(data)
     return(self.predictionLevel)
 
   def getResults(self):
@@ -743,6 +861,55 @@ class wqEquations(object):
     return(self.ensemblePrediction)
   
 
+"""
+Function: windVectorAverage
+Purpose: Averages wind speed and direction as vectors. The speed and direction series are paired up by time with a
+  merge join, each speed sample is matched with the closest direction sample within the tolerance. The east and
+  north components are averaged with numpy, then turned back into a speed and direction.
+Parameters:
+  spdDates - Epoch times of the speed samples, in ascending order.
+  spdValues - The speed samples.
+  dirDates - Epoch times of the direction samples, in ascending order.
+  dirValues - The direction samples, degrees.
+  tolerance - Number of seconds a speed and direction sample can be apart and still be paired. 0 requires the
+    same time.
+Returns:
+  A tuple setup to contain [0][0] = the vector speed and [0][1] direction average
+    [1][0] - Scalar speed average [1][1] - vector direction average with unity speed used.
+  The entries are None if no samples could be paired.
+"""
+def windVectorAverage(spdDates, spdValues, dirDates, dirValues, tolerance=0):
+  spdDates = numpy.asarray(spdDates, dtype=numpy.int64)
+  spdValues = numpy.asarray(spdValues, dtype=numpy.float64)
+  dirDates = numpy.asarray(dirDates, dtype=numpy.int64)
+  dirValues = numpy.asarray(dirValues, dtype=numpy.float64)
+  if(len(spdDates) == 0 or len(dirDates) == 0):
+    return(((None, None), (None, None)))
+  #For each speed sample, find the direction samples on either side of it and take the closest.
+  rightNdx = numpy.clip(numpy.searchsorted(dirDates, spdDates, side='left'), 0, len(dirDates) - 1)
+  leftNdx = numpy.clip(rightNdx - 1, 0, len(dirDates) - 1)
+  useLeft = numpy.abs(spdDates - dirDates[leftNdx]) < numpy.abs(dirDates[rightNdx] - spdDates)
+  matchNdx = numpy.where(useLeft, leftNdx, rightNdx)
+  paired = numpy.abs(dirDates[matchNdx] - spdDates) <= tolerance
+  if(not paired.any()):
+    return(((None, None), (None, None)))
+
+  speeds = spdValues[paired]
+  dirRadians = numpy.radians(dirValues[matchNdx[paired]])
+  eastUnit = numpy.sin(dirRadians)
+  northUnit = numpy.cos(dirRadians)
+  #Vector with speed as constant(1), and direction.
+  eastCompAvg = eastUnit.mean()
+  northCompAvg = northUnit.mean()
+  vectorDirAvg = math.degrees(math.atan2(eastCompAvg, northCompAvg)) % 360.0
+  scalarSpdAvg = float(spdValues.mean())
+  #Vector using both speed and direction.
+  eastCompAvg = (speeds * eastUnit).mean()
+  northCompAvg = (speeds * northUnit).mean()
+  spdAvg = math.hypot(eastCompAvg, northCompAvg)
+  dirAvg = math.degrees(math.atan2(eastCompAvg, northCompAvg)) % 360.0
+  return(((spdAvg, dirAvg), (scalarSpdAvg, vectorDirAvg)))
+
 """
 Class wqDataAccess
 Purpose: This is the base class for retrieving the data for the tests. This class interfaces
@@ -750,6 +917,9 @@ Purpose: This is the base class for retrieving the data for the tests. This clas
 
 """
 class wqDataAccess(object):
+  #The (obsName, uom, platformHandle) averages and the wind platforms the region's getData uses.
+  obsAverages = []
+  windPlatforms = []
   NO_DATA = -9999.0
   def __init__(self, configFile, obsDb, nexradDb, regionName="", logger=None):
     self.obsDb = obsDb              #The database object connected to the observations database.
@@ -758,6 +928,8 @@ class wqDataAccess(object):
     self.configFile = configFile    #A reference to an xmlConfigFile object.
     self.regionName = regionName    #The region this data object is for.
     self.results = {}               #Dictionary of wqEquation objects keyed on the stations for the test results.
+    self.obsPlanner = None          #If set, an obsDataPlanner with the observation data already fetched.
+    self.tideCache = None           #If set, the tideRangeCache shared by the regions.
   
   """
   Function: getAverageForObs\
@@ -773,6 +945,13 @@ class wqDataAccess(object):
   def getAverageForObs(self, obsName, uom, platformHandle, startDate, endDate):
     avg = -9999
     
+    #If the planner already has the average, use it.
+    if(self.obsPlanner != None):
+      planned,avg = self.obsPlanner.getAverage(obsName, uom, platformHandle, startDate, endDate)
+      if(planned):
+        return(avg)
+      avg = -9999
+
     #Get the sensor ID for the obs we are interested in so we can use it to query the data.
     sensorID = self.obsDb.dbConnection.sensorExists(obsName, uom, platformHandle)
     if(sensorID != None and sensorID != -1):
@@ -781,9 +960,8 @@ class wqDataAccess(object):
         sql = "SELECT AVG(m_value) as m_value_avg  FROM multi_obs\
                WHERE sensor_id = %d AND\
                (m_date >= '%s' AND \
-               m_date < '%s') AND \
-               sensor_id = %d"\
-              %(beginDate, endDate, sensorID)
+               m_date < '%s')"\
+              %(sensorID, startDate, endDate)
       else:
         #DWR 2013-02-04 Added qc_level check.
         sql = "SELECT AVG(m_value) as m_value_avg  FROM multi_obs\
@@ -792,7 +970,7 @@ class wqDataAccess(object):
                m_date < '%s') AND \
                sensor_id = %d AND \
                (qc_level = %d OR qc_level IS NULL)"\
-              %(beginDate, endDate, sensorID, qaqcTestFlags.DATA_QUAL_GOOD)
+              %(startDate, endDate, sensorID, qaqcTestFlags.DATA_QUAL_GOOD)
          
       dbCursor = self.obsDb.executeQuery(sql)
       if(dbCursor != None):
@@ -817,91 +995,86 @@ class wqDataAccess(object):
     platName - String representing the platform name to query
     startDate the date/time to start the average
     endDate the date/time to stop the average
+    tolerance the number of seconds a speed and direction sample can be apart and still be paired.
   Returns:
     A tuple setup to contain [0][0] = the vector speed and [0][1] direction average
       [1][0] - Scalar speed average [1][1] - vector direction average with unity speed used.
   """
-  def calcAvgWindSpeedAndDir(self, platName, startDate, endDate):    
-    windComponents = []
-    dirComponents = []
-    vectObj = vectorMagDir();
-    #Get the wind speed and direction so we can correctly average the data.    
-    #Get the sensor ID for the obs we are interested in so we can use it to query the data.
-    windSpdId = self.obsDb.dbConnection.sensorExists('wind_speed', 'm_s-1', platName)
-    windDirId = self.obsDb.dbConnection.sensorExists('wind_from_direction', 'degrees_true', platName)
-    sql = "SELECT m_date ,m_value FROM multi_obs\
-           WHERE sensor_id = %d AND\
-           (m_date >= '%s' AND \
-           m_date < '%s' ) ORDER BY m_date"\
-          %(windSpdId, startDate, endDate)
-    if(self.logger):
-      self.logger.debug("Wind Speed SQL: %s" % (sql))
-
-    windSpdCursor = self.obsDb.executeQuery(sql)
-    sql = "SELECT m_date ,m_value FROM multi_obs\
-           WHERE sensor_id = %d AND\
-           (m_date >= '%s' AND \
-           m_date < '%s' ) ORDER BY m_date"\
-          %(windDirId, startDate, endDate) 
-    if(self.logger):
-      self.logger.debug("Wind Dir SQL: %s" % (sql))
-    windDirCursor = self.obsDb.executeQuery(sql)
-    scalarSpd = None
-    spdCnt = 0
-    for spdRow in windSpdCursor:
-      if(scalarSpd == None):
-        scalarSpd = 0
-      scalarSpd += spdRow['m_value']
-      spdCnt += 1
-      for dirRow in windDirCursor:
-        if(spdRow['m_date'] == dirRow['m_date']):
-          if(self.logger):
-            self.logger.debug("Calculating vector for Speed(%s): %f Dir(%s): %f" % (spdRow['m_date'], spdRow['m_value'], dirRow['m_date'], dirRow['m_value']))
-          #Vector using both speed and direction.
-          windComponents.append(vectObj.calcVector(spdRow['m_value'], dirRow['m_value']))
-          #VEctor with speed as constant(1), and direction.
-          dirComponents.append(vectObj.calcVector(1, dirRow['m_value']))
-          break
-    #Get our average on the east and north components of the wind vector.
-    spdAvg = None  
-    dirAvg = None
-    scalarSpdAvg = None
-    vectorDirAvg = None
-
-    #If we have the direction only components, this is unity speed with wind direction, calc the averages.
-    if(len(dirComponents)):
-      eastCompAvg = 0
-      northCompAvg = 0
-      scalarSpdAvg = scalarSpd / spdCnt
-      
-      for vectorTuple in dirComponents:
-        eastCompAvg += vectorTuple[0]
-        northCompAvg += vectorTuple[1]
-
-      eastCompAvg = eastCompAvg / len(dirComponents)
-      northCompAvg = northCompAvg / len(dirComponents)
-      spdAvg,vectorDirAvg = vectObj.calcMagAndDir(eastCompAvg, northCompAvg)
+  def calcAvgWindSpeedAndDir(self, platName, startDate, endDate, tolerance=0):    
+    planned = None
+    if(self.obsPlanner != None):
+      planned = self.obsPlanner.getWindRows(platName, startDate, endDate)
+    if(planned != None):
+      windSpdRows = planned[0]
+      windDirRows = planned[1]
+    else:
+      #Get the wind speed and direction so we can correctly average the data.    
+      #Get the sensor ID for the obs we are interested in so we can use it to query the data.
+      windSpdId = self.obsDb.dbConnection.sensorExists('wind_speed', 'm_s-1', platName)
+      windDirId = self.obsDb.dbConnection.sensorExists('wind_from_direction', 'degrees_true', platName)
+      sql = "SELECT m_date ,m_value FROM multi_obs\
+             WHERE sensor_id = %d AND\
+             (m_date >= '%s' AND \
+             m_date < '%s' ) ORDER BY m_date"\
+            %(windSpdId, startDate, endDate)
       if(self.logger):
-        self.logger.debug("Platform: %s Scalar Speed Avg: %f Vector Dir Avg: %f" % (platName,scalarSpdAvg,vectorDirAvg))      
-    
-    #2013-11-21 DWR Add check to verify we have components. Also reset the eastCompAvg and northCompAvg to 0
-    #before doing calcs.  
-    #If we have speed and direction vectors, calc the averages.
-    if(len(windComponents)):
-      eastCompAvg = 0
-      northCompAvg = 0
-      for vectorTuple in windComponents:
-        eastCompAvg += vectorTuple[0]
-        northCompAvg += vectorTuple[1]
-        
-      eastCompAvg = eastCompAvg / len(windComponents)
-      northCompAvg = northCompAvg / len(windComponents)
-      #Calculate average with speed and direction components.
-      spdAvg,dirAvg = vectObj.calcMagAndDir(eastCompAvg, northCompAvg)      
+        self.logger.debug("Wind Speed SQL: %s" % (sql))
+      windSpdRows = self.obsDb.executeQuery(sql)
+
+      sql = "SELECT m_date ,m_value FROM multi_obs\
+             WHERE sensor_id = %d AND\
+             (m_date >= '%s' AND \
+             m_date < '%s' ) ORDER BY m_date"\
+            %(windDirId, startDate, endDate) 
       if(self.logger):
-        self.logger.debug("Platform: %s Vector Speed Avg: %f Vector Dir Avg: %f" % (platName,spdAvg,dirAvg))      
-        
-    return(((spdAvg, dirAvg), (scalarSpdAvg, vectorDirAvg)))
+        self.logger.debug("Wind Dir SQL: %s" % (sql))
+      windDirRows = self.obsDb.executeQuery(sql)
+
+    spdDates = []
+    spdValues = []
+    if(windSpdRows != None):
+      for row in windSpdRows:
+        if(row['m_value'] != None):
+          spdDates.append(dateToEpoch(str(row['m_date'])))
+          spdValues.append(row['m_value'])
+    dirDates = []
+    dirValues = []
+    if(windDirRows != None):
+      for row in windDirRows:
+        if(row['m_value'] != None):
+          dirDates.append(dateToEpoch(str(row['m_date'])))
+          dirValues.append(row['m_value'])
+
+    results = windVectorAverage(spdDates, spdValues, dirDates, dirValues, tolerance)
+    if(self.logger):
+      if(results[1][0] != None):
+        self.logger.debug("Platform: %s Scalar Speed Avg: %f Vector Dir Avg: %f" % (platName,results[1][0],results[1][1]))      
+      if(results[0][0] != None):
+        self.logger.debug("Platform: %s Vector Speed Avg: %f Vector Dir Avg: %f" % (platName,results[0][0],results[0][1]))      
+    return(results)
+
+  """
+  Function: getTideRange
+  Purpose: Gets the tide range for the station, from the tide cache if the region has one, otherwise straight from
+    the NOAA service.
+  Parameters:
+    station - The NOAA station id.
+    beginDate - The first day, YYYYMMDD local time.
+    endDate - The last day, YYYYMMDD local time.
+  Returns:
+    The dictionary from noaaTideData.calcTideRange, keyed on the tide code(HH, LL, etc), None if not available.
+  """
+  def getTideRange(self, station, beginDate, endDate, datum='MLLW', units='feet'):
+    if(self.tideCache != None):
+      return(self.tideCache.getTideRange(station, beginDate, endDate, datum, units))
+    tide = noaaTideData(logger=self.logger)
+    return(tide.calcTideRange(beginDate = beginDate,
+                       endDate = endDate,
+                       station=station,
+                       datum=datum,
+                       units=units,
+                       timezone='Local Time',
+                       smoothData=False))
 
   """
   Function: addTest
@@ -976,6 +1149,21 @@ class wqDataAccess(object):
         return(False)
       #Check to make sure the predictionTstObj actually exists in our namespace.
       if(predictionTstObj in globals()):
+        #Compile the formula now so a bad formula is caught when the config is loaded. The compiled formula is
+        #cached so the station test objects reuse it.
+        try:
+          if(issubclass(globals()[predictionTstObj], mlrPredictionTest)):
+            formula = getCompiledFormula(predictionTestString, True)
+          elif(issubclass(globals()[predictionTstObj], cartPredictionTest)):
+            formula = getCompiledFormula(predictionTestString, False)
+          else:
+            formula = None
+          if(formula != None and self.logger != None):
+            self.logger.debug("%s test: %s uses variables: %s" % (self.regionName, testId, ", ".join(sorted(formula.variables))))
+        except SyntaxError, e:
+          if(self.logger != None):
+            self.logger.error("Test: %s formula for %s does not compile: %s, cannot continue." % (testId, self.regionName, str(e)))
+          return(False)
         testsSetupInfo.append( {'testId' : testId, 
                                 'testString' : predictionTestString, 
                                 'testObject' : predictionTstObj})
@@ -1039,6 +1227,9 @@ class wqDataAccess(object):
      
 
 class wqDataNMB2(wqDataAccess):
+  obsAverages = [('salinity', 'psu', 'carocoops.SUN2.buoy'), ('water_temperature', 'celsius', 'carocoops.SUN2.buoy'), ('water_level', 'm', 'nos.8661070.WL')]
+  windPlatforms = []
+
   def __init__(self, configFile, obsDb, nexradDb, regionName="NMB2", logger=None):
     wqDataAccess.__init__(self,configFile, obsDb, nexradDb, regionName, logger)
       
@@ -1082,18 +1273,11 @@ class wqDataNMB2(wqDataAccess):
     #Get the tide data
     try:
       data['range'] = self.NO_DATA;
-      tide = noaaTideData(logger=self.logger)
       #Date/Time format for the NOAA is YYYYMMDD
       #Times passed in as UTC, we want local tide time, so we convert.
       tideBegin = beginDate.astimezone(timezone('US/Eastern') )
       tideEnd = beginDate.astimezone(timezone('US/Eastern') )
-      tideData = tide.calcTideRange(beginDate = tideBegin.strftime('%Y%m%d'),
-                         endDate = tideEnd.strftime('%Y%m%d'),
-                         station='8661070',
-                         datum='MLLW',
-                         units='feet',
-                         timezone='Local Time',
-                         smoothData=False)
+      tideData = self.getTideRange('8661070', tideBegin.strftime('%Y%m%d'), tideEnd.strftime('%Y%m%d'))
       #2014-04-02 DWR
       #ADded query retry in the noaaTideData object. We no longer throw the WebFault
       #from the request, we retry the query based on the retries param.
@@ -1110,7 +1294,9 @@ class wqDataNMB2(wqDataAccess):
     return(data)
  
 class wqDataNMB3(wqDataAccess):
-  
+  obsAverages = [('salinity', 'psu', 'carocoops.SUN2.buoy')]
+  windPlatforms = []
+
   def __init__(self, configFile, obsDb, nexradDb, regionName="NMB3", logger=None):
     wqDataAccess.__init__(self,configFile, obsDb, nexradDb, regionName, logger)
       
@@ -1138,18 +1324,11 @@ class wqDataNMB3(wqDataAccess):
     #Get the tide data
     try:
       data['range'] = self.NO_DATA;
-      tide = noaaTideData(logger=self.logger)
       #Date/Time format for the NOAA is YYYYMMDD
       #Times passed in as UTC, we want local tide time, so we convert.
       tideBegin = beginDate.astimezone(timezone('US/Eastern') )
       tideEnd = beginDate.astimezone(timezone('US/Eastern') )
-      tideData = tide.calcTideRange(beginDate = tideBegin.strftime('%Y%m%d'),
-                         endDate = tideEnd.strftime('%Y%m%d'),
-                         station='8661070',
-                         datum='MLLW',
-                         units='feet',
-                         timezone='Local Time',
-                         smoothData=False)
+      tideData = self.getTideRange('8661070', tideBegin.strftime('%Y%m%d'), tideEnd.strftime('%Y%m%d'))
       #2014-04-02 DWR
       #ADded query retry in the noaaTideData object. We no longer throw the WebFault
       #from the request, we retry the query based on the retries param.
@@ -1164,7 +1343,9 @@ class wqDataNMB3(wqDataAccess):
     return(data)
 
 class wqDataMB1(wqDataAccess):
-  
+  obsAverages = [('salinity', 'psu', 'carocoops.SUN2.buoy'), ('water_level', 'm', 'nos.8661070.WL')]
+  windPlatforms = []
+
   def __init__(self, configFile, obsDb, nexradDb, regionName="MB1", logger=None):
     wqDataAccess.__init__(self,configFile, obsDb, nexradDb, regionName, logger)
       
@@ -1210,18 +1391,11 @@ class wqDataMB1(wqDataAccess):
 
     try:
       data['lowFt'] = self.NO_DATA
-      tide = noaaTideData(logger=self.logger)
       #Date/Time format for the NOAA is YYYYMMDD
       #Times passed in as UTC, we want local tide time, so we convert.
       tideBegin = beginDate.astimezone(timezone('US/Eastern') )
       tideEnd = beginDate.astimezone(timezone('US/Eastern') )
-      tideData = tide.calcTideRange(beginDate = tideBegin.strftime('%Y%m%d'),
-                         endDate = tideEnd.strftime('%Y%m%d'),
-                         station='8661070',
-                         datum='MLLW',
-                         units='feet',
-                         timezone='Local Time',
-                         smoothData=False)
+      tideData = self.getTideRange('8661070', tideBegin.strftime('%Y%m%d'), tideEnd.strftime('%Y%m%d'))
       #2014-04-02 DWR
       #ADded query retry in the noaaTideData object. We no longer throw the WebFault
       #from the request, we retry the query based on the retries param.
@@ -1237,6 +1411,9 @@ class wqDataMB1(wqDataAccess):
     return(data)
 
 class wqDataMB2(wqDataAccess):
+  obsAverages = [('salinity', 'psu', 'carocoops.SUN2.buoy'), ('water_level', 'm', 'nos.8661070.WL'), ('wind_from_direction', 'degrees_true', 'nos.8661070.WL')]
+  windPlatforms = ['nos.8661070.WL']
+
   def __init__(self, configFile, obsDb, nexradDb, regionName="MB2", logger=None):
     wqDataAccess.__init__(self,configFile, obsDb, nexradDb, regionName, logger)
           
@@ -1300,6 +1477,9 @@ class wqDataMB2(wqDataAccess):
     return(data)
 
 class wqDataMB3(wqDataAccess):
+  obsAverages = [('wind_speed', 'm_s-1', 'carocoops.SUN2.buoy'), ('wind_from_direction', 'degrees_true', 'carocoops.SUN2.buoy'), ('water_level', 'm', 'nos.8661070.WL')]
+  windPlatforms = ['carocoops.SUN2.buoy']
+
   def __init__(self, configFile, obsDb, nexradDb, regionName="MB3", logger=None):
     wqDataAccess.__init__(self,configFile, obsDb, nexradDb, regionName, logger)
       
@@ -1377,6 +1557,9 @@ class wqDataMB3(wqDataAccess):
     return(data)
 
 class wqDataMB4(wqDataAccess):
+  obsAverages = [('water_temperature', 'celsius', 'carocoops.SUN2.buoy'), ('wind_from_direction', 'degrees_true', 'carocoops.SUN2.buoy'), ('salinity', 'psu', 'carocoops.SUN2.buoy'), ('water_level', 'm', 'nos.8661070.WL')]
+  windPlatforms = ['carocoops.SUN2.buoy']
+
   def __init__(self, configFile, obsDb, nexradDb, regionName="MB4", logger=None):
     wqDataAccess.__init__(self,configFile, obsDb, nexradDb, regionName, logger)
       
@@ -1450,18 +1633,11 @@ class wqDataMB4(wqDataAccess):
     try:
       data['range'] = self.NO_DATA
       data['highFt'] = self.NO_DATA
-      tide = noaaTideData(logger=self.logger)
       #Date/Time format for the NOAA is YYYYMMDD
       #Times passed in as UTC, we want local tide time, so we convert.
       tideBegin = beginDate.astimezone(timezone('US/Eastern') )
       tideEnd = beginDate.astimezone(timezone('US/Eastern') )
-      tideData = tide.calcTideRange(beginDate = tideBegin.strftime('%Y%m%d'),
-                         endDate = tideEnd.strftime('%Y%m%d'),
-                         station='8661070',
-                         datum='MLLW',
-                         units='feet',
-                         timezone='Local Time',
-                         smoothData=False)
+      tideData = self.getTideRange('8661070', tideBegin.strftime('%Y%m%d'), tideEnd.strftime('%Y%m%d'))
 
       #2014-04-02 DWR
       #ADded query retry in the noaaTideData object. We no longer throw the WebFault
@@ -1478,6 +1654,9 @@ class wqDataMB4(wqDataAccess):
     return(data)
 
 class wqDataSS(wqDataAccess):
+  obsAverages = [('water_temperature', 'celsius', 'carocoops.SUN2.buoy'), ('salinity', 'psu', 'carocoops.SUN2.buoy'), ('water_temperature', 'celsius', 'nos.8661070.WL')]
+  windPlatforms = []
+
   def __init__(self, configFile, obsDb, nexradDb, regionName="Surfside", logger=None):
     wqDataAccess.__init__(self,configFile, obsDb, nexradDb, regionName, logger)
       
@@ -1532,18 +1711,11 @@ class wqDataSS(wqDataAccess):
     try:
       data['range'] = self.NO_DATA
       data['lowFt'] = self.NO_DATA
-      tide = noaaTideData(logger=self.logger)
       #Date/Time format for the NOAA is YYYYMMDD
       #Times passed in as UTC, we want local tide time, so we convert.
       tideBegin = beginDate.astimezone(timezone('US/Eastern') )
       tideEnd = beginDate.astimezone(timezone('US/Eastern') )
-      tideData = tide.calcTideRange(beginDate = tideBegin.strftime('%Y%m%d'),
-                         endDate = tideEnd.strftime('%Y%m%d'),
-                         station='8661070',
-                         datum='MLLW',
-                         units='feet',
-                         timezone='Local Time',
-                         smoothData=False)
+      tideData = self.getTideRange('8661070', tideBegin.strftime('%Y%m%d'), tideEnd.strftime('%Y%m%d'))
       #2014-04-02 DWR
       #ADded query retry in the noaaTideData object. We no longer throw the WebFault
       #from the request, we retry the query based on the retries param.
@@ -1559,6 +1731,9 @@ class wqDataSS(wqDataAccess):
     return(data)
 
 class wqDataGC(wqDataAccess):
+  obsAverages = [('water_temperature', 'celsius', 'carocoops.SUN2.buoy'), ('salinity', 'psu', 'carocoops.SUN2.buoy'), ('water_level', 'm', 'nos.8661070.WL')]
+  windPlatforms = []
+
   def __init__(self, configFile, obsDb, nexradDb, regionName="Gardcty", logger=None):
     wqDataAccess.__init__(self,configFile, obsDb, nexradDb, regionName, logger)
       
@@ -1613,18 +1788,11 @@ class wqDataGC(wqDataAccess):
     try:
       data['range'] = self.NO_DATA
       data['highFt'] = self.NO_DATA
-      tide = noaaTideData(logger=self.logger)
       #Date/Time format for the NOAA is YYYYMMDD
       #Times passed in as UTC, we want local tide time, so we convert.
       tideBegin = beginDate.astimezone(timezone('US/Eastern') )
       tideEnd = beginDate.astimezone(timezone('US/Eastern') )
-      tideData = tide.calcTideRange(beginDate = tideBegin.strftime('%Y%m%d'),
-                         endDate = tideEnd.strftime('%Y%m%d'),
-                         station='8661070',
-                         datum='MLLW',
-                         units='feet',
-                         timezone='Local Time',
-                         smoothData=False)
+      tideData = self.getTideRange('8661070', tideBegin.strftime('%Y%m%d'), tideEnd.strftime('%Y%m%d'))
       #2014-04-02 DWR
       #ADded query retry in the noaaTideData object. We no longer throw the WebFault
       #from the request, we retry the query based on the retries param.
@@ -1639,6 +1807,156 @@ class wqDataGC(wqDataAccess):
     
     return(data)
 
+"""
+Class: obsDataPlanner
+Purpose: Most of the regions use the same SUN2 and NOS 8661070 observations over the same dates. Instead of each
+  region querying them, the planner gathers the observations every region declares in its obsAverages and
+  windPlatforms, looks up each sensor once, then fetches all the averages with one grouped query and all the wind
+  data with a second query. The regions' getAverageForObs and calcAvgWindSpeedAndDir use the fetched values.
+  Anything the planner doesn't have falls back to the region querying it itself.
+"""
+class obsDataPlanner(object):
+  def __init__(self, obsDb, logger=None):
+    self.obsDb = obsDb              #The database object connected to the observations database.
+    self.logger = logger
+    self.averageRequests = set()    #The (obsName, uom, platformHandle) averages requested.
+    self.windPlatforms = set()      #The platforms the wind averages are requested for.
+    self.startDate = None
+    self.endDate = None
+    self.averages = {}              #Averages keyed on (obsName, uom, platformHandle).
+    self.windRows = {}              #Tuples of the (speed rows, direction rows) keyed on the platform.
+    self.queryCount = 0             #Number of queries run against the observation database.
+
+  """
+  Function: addRegion
+  Purpose: Adds the observations a region's processing class uses.
+  Parameters:
+    testObj - The wqDataAccess derived class.
+  """
+  def addRegion(self, testObj):
+    self.averageRequests.update(testObj.obsAverages)
+    self.windPlatforms.update(testObj.windPlatforms)
+
+  """
+  Function: sensorId
+  Purpose: Looks up the sensor id for an observation.
+  Return:
+    The sensor id, None if the sensor does not exist.
+  """
+  def sensorId(self, obsName, uom, platformHandle):
+    self.queryCount += 1
+    sensorID = self.obsDb.dbConnection.sensorExists(obsName, uom, platformHandle)
+    if(sensorID == None or sensorID == -1):
+      if(self.logger != None):
+        self.logger.error("No sensor ID found for observation: %s(%s) on platform: %s" %(obsName, uom, platformHandle))
+      return(None)
+    return(sensorID)
+
+  """
+  Function: fetch
+  Purpose: Runs the queries for all the requested observations.
+  Parameters:
+    startDate - The date/time to start the averages, YYYY-MM-DDTHH:MM:SS.
+    endDate - The date/time to stop the averages, YYYY-MM-DDTHH:MM:SS.
+  """
+  def fetch(self, startDate, endDate):
+    self.startDate = startDate
+    self.endDate = endDate
+    self.averages = {}
+    self.windRows = {}
+    self.queryCount = 0
+
+    avgSensors = {}
+    for key in self.averageRequests:
+      sensorID = self.sensorId(key[0], key[1], key[2])
+      if(sensorID != None):
+        avgSensors[sensorID] = key
+      else:
+        #Same as getAverageForObs when there is no sensor.
+        self.averages[key] = None
+    if(len(avgSensors)):
+      sensorList = ",".join([str(sensorID) for sensorID in avgSensors])
+      if(self.obsDb.dbConnection.dbType == dbTypes.SQLite):
+        sql = "SELECT sensor_id,AVG(m_value) as m_value_avg FROM multi_obs\
+               WHERE sensor_id IN (%s) AND\
+               (m_date >= '%s' AND \
+               m_date < '%s')\
+               GROUP BY sensor_id"\
+              %(sensorList, startDate, endDate)
+      else:
+        sql = "SELECT sensor_id,AVG(m_value) as m_value_avg FROM multi_obs\
+               WHERE \
+               (m_date >= '%s' AND \
+               m_date < '%s') AND \
+               sensor_id IN (%s) AND \
+               (qc_level = %d OR qc_level IS NULL)\
+               GROUP BY sensor_id"\
+              %(startDate, endDate, sensorList, qaqcTestFlags.DATA_QUAL_GOOD)
+      self.queryCount += 1
+      dbCursor = self.obsDb.executeQuery(sql)
+      if(dbCursor != None):
+        #Sensors without any data in the window don't come back from the query, they get the -9999 default.
+        for sensorID in avgSensors:
+          self.averages[avgSensors[sensorID]] = -9999
+        for row in dbCursor:
+          if(row['m_value_avg'] != None):
+            self.averages[avgSensors[int(row['sensor_id'])]] = float(row['m_value_avg'])
+        dbCursor.close()
+      elif(self.logger != None):
+        self.logger.error("Error retrieving the observation averages. Error: %s" %(self.obsDb.dbConnection.getErrorInfo()))
+
+    windSensors = {}
+    for platName in self.windPlatforms:
+      windSpdId = self.sensorId('wind_speed', 'm_s-1', platName)
+      windDirId = self.sensorId('wind_from_direction', 'degrees_true', platName)
+      if(windSpdId != None and windDirId != None):
+        windSensors[windSpdId] = (platName, 0)
+        windSensors[windDirId] = (platName, 1)
+    if(len(windSensors)):
+      sql = "SELECT sensor_id,m_date,m_value FROM multi_obs\
+             WHERE sensor_id IN (%s) AND\
+             (m_date >= '%s' AND \
+             m_date < '%s' ) ORDER BY sensor_id,m_date"\
+            %(",".join([str(sensorID) for sensorID in windSensors]), startDate, endDate)
+      self.queryCount += 1
+      dbCursor = self.obsDb.executeQuery(sql)
+      if(dbCursor != None):
+        for platName,ndx in windSensors.values():
+          self.windRows[platName] = ([], [])
+        for row in dbCursor:
+          platName,ndx = windSensors[int(row['sensor_id'])]
+          self.windRows[platName][ndx].append({'m_date' : row['m_date'], 'm_value' : row['m_value']})
+        dbCursor.close()
+      elif(self.logger != None):
+        self.logger.error("Error retrieving the wind data. Error: %s" %(self.obsDb.dbConnection.getErrorInfo()))
+
+    if(self.logger != None):
+      self.logger.info("Fetched %d observation averages and %d wind platforms with %d queries."\
+                       %(len(self.averages), len(self.windRows), self.queryCount))
+
+  """
+  Function: getAverage
+  Purpose: Returns the fetched average for an observation.
+  Return:
+    A tuple, the first entry is True if the planner fetched the observation for the dates, the second the average.
+  """
+  def getAverage(self, obsName, uom, platformHandle, startDate, endDate):
+    key = (obsName, uom, platformHandle)
+    if(startDate == self.startDate and endDate == self.endDate and key in self.averages):
+      return(True, self.averages[key])
+    return(False, None)
+
+  """
+  Function: getWindRows
+  Purpose: Returns the fetched wind speed and direction rows for a platform.
+  Return:
+    A tuple of the speed rows and the direction rows ordered by date, None if the planner does not have them.
+  """
+  def getWindRows(self, platName, startDate, endDate):
+    if(startDate == self.startDate and endDate == self.endDate):
+      return(self.windRows.get(platName))
+    return(None)
+
 """
 Class: testSuite
 Purpose: This class runs through the watersheds in the configuration file and runs the prediction tests.
@@ -1651,6 +1969,13 @@ class testSuite(object):
     self.testObjects = []               # A list of wqDataAccess objects. These perform the tests for each watershed area.
     self.varMapping = {}                # If we are outputting the data in the email and KML files, this is a mapping from variable name to 
                                         # a more explanatory display name.
+    self.regionTimes = {}               # Wall time in seconds each region took to process, keyed on the region name.
+    self.workerCount = 1                # Number of regions to process at the same time.
+    self.obsPlanner = None              # The obsDataPlanner with the observation data shared by the regions.
+    self.tideCache = None               # The tideRangeCache shared by the regions.
+    workerCount = self.configFile.getEntry('//environment/stationTesting/regionWorkerCount')
+    if(workerCount != None and len(workerCount)):
+      self.workerCount = max(1, int(workerCount))
   
   def logMsg(self, msgLevel, msg):
     if(self.logger != None):
@@ -1672,18 +1997,11 @@ class testSuite(object):
        
     testRunDate = datetime.datetime.now(timezone('US/Eastern'))
 
-    obsDBSettings = self.configFile.getDatabaseSettingsEx('//environment/stationTesting/database/obsDatabase/')
-    obsDB = dbXenia()
-    #def connect(self, dbFilePath=None, user=None, passwd=None, host=None, dbName=None ):
-    if(obsDB.connect(None, obsDBSettings['dbUser'], obsDBSettings['dbPwd'], obsDBSettings['dbHost'], obsDBSettings['dbName']) != True):
-      self.logger.error("Unable to connect to observation database: %s @ %s" %(obsDBSettings['dbName'], obsDBSettings['dbHost']))
+    obsDB,nexradDB = self.connectDatabases()
+    if(obsDB == None):
       sys.exit(-1)
-    else:
-      self.logger.info("Connected to %s @ %s" %(obsDBSettings['dbName'], obsDBSettings['dbHost']))
-
-    nexradDBSettings = self.configFile.getDatabaseSettingsEx('//environment/stationTesting/database/nexradDatabase/')
-    nexradDB = dhecDB(nexradDBSettings['dbName'],"dhec_testing_logger")
         
+    regions = []
     tag = "//environment/stationTesting/watersheds"
     regionList = self.configFile.getListHead(tag)
     for watershed in self.configFile.getNextInList(regionList):
@@ -1694,16 +2012,30 @@ class testSuite(object):
       #objects.
       if(testObjName in globals()):
         #Retrieve the processing class      
-        testObj = globals()[testObjName]
-        #Now we instantiate the object.
-        wqObj = testObj(configFile=configFile, obsDb=obsDB, nexradDb=nexradDB, logger=logger)
-        wqObj.processData(beginDate, endDate)
-        self.testObjects.append(wqObj)
-        #Store the results in the db
-        self.storeResults(nexradDB, wqObj, endDate.strftime('%Y-%m-%dT%H:%M:%S'), testRunDate.strftime('%Y-%m-%d %H:%M:%S'))
+        regions.append((watershedName, globals()[testObjName]))
       else:
         if(self.logger != None):
           self.logger.error("Region: %s using invalid testObject: %s, cannot process." %(watershedName, testObjName))
+
+    startTime = time.time()
+    #Fetch the observations the regions share once, up front.
+    self.obsPlanner = obsDataPlanner(obsDB, self.logger)
+    for watershedName,testObj in regions:
+      self.obsPlanner.addRegion(testObj)
+    self.obsPlanner.fetch(beginDate.strftime('%Y-%m-%dT%H:%M:%S'), endDate.strftime('%Y-%m-%dT%H:%M:%S'))
+    self.tideCache = self.createTideCache()
+    if(self.workerCount > 1 and len(regions) > 1):
+      wqObjs = self.processRegionsConcurrent(regions, beginDate, endDate)
+    else:
+      wqObjs = [self.processRegion(watershedName, testObj, obsDB, nexradDB, beginDate, endDate) for watershedName,testObj in regions]
+    if(self.logger != None):
+      self.logger.info("Processed %d regions with %d workers in %f seconds." %(len(regions), min(self.workerCount, max(len(regions), 1)), time.time() - startTime))
+
+    #Store the results in the db in the config file order, the same as a sequential run.
+    for wqObj in wqObjs:
+      if(wqObj != None):
+        self.testObjects.append(wqObj)
+        self.storeResults(nexradDB, wqObj, endDate.strftime('%Y-%m-%dT%H:%M:%S'), testRunDate.strftime('%Y-%m-%d %H:%M:%S'))
     
     tag = "//environment/stationTesting/results/outputDataUsed"
     outputData = self.configFile.getEntry(tag)
@@ -1712,11 +2044,152 @@ class testSuite(object):
        
     testBeginDate = beginDate.astimezone(timezone('US/Eastern'))
     testEndDate = endDate.astimezone(timezone('US/Eastern'))
+    if(self.logger != None):
+      self.logger.info("Tide cache hits: %d requests: %d" %(self.tideCache.hitCount, self.tideCache.missCount))
+    self.tideCache.close()
     obsDB.dbConnection.DB.close()
     nexradDB.DB.close()
     self.sendResults(testBeginDate, testEndDate, testRunDate)
 
+  """
+  Function: connectDatabases
+  Purpose: Opens a connection to the observation database and the nexrad database. Each worker processing regions
+    gets its own connections since the connections can't be shared between threads.
+  Return:
+    A tuple of the dbXenia and dhecDB objects, (None,None) if the observation database could not be connected to.
+  """
+  def connectDatabases(self):
+    obsDBSettings = self.configFile.getDatabaseSettingsEx('//environment/stationTesting/database/obsDatabase/')
+    obsDB = dbXenia()
+    #def connect(self, dbFilePath=None, user=None, passwd=None, host=None, dbName=None ):
+    if(obsDB.connect(None, obsDBSettings['dbUser'], obsDBSettings['dbPwd'], obsDBSettings['dbHost'], obsDBSettings['dbName']) != True):
+      self.logger.error("Unable to connect to observation database: %s @ %s" %(obsDBSettings['dbName'], obsDBSettings['dbHost']))
+      return(None,None)
+    else:
+      self.logger.info("Connected to %s @ %s" %(obsDBSettings['dbName'], obsDBSettings['dbHost']))
+
+    nexradDBSettings = self.configFile.getDatabaseSettingsEx('//environment/stationTesting/database/nexradDatabase/')
+    nexradDB = dhecDB(nexradDBSettings['dbName'],"dhec_testing_logger")
+    #Directory of the yearly partitions the old nexrad database rows are rolled over into.
+    archiveDir = self.configFile.getEntry('//environment/stationTesting/database/nexradDatabase/archiveDir')
+    if(archiveDir != None and len(archiveDir)):
+      nexradDB.usePartitions(archiveDir)
+    return(obsDB,nexradDB)
+
+  """
+  Function: createTideCache
+  Purpose: Creates the tide cache the regions share from the stationTesting/tideCache settings. The backend is
+    either noaa, the default, or local to use the daily_tide_range table in the nexrad database.
+  Return:
+    The tideRangeCache object.
+  """
+  def createTideCache(self):
+    cacheFile = self.configFile.getEntry('//environment/stationTesting/tideCache/cacheFile')
+    if(cacheFile != None and len(cacheFile) == 0):
+      cacheFile = None
+    backendType = self.configFile.getEntry('//environment/stationTesting/tideCache/backend')
+    if(backendType == 'local'):
+      nexradDBSettings = self.configFile.getDatabaseSettingsEx('//environment/stationTesting/database/nexradDatabase/')
+      backend = localTideBackend(nexradDBSettings['dbName'], self.logger)
+    else:
+      backend = noaaTideBackend(self.logger)
+    return(tideRangeCache(backend, cacheFile, self.logger))
+
+  """
+  Function: processRegion
+  Purpose: Creates the processing object for a region and runs the tests, timing how long it takes.
+  Parameters:
+    watershedName - The region name from the config file.
+    testObj - The wqDataAccess derived class for the region.
+    obsDB - The dbXenia object to use.
+    nexradDB - The dhecDB object to use.
+    beginDate, endDate - The processing run dates.
+  Return:
+    The processing object.
+  """
+  def processRegion(self, watershedName, testObj, obsDB, nexradDB, beginDate, endDate):
+    startTime = time.time()
+    #Now we instantiate the object.
+    wqObj = testObj(configFile=self.configFile, obsDb=obsDB, nexradDb=nexradDB, logger=self.logger)
+    wqObj.obsPlanner = self.obsPlanner
+    wqObj.tideCache = self.tideCache
+    wqObj.processData(beginDate, endDate)
+    self.regionTimes[watershedName] = time.time() - startTime
+    if(self.logger != None):
+      self.logger.info("Region: %s processed in %f seconds." %(watershedName, self.regionTimes[watershedName]))
+    return(wqObj)
+
+  """
+  Function: processRegionsConcurrent
+  Purpose: Processes the regions with a pool of worker threads. Most of a region's time is spent waiting on the
+    database queries and the tide service, so the regions overlap those waits. Each worker opens its own database
+    connections. If a region's tests exit the run, the workers stop taking regions and the exit is raised once they
+    have finished, the same as a sequential run. If none of the workers could connect to the databases, the run exits.
+  Parameters:
+    regions - List of (watershedName, testObj) tuples.
+    beginDate, endDate - The processing run dates.
+  Return:
+    List of the processing objects in the same order as regions. If a region failed, its entry is None.
+  """
+  def processRegionsConcurrent(self, regions, beginDate, endDate):
+    wqObjs = [None] * len(regions)
+    workQueue = Queue.Queue()
+    for ndx in range(len(regions)):
+      workQueue.put(ndx)
+    #SystemExits raised in the workers, the first is raised again once all the workers have stopped.
+    exits = []
+
+    def worker():
+      obsDB,nexradDB = self.connectDatabases()
+      if(obsDB == None):
+        if(self.logger != None):
+          self.logger.error("%s unable to connect to the databases, not processing any regions." % (threading.currentThread().getName()))
+        return
+      try:
+        while len(exits) == 0:
+          try:
+            ndx = workQueue.get_nowait()
+          except Queue.Empty:
+            break
+          watershedName,testObj = regions[ndx]
+          try:
+            wqObjs[ndx] = self.processRegion(watershedName, testObj, obsDB, nexradDB, beginDate, endDate)
+          #wqDataAccess.runTests exits when a station's tests fail, which would only end this thread.
+          except SystemExit, e:
+            if(self.logger != None):
+              self.logger.error("Region: %s exited the run." % (watershedName))
+            exits.append(e)
+          except Exception, e:
+            if(self.logger != None):
+              self.logger.exception(e)
+      finally:
+        obsDB.dbConnection.DB.close()
+        nexradDB.DB.close()
+
+    workers = []
+    for i in range(min(self.workerCount, len(regions))):
+      thread = threading.Thread(target=worker, name="regionWorker%d" % (i))
+      thread.start()
+      workers.append(thread)
+    for thread in workers:
+      thread.join()
+    unprocessed = []
+    while True:
+      try:
+        unprocessed.append(regions[workQueue.get_nowait()][0])
+      except Queue.Empty:
+        break
+    if(len(unprocessed) and self.logger != None):
+      self.logger.error("Regions not processed: %s" % (", ".join(unprocessed)))
+    if(len(exits)):
+      raise exits[0]
+    if(len(unprocessed)):
+      sys.exit(-1)
+    return(wqObjs)
+
   def storeResults(self, dbObj, wqObj, endDate, testRunDate):    
+    #The results for all the stations are written as one batch.
+    measurements = []
     for station in wqObj.results:      
       if(self.logger != None):
         self.logger.info("Storing %s results to database." %(station))
@@ -1725,28 +2198,7 @@ class testSuite(object):
       if(platformCursor != None):
         nfo = platformCursor.fetchone()
         if(nfo != None):                  
-          #Check to see if the result type exists as a sensor on the platform, if not add it.
-          sensorId = dbObj.addSensor('overall_result', 'units', platformHandle, 1, 0, 1, None, True)        
-          if(sensorId != None and sensorId != -1):
-            mVals = []
-            mVals.append(wqObj.results[station].ensemblePrediction)            
-            if(dbObj.addMeasurement('overall_result', 'units',
-                                               platformHandle,
-                                               endDate,
-                                               nfo['fixed_latitude'], nfo['fixed_longitude'],
-                                               0,
-                                               mVals,
-                                               1,
-                                               False,
-                                               testRunDate) != True):
-              if(self.logger != None):
-                self.logger.error("Unable to add overall_result to database. %s" % (dbObj.getErrorInfo()))
-            else:
-              self.logger.debug("Added overall_result: %d to database." % (wqObj.results[station].ensemblePrediction))
-          else:
-            if(self.logger != None):
-                self.logger.error("Unable to find or add sensor id for platform: %s obs: overall_result(units). %s"\
-                                   % (platformHandle, dbObj.getErrorInfo()))
+          results = [('overall_result', wqObj.results[station].ensemblePrediction)]
           #Now loop through the tests and add the results to the database.
           for testObj in wqObj.results[station].tests:
             obsName = None
@@ -1754,31 +2206,23 @@ class testSuite(object):
               obsName = 'mlr_result'
             elif(testObj.name == 'dhecCART'):
               obsName = 'cart_result'
-                
+            results.append((obsName, testObj.predictionLevel))
+          for obsName,value in results:
             #Check to see if the result type exists as a sensor on the platform, if not add it.
             sensorId = dbObj.addSensor(obsName, 'units', platformHandle, 1, 0, 1, None, True)        
             if(sensorId != None and sensorId != -1):
-              del mVals[:]
-              mVals.append(testObj.predictionLevel)            
-              if(dbObj.addMeasurement(obsName, 'units',
-                                                 platformHandle,
-                                                 endDate,
-                                                 nfo['fixed_latitude'], nfo['fixed_longitude'],
-                                                 0,
-                                                 mVals,
-                                                 1,
-                                                 False,
-                                                 testRunDate) != True):
-                if(self.logger != None):
-                  self.logger.error("Unable to add %s to database. %s" % (obsName, dbObj.getErrorInfo()))
-              else:
-                self.logger.debug("Added %s: %d to database." % (obsName, testObj.predictionLevel))
+              measurements.append((obsName, 'units', platformHandle, endDate,
+                                   nfo['fixed_latitude'], nfo['fixed_longitude'], 0, [value], 1))
             else:
               if(self.logger != None):
                   self.logger.error("Unable to find or add sensor id for platform: %s obs: %s(units). %s"\
                                      % (platformHandle, obsName, dbObj.getErrorInfo()))
                 
-    dbObj.commit()
+    if(dbObj.addMeasurements(measurements, rowEntryDate=testRunDate) == -1):
+      if(self.logger != None):
+        self.logger.error("Unable to add the results to database.")
+    elif(self.logger != None):
+      self.logger.debug("Added %d of %d results to database." % (dbObj.lastBatchStats['written'], len(measurements)))
     return
 
   def sendResults(self, testBeginDate, testEndDate, testRunDate):
@@ -8,18 +8,158 @@ Date: 2011-06-23
 Function: getLastNHoursSummaryFromRadarPrecip
 Changes: Now we are adding the weighted averages even for values of 0 into the database. Had to rework
 this function to calculate the preceeding dry days.
+
+Functions: getRainGaugeStats, createXMRGStatsForDates
+Changes: Added to compute the rain gauge and radar window sums, intensity and dry day counts from a single
+load of each series using precipStats.precipSeries. writeSummaryForStation and createXMRGStats now use them
+instead of issuing a query per window. writeSummaryForStation was writing the 2 day radar delay into the
+3 day delay column, fixed.
 """
 import os
 import sys
 import time
+import calendar
 import datetime
 #from datetime import tzinfo
 #from pytz import timezone
 import logging
+import numpy
 #import logging.handlers
 from pysqlite2 import dbapi2 as sqlite3
 from xeniatools.xenia import xeniaSQLite
-from xeniatools.astronomicalCalcs import moon
+from xmrgFile import radarCellWeights, radarHourManifest
+from precipStats import precipSeries, dateToEpoch
+from moonIllumination import dayNumber, illuminatedFraction, fillMoonPhaseTable
+from obsPartitions import yearPartitions, partitionFileName, sensorMetadataSQL
+
+"""
+Class: metadataCursor
+Purpose: Stands in for the cursor xeniaSQLite.getPlatformInfo returns when the rows come from the metadata cache.
+"""
+class metadataCursor(object):
+  def __init__(self, rows):
+    self.rows = rows
+    self.ndx = 0
+
+  def fetchone(self):
+    if(self.ndx < len(self.rows)):
+      self.ndx += 1
+      return(self.rows[self.ndx - 1])
+    return(None)
+
+  def fetchall(self):
+    rows = self.rows[self.ndx:]
+    self.ndx = len(self.rows)
+    return(rows)
+
+  def __iter__(self):
+    return(iter(self.fetchall()))
+
+  def close(self):
+    return
+
+"""
+Class: tideLevelIndex
+Purpose: Holds the daily_tide_range highs and lows for a tide station in sorted arrays. Each pair of consecutive
+ highs/lows is an interval, and the interval a date falls in is found with a binary search, so the tide stage for
+ any number of dates is worked out without going back to the database.
+"""
+class tideLevelIndex(object):
+  def __init__(self, tideStationID, logger=None):
+    self.tideStationID = tideStationID
+    self.logger = logger
+    self.epochs = numpy.array([], dtype=numpy.int64)        #The dates as seconds, used to find the interval.
+    self.localEpochs = numpy.array([], dtype=numpy.int64)   #The dates as local time seconds, used for the stage.
+    self.levels = numpy.array([], dtype=numpy.float64)
+
+  """
+  Function: loadFromDB
+  Purpose: Loads the station's tide points from the daily_tide_range table with a single query.
+  Parameters:
+    dbConnection is the sqlite connection to query.
+  Return: True if the data was loaded, otherwise False.
+  """
+  def loadFromDB(self, dbConnection):
+    sql = "SELECT date,level FROM daily_tide_range WHERE station_id = ? ORDER BY date ASC"
+    try:
+      dbCursor = dbConnection.cursor()
+      dbCursor.execute(sql, (self.tideStationID,))
+      epochs = []
+      localEpochs = []
+      levels = []
+      for row in dbCursor:
+        timeTuple = time.strptime(row[0], '%Y-%m-%dT%H:%M:%S')
+        epochs.append(calendar.timegm(timeTuple))
+        localEpochs.append(int(time.mktime(timeTuple)))
+        levels.append(float(row[1]))
+      dbCursor.close()
+      self.epochs = numpy.array(epochs, dtype=numpy.int64)
+      self.localEpochs = numpy.array(localEpochs, dtype=numpy.int64)
+      self.levels = numpy.array(levels, dtype=numpy.float64)
+      return(True)
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      else:
+        print("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+    return(False)
+
+  """
+  Function: getTideLevels
+  Purpose: Calculates the tide stage for each date, the same way the getTideLevel query used to. The stage is
+   2000 for a flood tide or 4000 for an ebb tide, plus 0, 100, 200 or 300 for the quarter of the interval between
+   the high and low the date falls in. The high and low must both be within 12 hours of the date.
+  Parameters:
+    dates is a list of the dates, YYYY-MM-DDTHH:MM:SS.
+  Return: A list of the tide stages, -9999 where there is no interval for the date.
+  """
+  def getTideLevels(self, dates):
+    tideLevels = [-9999] * len(dates)
+    if(len(dates) == 0 or len(self.epochs) < 2):
+      return(tideLevels)
+    timeTuples = [time.strptime(date, '%Y-%m-%dT%H:%M:%S') for date in dates]
+    anchors = numpy.array([calendar.timegm(timeTuple) for timeTuple in timeTuples], dtype=numpy.int64)
+    localAnchors = numpy.array([int(time.mktime(timeTuple)) for timeTuple in timeTuples], dtype=numpy.int64)
+    prevNdx = numpy.searchsorted(self.epochs, anchors, side='right') - 1
+    valid = (prevNdx >= 0) & (prevNdx < len(self.epochs) - 1)
+    prevNdx = numpy.clip(prevNdx, 0, len(self.epochs) - 2)
+    curNdx = prevNdx + 1
+    halfDay = 12 * 3600
+    valid &= (self.epochs[prevNdx] >= anchors - halfDay) & (self.epochs[curNdx] < anchors + halfDay)
+    #Flood if the tide is rising, ebb if it is falling.
+    tideStates = numpy.where(self.levels[prevNdx] < self.levels[curNdx], 2000, 4000)
+    #Which quarter of the time between the 2 tide changes the date falls in.
+    prevTimes = self.localEpochs[prevNdx]
+    totalTimes = self.localEpochs[curNdx] - prevTimes
+    quarters = ((localAnchors - prevTimes) * 4) // numpy.maximum(totalTimes, 1)
+    valid &= (localAnchors >= prevTimes) & (quarters >= 0) & (quarters < 4)
+    for i in numpy.flatnonzero(valid):
+      tideLevels[i] = int(tideStates[i] + quarters[i] * 100)
+    return(tideLevels)
+
+  """
+  Function: getDailyHighLows
+  Purpose: For each date, finds the highest and lowest tide levels on its day. These are the highest high and lowest
+   low the tests take the day's tide range from.
+  Parameters:
+    dates is a list of the dates, YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS, local time.
+  Return: A tuple of the lists of the highs and the lows, -9999 where the day doesn't have a high and a low.
+  """
+  def getDailyHighLows(self, dates):
+    secondsInDay = 24 * 60 * 60
+    highs = [-9999] * len(dates)
+    lows = [-9999] * len(dates)
+    if(len(dates) == 0 or len(self.epochs) < 2):
+      return(highs, lows)
+    dayStarts = numpy.array([calendar.timegm(time.strptime(date[0:10], '%Y-%m-%d')) for date in dates], dtype=numpy.int64)
+    startNdx = numpy.searchsorted(self.epochs, dayStarts, side='left')
+    endNdx = numpy.searchsorted(self.epochs, dayStarts + secondsInDay, side='left')
+    for i in numpy.flatnonzero((endNdx - startNdx) >= 2):
+      dayLevels = self.levels[startNdx[i]:endNdx[i]]
+      if(dayLevels.max() > dayLevels.min()):
+        highs[i] = float(dayLevels.max())
+        lows[i] = float(dayLevels.min())
+    return(highs, lows)
 
 """
 Class: dhecDB
@@ -41,6 +181,16 @@ class dhecDB(xeniaSQLite):
     self.totalRowsProcd = 0
     self.rowErrorCnt = 0
     self.lastErrorMsg = None
+    self.clearMetadataCache()
+    self.dryDayIndexReady = False
+    self.fileCheckpointReady = False
+    self.rolloverTableReady = False
+    self.tideIndexes = {}         #tideLevelIndex objects keyed on the tide station id.
+    self.moonPhases = None        #moon_phase values indexed by day number - moonPhaseStart, loaded on first use.
+    self.moonPhaseStart = 0
+    self.measurementConflictPolicy = 'ignore'  #What addMeasurements does with rows already in multi_obs.
+    self.lastBatchStats = None
+    self.partitions = None        #yearPartitions object for the archived multi_obs rows, see usePartitions.
     if(xeniaSQLite.connect(self, dbName) == False):
       if(self.logger != None):
         self.logger.error(self.lastErrorMsg)
@@ -48,6 +198,196 @@ class dhecDB(xeniaSQLite):
   def __del__(self):
     self.DB.close()
   
+  """
+  Function: clearMetadataCache
+  Purpose: Empties the platform, sensor and m_type id caches and resets the hit/miss counters.
+  Parameters: None
+  Return: None
+  """
+  def clearMetadataCache(self):
+    self.platformCache = {}       #Platform rows keyed on the platform handle.
+    self.sensorCache = {}         #Sensor ids keyed on (obsName, uom, platformHandle, sOrder).
+    self.mTypeCache = {}          #m_type ids keyed on (obsName, uom, platformHandle, sOrder).
+    self.numTypesCache = {}       #m_type num_types keyed on the m_type id.
+    self.metadataCacheHits = 0
+    self.metadataCacheMisses = 0
+
+  """
+  Function: getMetadataCacheStats
+  Purpose: Returns the metadata cache counters.
+  Return: A dictionary with the hits, misses and the number of platforms, sensors and m_types cached.
+  """
+  def getMetadataCacheStats(self):
+    return({'hits' : self.metadataCacheHits,
+            'misses' : self.metadataCacheMisses,
+            'platforms' : len(self.platformCache),
+            'sensors' : len(self.sensorCache),
+            'mTypes' : len(self.mTypeCache)})
+
+  """
+  Function: getPlatformInfo
+  Purpose: Cached version of xeniaSQLite.getPlatformInfo. The platform row is only queried the first time it is
+   asked for.
+  Parameters:
+    platformHandle is the platform to look up.
+  Return: A cursor like object to fetch the platform row from, None if there was an error.
+  """
+  def getPlatformInfo(self, platformHandle):
+    if(platformHandle in self.platformCache):
+      self.metadataCacheHits += 1
+      return(metadataCursor(self.platformCache[platformHandle]))
+    self.metadataCacheMisses += 1
+    dbCursor = xeniaSQLite.getPlatformInfo(self, platformHandle)
+    if(dbCursor == None):
+      return(None)
+    rows = dbCursor.fetchall()
+    dbCursor.close()
+    #Only cache platforms that exist, so one added later by another connection is still found.
+    if(len(rows)):
+      self.platformCache[platformHandle] = rows
+    return(metadataCursor(rows))
+
+  """
+  Function: sensorExists
+  Purpose: Cached version of xeniaSQLite.sensorExists.
+  Return: The sensor id, -1 if the sensor does not exist, None if there was an error.
+  """
+  def sensorExists(self, obsName, uom, platformHandle, sOrder=1):
+    key = (obsName, uom, platformHandle, sOrder)
+    if(key in self.sensorCache):
+      self.metadataCacheHits += 1
+      return(self.sensorCache[key])
+    self.metadataCacheMisses += 1
+    sensorID = xeniaSQLite.sensorExists(self, obsName, uom, platformHandle, sOrder)
+    if(sensorID != None and sensorID != -1):
+      self.sensorCache[key] = sensorID
+    return(sensorID)
+
+  """
+  Function: getMTypeFromObsName
+  Purpose: Cached version of xeniaSQLite.getMTypeFromObsName.
+  Return: The m_type id, None if not found.
+  """
+  def getMTypeFromObsName(self, obsName, uom, platformHandle, sOrder=1):
+    key = (obsName, uom, platformHandle, sOrder)
+    if(key in self.mTypeCache):
+      self.metadataCacheHits += 1
+      return(self.mTypeCache[key])
+    self.metadataCacheMisses += 1
+    mTypeID = xeniaSQLite.getMTypeFromObsName(self, obsName, uom, platformHandle, sOrder)
+    if(mTypeID != None and mTypeID != -1):
+      self.mTypeCache[key] = mTypeID
+    return(mTypeID)
+
+  """
+  Function: addPlatform
+  Purpose: Adds the platform, then drops it from the metadata cache so the new row is read back.
+  """
+  def addPlatform(self, platformInfo, *args):
+    id = xeniaSQLite.addPlatform(self, platformInfo, *args)
+    if('platform_handle' in platformInfo):
+      self.platformCache.pop(platformInfo['platform_handle'], None)
+    return(id)
+
+  """
+  Function: addSensor
+  Purpose: Adds the sensor if it isn't already in the database. When a sensor is added, the platform's sensors and
+   m_types are dropped from the metadata cache so the new rows are read back.
+  """
+  def addSensor(self, obsName, uom, platformHandle, *args):
+    #The positional arguments after the platform handle are active, fixedZ, sOrder, ...
+    sOrder = 1
+    if(len(args) > 2):
+      sOrder = args[2]
+    sensorID = self.sensorExists(obsName, uom, platformHandle, sOrder)
+    if(sensorID != None and sensorID != -1):
+      return(sensorID)
+    sensorID = xeniaSQLite.addSensor(self, obsName, uom, platformHandle, *args)
+    for cache in (self.sensorCache, self.mTypeCache):
+      for key in cache.keys():
+        if(key[2] == platformHandle):
+          del cache[key]
+    return(sensorID)
+
+  """
+  Function: addMeasurements
+  Purpose: Batched version of xeniaSQLite.addMeasurement. The m_type and sensor ids are looked up once for each
+   observation in the batch and all the rows are inserted with one executemany in a single transaction.
+  Parameters:
+    measurements is a list of tuples: (obsName, uom, platformHandle, date, lat, lon, z, mValues, sOrder). mValues
+      is a list of up to 8 values for the m_value through m_value_8 columns.
+    conflictPolicy is what to do when a row already exists for the m_date, m_type_id and sensor_id:
+      'ignore' keeps the existing row, 'replace' overwrites it and 'abort' rolls back the whole batch. If None,
+      self.measurementConflictPolicy is used. Rows for sensors that don't exist are skipped and logged.
+    rowEntryDate is the row_entry_date for the rows, if None the current time is used.
+  Return: The number of rows written, -1 if the batch failed and nothing was written. The row counts, elapsed
+    seconds and rows/sec are saved in self.lastBatchStats.
+  """
+  def addMeasurements(self, measurements, conflictPolicy=None, rowEntryDate=None):
+    startTime = time.time()
+    if(conflictPolicy == None):
+      conflictPolicy = self.measurementConflictPolicy
+    if(rowEntryDate == None):
+      rowEntryDate = time.strftime('%Y-%m-%dT%H:%M:%S')
+    ids = {}
+    rows = []
+    valueCnt = 1
+    skippedCnt = 0
+    for obsName,uom,platformHandle,date,lat,lon,z,mValues,sOrder in measurements:
+      key = (obsName, uom, platformHandle, sOrder)
+      if(key not in ids):
+        mTypeID = self.getMTypeFromObsName(obsName, uom, platformHandle, sOrder)
+        sensorID = self.sensorExists(obsName, uom, platformHandle, sOrder)
+        if(mTypeID == None or mTypeID == -1 or sensorID == None or sensorID == -1):
+          if(self.logger != None):
+            self.logger.error("No m_type_id or sensor_id for: %s(%s) sOrder: %d on platform: %s, skipping its measurements."\
+                              % (obsName, uom, sOrder, platformHandle))
+          ids[key] = None
+        else:
+          ids[key] = (mTypeID, sensorID)
+      if(ids[key] == None):
+        skippedCnt += 1
+        continue
+      mTypeID,sensorID = ids[key]
+      valueCnt = max(valueCnt, len(mValues))
+      rows.append((rowEntryDate, platformHandle, sensorID, mTypeID, date, lon, lat, z) + tuple(mValues))
+
+    valueCols = ['m_value'] + ['m_value_%d' % (i) for i in range(2, valueCnt + 1)]
+    #Every row needs the same number of columns for executemany, missing values are NULL.
+    rows = [row + (None,) * (8 + valueCnt - len(row)) for row in rows]
+    verb = {'ignore' : 'INSERT OR IGNORE', 'replace' : 'INSERT OR REPLACE', 'abort' : 'INSERT'}[conflictPolicy]
+    sql = "%s INTO multi_obs (row_entry_date,platform_handle,sensor_id,m_type_id,m_date,m_lon,m_lat,m_z,%s)\
+           VALUES(%s)" % (verb, ",".join(valueCols), ",".join(["?"] * (8 + valueCnt)))
+    writtenCnt = 0
+    try:
+      if(len(rows)):
+        dbCursor = self.DB.cursor()
+        dbCursor.executemany(sql, rows)
+        writtenCnt = dbCursor.rowcount
+        dbCursor.close()
+        self.DB.commit()
+    except sqlite3.Error, e:
+      self.DB.rollback()
+      self.rowErrorCnt += len(measurements)
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      else:
+        print("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      return(-1)
+    elapsed = time.time() - startTime
+    self.totalRowsProcd += len(measurements)
+    self.rowErrorCnt += skippedCnt
+    self.lastBatchStats = {'rows' : len(measurements),
+                           'written' : writtenCnt,
+                           'ignored' : len(rows) - writtenCnt,
+                           'skipped' : skippedCnt,
+                           'seconds' : elapsed,
+                           'rowsPerSec' : (len(measurements) / elapsed) if elapsed > 0 else float(len(measurements))}
+    if(self.logger != None):
+      self.logger.debug("Wrote %d of %d measurements, %d ignored(%s), %d skipped, %.1f rows/sec."\
+                        % (writtenCnt, len(measurements), len(rows) - writtenCnt, conflictPolicy, skippedCnt, self.lastBatchStats['rowsPerSec']))
+    return(writtenCnt)
+  
   
   """
   Function: vacuumDB
@@ -85,68 +425,17 @@ class dhecDB(xeniaSQLite):
   Return: True if successful otherwise false. 
   """
   def writePrecip(self, dateTime, rain_gauge, batt_voltage, program_code, rainfall, wind=None, windDir=None):
-    
-    #Get the platform info so we can get the lat/long for the sensor.
-    platformHandle = "dhec.%s.raingauge" % (rain_gauge)
-    platformCursor = xeniaSQLite.getPlatformInfo(self, platformHandle)
-    if(platformCursor != None):
-      nfo = platformCursor.fetchone()
-      if(nfo != None):
-        mVals = []
-        mVals.append(rainfall)
-        mVals.append(batt_voltage)
-        mVals.append(program_code)                                 
-        if(xeniaSQLite.addMeasurement(self,
-                                   'precipitation', 'in',
-                                   platformHandle,
-                                   dateTime,
-                                   nfo['fixed_latitude'], nfo['fixed_longitude'],
-                                   0,
-                                   mVals,
-                                   1,
-                                   False) != True):
-          self.logger.error( "%s"\
-                             %(self.getErrorInfo()) )
-          xeniaSQLite.clearErrorInfo(self)
-          return(False)
-        
-        if(wind != None):
-          mVals = []
-          mVals.append(wind)
-          if(xeniaSQLite.addMeasurement(self,
-                                     'wind_speed', 'mph',
-                                     platformHandle,
-                                     dateTime,
-                                     nfo['fixed_latitude'], nfo['fixed_longitude'],
-                                     0,
-                                     mVals,
-                                     1,
-                                     False) != True):           
-            self.logger.error( "%s"\
-                             %(self.getErrorInfo()) )
-            xeniaSQLite.clearErrorInfo(self)
-            return(False)
-        if(windDir != None):    
-          mVals.append(windDir)
-          if(xeniaSQLite.addMeasurement(self,
-                                     'wind_from_direction', 'degrees_true',
-                                     platformHandle,
-                                     dateTime,
-                                     nfo['fixed_latitude'], nfo['fixed_longitude'],
-                                     0,
-                                     mVals,
-                                     1,
-                                     False) != True):
-            self.logger.error( "%s"\
-                             %(self.getErrorInfo()) )
-            xeniaSQLite.clearErrorInfo(self)
-            return(False)
-      else:
-        self.logger.error( "Platform: %s not found. Cannot add measurement." %(platformHandle) )
-    else:
-      self.logger.error( "%s" %(self.getErrorInfo()) )
-      
-    return(True)  
+    gaugeData = {'ID' : [1],
+                 'dateTime' : [dateTime],
+                 'batteryVoltage' : [batt_voltage],
+                 'programCode' : [program_code],
+                 'rainfall' : [rainfall],
+                 'windSpeed' : None,
+                 'windDir' : None}
+    if(wind != None or windDir != None):
+      gaugeData['windSpeed'] = [wind]
+      gaugeData['windDir'] = [windDir]
+    return(self.writeRainGaugeData(rain_gauge, gaugeData) == 0)
   """
   Function: write24HourSummary
   Purpose: Writes an entry into the precip_daily_summary table. This is the days summary for the rain gauge.
@@ -157,27 +446,63 @@ class dhecDB(xeniaSQLite):
   Return: True if successful otherwise false. 
   """
   def write24HourSummary(self, dateTime, rain_gauge, rainfall):
+    gaugeData = {'ID' : [2],
+                 'dateTime' : [dateTime],
+                 'rainfall' : [rainfall]}
+    return(self.writeRainGaugeData(rain_gauge, gaugeData) == 0)
+
+  """
+  Function: writeRainGaugeData
+  Purpose: Writes the 10 minute samples and the 24 hour summaries for a rain gauge into multi_obs as one batch.
+   The dry day index is updated for the new summaries.
+  Parameters:
+    rain_gauge is the name of the rain gauge the entries are for.
+    gaugeData is a dictionary of lists or arrays, the columns readRainGaugeData.readColumns returns. The rows with
+     an odd ID are the 10 minute samples, the even ones the 24 hour summaries. windSpeed and windDir can be None,
+     as can any of their values.
+  Return: The number of rows that were not written, -1 if the batch failed.
+  """
+  def writeRainGaugeData(self, rain_gauge, gaugeData):
     #Get the platform info so we can get the lat/long for the sensor.
     platformHandle = "dhec.%s.raingauge" % (rain_gauge)
-    platformCursor = xeniaSQLite.getPlatformInfo(self, platformHandle)
-    if(platformCursor != None):
-      nfo = platformCursor.fetchone()
-      if(nfo != None):
-        mVals = []
-        mVals.append(rainfall)
-        if(xeniaSQLite.addMeasurement(self,
-                                   'precipitation_accumulated_daily', 'in',
-                                   platformHandle,
-                                   dateTime,
-                                   nfo['fixed_latitude'], nfo['fixed_longitude'],
-                                   0,
-                                   mVals,
-                                   1,
-                                   True) != True):
-          self.logger.error( "%s Function: %s Line: %s File: %s"\
-                           %(self.lastErrorMsg,self.lastErrorFunc, self.lastErrorLineNo, self.lastErrorFile) )
-          xeniaSQLite.clearErrorInfo(self)
-          return(False)
+    platformCursor = self.getPlatformInfo(platformHandle)
+    if(platformCursor == None):
+      self.logger.error( "%s" %(self.getErrorInfo()) )
+      xeniaSQLite.clearErrorInfo(self)
+      return(-1)
+    nfo = platformCursor.fetchone()
+    if(nfo == None):
+      self.logger.error( "Platform: %s not found. Cannot add measurement." %(platformHandle) )
+      return(-1)
+    lat = nfo['fixed_latitude']
+    lon = nfo['fixed_longitude']
+    measurements = []
+    summaries = []
+    windSpeed = gaugeData.get('windSpeed')
+    windDir = gaugeData.get('windDir')
+    for i in range(len(gaugeData['ID'])):
+      dateTime = gaugeData['dateTime'][i]
+      #The idea behind this is that there are 2 ID types in the data. One with a signature of xx1 is a normal
+      #10 minute interval sample, one with an xx2 signature is the 24 hour summary.
+      if(gaugeData['ID'][i] & 1):
+        measurements.append(('precipitation', 'in', platformHandle, dateTime, lat, lon, 0,
+                             [gaugeData['rainfall'][i], gaugeData['batteryVoltage'][i], gaugeData['programCode'][i]], 1))
+        if(windSpeed != None and windSpeed[i] != None):
+          measurements.append(('wind_speed', 'mph', platformHandle, dateTime, lat, lon, 0, [windSpeed[i]], 1))
+        if(windDir != None and windDir[i] != None):
+          measurements.append(('wind_from_direction', 'degrees_true', platformHandle, dateTime, lat, lon, 0, [windDir[i]], 1))
+      else:
+        measurements.append(('precipitation_accumulated_daily', 'in', platformHandle, dateTime, lat, lon, 0,
+                             [gaugeData['rainfall'][i]], 1))
+        summaries.append((dateTime, gaugeData['rainfall'][i]))
+
+    writtenCnt = self.addMeasurements(measurements)
+    if(writtenCnt == -1):
+      return(-1)
+    #Keep the dry day run lengths up to date with the new summaries.
+    if(len(summaries)):
+      self.updateDryDayIndex(platformHandle, summaries)
+    return(self.lastBatchStats['skipped'])
 
     
   """
@@ -219,6 +544,63 @@ class dhecDB(xeniaSQLite):
       sys.exit(- 1)
     return(dateList)
   """
+  Function: loadMoonPhases
+  Purpose: Loads the moon_phase table into an array indexed by day number so the illumination lookups don't need
+   a query each.
+  Return: True if the table was loaded, otherwise False.
+  """
+  def loadMoonPhases(self):
+    self.moonPhaseStart = 0
+    self.moonPhases = numpy.array([], dtype=numpy.float64)
+    sql = "SELECT date,phase FROM moon_phase WHERE phase IS NOT NULL"
+    try:
+      dbCursor = self.DB.cursor()
+      dbCursor.execute(sql)
+      days = []
+      phases = []
+      for row in dbCursor:
+        days.append(dayNumber(row[0]))
+        phases.append(float(row[1]))
+      dbCursor.close()
+    except sqlite3.Error, e:
+      self.rowErrorCnt += 1
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      else:
+        print("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      return(False)
+    if(len(days)):
+      days = numpy.array(days, dtype=numpy.int64)
+      self.moonPhaseStart = days.min()
+      #Days missing from the table are NaN.
+      self.moonPhases = numpy.empty(days.max() - self.moonPhaseStart + 1, dtype=numpy.float64)
+      self.moonPhases.fill(numpy.nan)
+      self.moonPhases[days - self.moonPhaseStart] = phases
+    return(True)
+
+  """
+  Function: getMoonIlluminationForDates
+  Purpose: For each day, return the moon illumination(percentage of moon visible). The values come from the
+   moon_phase table, which is loaded once, and days not in the table are calculated with moonIllumination.
+  Parameters:
+    dates is a list of the days of interest, YYYY-MM-DD. A time after the day is ignored.
+  Return:
+    A list of floating point numbers representing the percentage of moon visible
+  """
+  def getMoonIlluminationForDates(self, dates):
+    if(self.moonPhases is None):
+      self.loadMoonPhases()
+    days = numpy.array([dayNumber(date) for date in dates], dtype=numpy.int64)
+    phases = numpy.round(illuminatedFraction(days), 2)
+    if(len(self.moonPhases)):
+      ndx = days - self.moonPhaseStart
+      inTable = (ndx >= 0) & (ndx < len(self.moonPhases))
+      tablePhases = self.moonPhases[numpy.clip(ndx, 0, len(self.moonPhases) - 1)]
+      inTable &= ~numpy.isnan(tablePhases)
+      phases = numpy.where(inTable, tablePhases, phases)
+    return([float(phase) for phase in phases])
+
+  """
   Function: getMoonIllumination
   Purpose: For the given day, return the moon illumination(percentage of moon visible).
   Parameters:
@@ -227,24 +609,22 @@ class dhecDB(xeniaSQLite):
     a floating point number representing the percentage of moon visible
   """
   def getMoonIllumination(self, date):
-    moonPhase = -9999.0
-    sql = "SELECT phase FROM moon_phase WHERE date = strftime( '%%Y-%%m-%%d','%s')" % (date)
-    try:
-      dbCursor = self.executeQuery(sql)
-      if(dbCursor != None):
-        val = dbCursor.fetchone()
-        if(val != None):
-          if(val['phase'] != None):
-            moonPhase = float(val['phase'])
-    except sqlite3.Error, e:
-      self.rowErrorCnt += 1
-      if(self.logger != None):
-        self.logger.critical("ErrMsg: %s SQL: \"%s\" Terminating script!" % (e.args[0], sql))
-      else:
-        print("ErrMsg: %s SQL: \"%s\" Terminating script!" % (e.args[0], sql))      
-      sys.exit(- 1)
-      
-    return(moonPhase)
+    return(self.getMoonIlluminationForDates([date])[0])
+
+  """
+  Function: fillMoonPhaseTable
+  Purpose: Adds the days from the start to the end date that are missing from the moon_phase table, calculated
+   with moonIllumination.
+  Parameters:
+    startDate is the first day, YYYY-MM-DD.
+    endDate is the last day, YYYY-MM-DD.
+  Return: The number of days added, -1 if there was an error.
+  """
+  def fillMoonPhaseTable(self, startDate, endDate):
+    dayCnt = fillMoonPhaseTable(self.DB, startDate, endDate, self.logger)
+    #Reload the lookup array the next time it is used.
+    self.moonPhases = None
+    return(dayCnt)
   
   """
   Function: writeSummaryForStation
@@ -287,69 +667,40 @@ class dhecDB(xeniaSQLite):
         if(rainGauge != None):
           if(dateTime == '2009-12-31T16:25:00' and station == 'WAC-005A'):
             stop = 1
-          #Query the rainfall totals over the given hours range. 
-          #Get the last 24 hours summary
-          sum24 = self.getLastNHoursSummaryFromPrecipSummary(dateTime, rainGauge, 24)
-          if(sum24 == -9999.0):
-            sum24 = 'NULL'
-          #Get the last 48 hours summary
-          sum48 = self.getLastNHoursSummaryFromPrecipSummary(dateTime, rainGauge, 48)
-          if(sum48 == -9999.0):
-            sum48 = 'NULL'
-          #Get the last 72 hours summary
-          sum72 = self.getLastNHoursSummaryFromPrecipSummary(dateTime, rainGauge, 72)
-          if(sum72 == -9999.0):
-            sum72 = 'NULL'
-          #Get the last 96 hours summary
-          sum96 = self.getLastNHoursSummaryFromPrecipSummary(dateTime, rainGauge, 96)
-          if(sum96 == -9999.0):
-            sum96 = 'NULL'
-          #Get the last 120 hours summary
-          sum120 = self.getLastNHoursSummaryFromPrecipSummary(dateTime, rainGauge, 120)
-          if(sum120 == -9999.0):
-            sum120 = 'NULL'
-          #Get the last 144 hours summary
-          sum144 = self.getLastNHoursSummaryFromPrecipSummary(dateTime, rainGauge, 144)
-          if(sum144 == -9999.0):
-            sum144 = 'NULL'
-          #Get the last 168 hours summary
-          sum168 = self.getLastNHoursSummaryFromPrecipSummary(dateTime, rainGauge, 168)
-          if(sum168 == -9999.0):
-            sum168 = 'NULL'
+          #Query the rainfall totals over the given hours range, the intensity and the preceding dry days.
+          gaugeStats = self.getRainGaugeStats([dateTime], rainGauge)[0]
+          sum24 = gaugeStats['sum24']
+          sum48 = gaugeStats['sum48']
+          sum72 = gaugeStats['sum72']
+          sum96 = gaugeStats['sum96']
           #calculate the X day delay totals
           #1 day delay
           sum1daydelay = 'NULL'
-          if(sum24 != 'NULL' and sum48 != 'NULL'):
+          if(sum24 != None and sum48 != None):
             sum1daydelay = str(sum48 - sum24)
           #2 day delay
           sum2daydelay = 'NULL'
-          if(sum72 != 'NULL' and sum48 != 'NULL'):
+          if(sum72 != None and sum48 != None):
             sum2daydelay = str(sum72 - sum48)
           #3 day delay
           sum3daydelay = 'NULL'
-          if(sum72 != 'NULL' and sum96 != 'NULL'):
+          if(sum72 != None and sum96 != None):
             sum3daydelay = str(sum96 - sum72)
           #Now convert the values to strings. We use strings in the SQL call so we can use 'NULL' for values we don't have.
-          sum24 = str(sum24)
-          sum48 = str(sum48)
-          sum72 = str(sum72)
-          sum96 = str(sum96)
-          sum120 = str(sum120)
-          sum144 = str(sum144)
-          sum168 = str(sum168)
-          
-          #Get the preceding dry days count, if there are any.
-          dryCnt = self.getPrecedingDryDaysCount(dateTime, rainGauge)
-          if(dryCnt == -9999):
-            dryCnt = 'NULL'
-          else:
-            dryCnt = str(dryCnt)
-          #Get the 24 hour rainfall intensity
-          rainfallIntensity = self.calcRainfallIntensity(rainGauge, dateTime, 10)
-          if(rainfallIntensity == -9999.0):
-            rainfallIntensity = 'NULL'
-          else:
-            rainfallIntensity = str(rainfallIntensity)
+          for key in ['sum24','sum48','sum72','sum96','sum120','sum144','sum168','dryCnt','rainfallIntensity']:
+            if(gaugeStats[key] == None):
+              gaugeStats[key] = 'NULL'
+            else:
+              gaugeStats[key] = str(gaugeStats[key])
+          sum24 = gaugeStats['sum24']
+          sum48 = gaugeStats['sum48']
+          sum72 = gaugeStats['sum72']
+          sum96 = gaugeStats['sum96']
+          sum120 = gaugeStats['sum120']
+          sum144 = gaugeStats['sum144']
+          sum168 = gaugeStats['sum168']
+          dryCnt = gaugeStats['dryCnt']
+          rainfallIntensity = gaugeStats['rainfallIntensity']
                   
           #Write the summary table
           etcoc = 'NULL'
@@ -372,73 +723,28 @@ class dhecDB(xeniaSQLite):
             weather = str(beachData['weather'])
           
           #Calculate the moon illumination. We want to calculate the illumination in EST at noon.
-          
-          moonCalcs = moon()
           #We use the sampleDate for the moon illumination since the dates are in EST in the table.
-          #moon = self.getMoonIllumination(sampleDate)  
-          if(moon == -9999.0):
-            moon = 'NULL'
-          else:
-            moon = str(moon)
+          moon = str(self.getMoonIllumination(sampleDate))
          
           
-          #Query the rainfall totals over the given hours range. 
-          #Get the last 24 hours summary
-          radarSum24 = self.getLastNHoursSummaryFromRadarPrecip(dateTime, rainGauge, 24)
-          if(radarSum24 == -9999.0):
-            radarSum24 = 'NULL'
-          #Get the last 48 hours summary
-          radarSum48 = self.getLastNHoursSummaryFromRadarPrecip(dateTime, rainGauge, 48)
-          if(radarSum48 == -9999.0):
-            radarSum48 = 'NULL'
-          #Get the last 72 hours summary
-          radarSum72 = self.getLastNHoursSummaryFromRadarPrecip(dateTime, rainGauge, 72)
-          if(radarSum72 == -9999.0):
-            radarSum72 = 'NULL'
-          #Get the last 96 hours summary
-          radarSum96 = self.getLastNHoursSummaryFromRadarPrecip(dateTime, rainGauge, 96)
-          if(radarSum96 == -9999.0):
-            radarSum96 = 'NULL'
-          #Get the last 120 hours summary
-          radarSum120 = self.getLastNHoursSummaryFromRadarPrecip(dateTime, rainGauge, 120)
-          if(radarSum120 == -9999.0):
-            radarSum120 = 'NULL'
-          #Get the last 144 hours summary
-          radarSum144 = self.getLastNHoursSummaryFromRadarPrecip(dateTime, rainGauge, 144)
-          if(radarSum144 == -9999.0):
-            radarSum144 = 'NULL'
-          #Get the last 168 hours summary
-          radarSum168 = self.getLastNHoursSummaryFromRadarPrecip(dateTime, rainGauge, 168)
-          if(radarSum168 == -9999.0):
-            radarSum168 = 'NULL'
-      
-          radarIntensity = self.calcRadarRainfallIntensity( rainGauge, dateTime, 60)
-          if(radarSum24 == 'NULL' or radarIntensity == -9999):
-            radarIntensity = 'NULL'
-          else:
-            radarIntensity = str(radarIntensity)
-          
-          radarDryCnt = 'NULL'
-          if(radarSum24 != 'NULL'):
-            radarDryCnt = self.getPrecedingRadarDryDaysCount(dateTime, rainGauge)
-            if(radarDryCnt == -9999):
-              radarDryCnt = 'NULL'
-            else:
-              radarDryCnt = str(radarDryCnt)
-          
-          #calculate the X day delay totals
-          #1 day delay
-          radarsum1daydelay = 'NULL'
-          if(radarSum48 != 'NULL' and radarSum24 != 'NULL'):
-            radarsum1daydelay = str(radarSum48 - radarSum24)
-          #2 day delay
-          radarsum2daydelay = 'NULL'
-          if(radarSum72 != 'NULL' and radarSum48 != 'NULL'):
-            radarsum2daydelay = str(radarSum72 - radarSum48)
-          #3 day delay
-          radarsum3daydelay = 'NULL'
-          if(radarSum96 != 'NULL' and radarSum72 != 'NULL'):
-            radarsum3daydelay = str(radarSum96 - radarSum72)
+          #Query the radar rainfall totals, intensity and dry days.
+          xmrgData = self.createXMRGStatsForDates([dateTime], rainGauge)[0]
+          for key in ['radarSum24','radarSum48','radarSum72','radarSum96','radarSum120','radarSum144','radarSum168',
+                      'radarIntensity','radarDryCnt','radarsum1daydelay','radarsum2daydelay','radarsum3daydelay']:
+            if(xmrgData[key] == None):
+              xmrgData[key] = 'NULL'
+          radarSum24 = xmrgData['radarSum24']
+          radarSum48 = xmrgData['radarSum48']
+          radarSum72 = xmrgData['radarSum72']
+          radarSum96 = xmrgData['radarSum96']
+          radarSum120 = xmrgData['radarSum120']
+          radarSum144 = xmrgData['radarSum144']
+          radarSum168 = xmrgData['radarSum168']
+          radarIntensity = str(xmrgData['radarIntensity'])
+          radarDryCnt = str(xmrgData['radarDryCnt'])
+          radarsum1daydelay = str(xmrgData['radarsum1daydelay'])
+          radarsum2daydelay = str(xmrgData['radarsum2daydelay'])
+          radarsum3daydelay = str(xmrgData['radarsum3daydelay'])
            
           radarSum24 = str(radarSum24)      
           radarSum48 = str(radarSum48)      
@@ -513,7 +819,7 @@ class dhecDB(xeniaSQLite):
                   sum1daydelay, sum2daydelay, sum3daydelay,
                   dryCnt, beachData['insp_type'], rainfallIntensity,
                   radarSum24,radarSum48,radarSum72,radarSum96,radarSum120,radarSum144,radarSum168,
-                  radarsum1daydelay,radarsum2daydelay,radarsum2daydelay,radarDryCnt,radarIntensity,
+                  radarsum1daydelay,radarsum2daydelay,radarsum3daydelay,radarDryCnt,radarIntensity,
                   avgWindSpdSUN2,cardPtSUN2,avgWaterTempSUN2,avgSalinitySUN2,
                   avgWindSpdNOS,cardPtNOS,avgWaterTempNOS,avgWaterLevelNOS)
           dbCursor = self.executeQuery(sql)
@@ -543,64 +849,501 @@ class dhecDB(xeniaSQLite):
     
     return(False)
   
+  """
+  Function: getObsAveragesForDates
+  Purpose: For the given observation on the platform, computes the same averages as getAverageForObs for a list
+   of dates. The observation series covering all the dates is loaded once and each average is done with a lookup
+   against it.
+  Parameters:
+    obsName string representing the observation we are calcing the average for
+    uom the units of measurement the observation is stored in
+    platformHandle the platform the observation was made on
+    dateTimes is a list of the dates, YYYY-MM-DDTHH:MM:SS, to calculate the averages for.
+    prevNHours the number of hours to go back from each date to compute the average.
+  Return:
+    A list of the averages, -9999 for a date with no data. None if the sensor doesn't exist.
+  """
+  def getObsAveragesForDates(self, obsName, uom, platformHandle, dateTimes, prevNHours=24):
+    sensorID = self.sensorExists(obsName, uom, platformHandle)
+    if(sensorID == None or sensorID == -1):
+      return(None)
+    #Like the getAverageForObs query, the window runs from the start of the day prevNHours back up to the start
+    #of the day of the date.
+    secondsInDay = 24 * 60 * 60
+    startTimes = []
+    endTimes = []
+    for dateTime in dateTimes:
+      anchor = dateToEpoch(dateTime)
+      startTimes.append(((anchor - (prevNHours * 3600)) // secondsInDay) * secondsInDay)
+      endTimes.append((anchor // secondsInDay) * secondsInDay)
+    series = precipSeries(logger=self.logger)
+    if(series.loadFromDB(self.DB, platformHandle, sensorID=sensorID,
+                         startDate=time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(min(startTimes))),
+                         endDate=time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(max(endTimes)))) == False):
+      return(None)
+    return(series.rangeAverages(startTimes, endTimes, -9999))
+
+  """
+  Function: rebuildStationSummaries
+  Purpose: Rebuilds the station_summary entries for all the samples in the dhec_beach table for a date range.
+   Instead of the per sample queries writeSummaryForStation does, each rain gauge, radar and observation series
+   is loaded once for the whole range and the statistics for every sample are computed from it. The existing
+   entries for the range and stations are deleted and the new ones written in a single transaction, so
+   rebuilding a range again doesn't add a second copy of its summaries.
+  Parameters:
+    startDate is the first inspection date, YYYY-MM-DD, to rebuild.
+    endDate is the last inspection date, YYYY-MM-DD, to rebuild.
+    stations is an optional list of the station names to rebuild. If None, all the stations are done.
+  Return:
+    The number of summaries written, -1 if there was an error.
+  """
+  def rebuildStationSummaries(self, startDate, endDate, stations=None):
+    startTime = time.time()
+    sql = "SELECT dhec_beach.station,dhec_beach.insp_date,dhec_beach.insp_time,dhec_beach.insp_type,\
+           dhec_beach.etcoc,dhec_beach.tide,dhec_beach.salinity,dhec_beach.weather,monitoring_stations.rain_gauge\
+           FROM dhec_beach,monitoring_stations\
+           WHERE monitoring_stations.station = dhec_beach.station AND\
+           dhec_beach.insp_date >= ? AND dhec_beach.insp_date <= ?"
+    params = [startDate, endDate]
+    if(stations != None and len(stations)):
+      sql += " AND dhec_beach.station IN (%s)" % (",".join(["?"] * len(stations)))
+      params.extend(stations)
+    sql += " ORDER BY dhec_beach.insp_date ASC,dhec_beach.insp_time ASC"
+    try:
+      samples = []
+      dbCursor = self.DB.cursor()
+      dbCursor.execute(sql, params)
+      for row in dbCursor:
+        if(row['rain_gauge'] == None):
+          continue
+        #The sample date and time are in EST, the other tables are queried in UTC.
+        try:
+          sampleTime = int(row['insp_time'])
+        except ValueError:
+          if(self.logger != None):
+            self.logger.error("Station: %s date: %s has an invalid time: %s, skipping." % (row['station'], row['insp_date'], row['insp_time']))
+          continue
+        hour = sampleTime / 100
+        minute = sampleTime - (hour * 100)
+        estDatetime = "%sT%02d:%02d:00" %(row['insp_date'], hour, minute)
+        dataEpochTime = time.mktime(time.strptime(estDatetime, '%Y-%m-%dT%H:%M:%S'))
+        samples.append({'beachData' : row,
+                        'estDatetime' : estDatetime,
+                        'dateTime' : time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(dataEpochTime))})
+      dbCursor.close()
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      else:
+        print("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      return(-1)
+
+    if(len(samples) == 0):
+      if(self.logger != None):
+        self.logger.info("No samples between: %s and %s to summarize." % (startDate, endDate))
+      return(0)
+
+    dateTimes = [sample['dateTime'] for sample in samples]
+    #Group the samples by rain gauge so each gauge's precipitation and radar series are only loaded once.
+    gauges = {}
+    for i in range(len(samples)):
+      rainGauge = samples[i]['beachData']['rain_gauge']
+      if(rainGauge not in gauges):
+        gauges[rainGauge] = []
+      gauges[rainGauge].append(i)
+    gaugeStats = [None] * len(samples)
+    xmrgStats = [None] * len(samples)
+    for rainGauge in gauges:
+      ndxList = gauges[rainGauge]
+      gaugeDates = [dateTimes[i] for i in ndxList]
+      stats = self.getRainGaugeStats(gaugeDates, rainGauge)
+      radarStats = self.createXMRGStatsForDates(gaugeDates, rainGauge)
+      for j in range(len(ndxList)):
+        gaugeStats[ndxList[j]] = stats[j]
+        xmrgStats[ndxList[j]] = radarStats[j]
+
+    #The previous day averages from the SUN2 buoy and the NOS water level station.
+    obsAverages = {}
+    for key,obsName,uom,platformHandle in [('sun2WindSpd', 'wind_speed', 'm_s-1', 'carocoops.SUN2.buoy'),
+                                           ('sun2WindDir', 'wind_from_direction', 'degrees_true', 'carocoops.SUN2.buoy'),
+                                           ('sun2WaterTemp', 'water_temperature', 'celsius', 'carocoops.SUN2.buoy'),
+                                           ('sun2Salinity', 'salinity', 'psu', 'carocoops.SUN2.buoy'),
+                                           ('nosWindSpd', 'wind_speed', 'm_s-1', 'nos.8661070.WL'),
+                                           ('nosWindDir', 'wind_from_direction', 'degrees_true', 'nos.8661070.WL'),
+                                           ('nosWaterTemp', 'water_temperature', 'celsius', 'nos.8661070.WL'),
+                                           ('nosWaterLevel', 'water_level', 'm', 'nos.8661070.WL')]:
+      obsAverages[key] = self.getObsAveragesForDates(obsName, uom, platformHandle, dateTimes)
+
+    moonPhases = self.getMoonIlluminationForDates([sample['beachData']['insp_date'] for sample in samples])
+    #The tide stage from the NOS station, used when the sample doesn't have the tide recorded.
+    tideLevels = self.getTideLevelsForDates(8661070, dateTimes)
+
+    summaryRows = []
+    for i in range(len(samples)):
+      beachData = samples[i]['beachData']
+      stats = gaugeStats[i]
+      xmrgData = xmrgStats[i]
+      #calculate the X day delay totals
+      sum1daydelay = None
+      if(stats['sum24'] != None and stats['sum48'] != None):
+        sum1daydelay = stats['sum48'] - stats['sum24']
+      sum2daydelay = None
+      if(stats['sum72'] != None and stats['sum48'] != None):
+        sum2daydelay = stats['sum72'] - stats['sum48']
+      sum3daydelay = None
+      if(stats['sum72'] != None and stats['sum96'] != None):
+        sum3daydelay = stats['sum96'] - stats['sum72']
+
+      beachVals = {}
+      for key in ['etcoc','salinity','tide','weather']:
+        beachVals[key] = None
+        if(beachData[key] != None and beachData[key] != ''):
+          beachVals[key] = beachData[key]
+      if(beachVals['tide'] == None and tideLevels[i] != -9999):
+        beachVals['tide'] = tideLevels[i]
+
+      averages = {}
+      for key in obsAverages:
+        averages[key] = None
+        if(obsAverages[key] != None and obsAverages[key][i] != -9999):
+          avg = obsAverages[key][i]
+          if(key in ('sun2WindSpd', 'nosWindSpd')):
+            #Convert to knots.
+            avg *= 1.9438444924406
+          averages[key] = float("%.3f" % (avg))
+      #The summary stores the cardinal point of the average direction, not the direction itself.
+      cardPts = {}
+      for key in ('sun2WindDir', 'nosWindDir'):
+        cardPts[key] = ""
+        if(obsAverages[key] != None):
+          cardPts[key] = None
+          if(averages[key] != None):
+            cardPts[key] = self.compassDirToCardinalPt(obsAverages[key][i])
+
+      summaryRows.append((samples[i]['estDatetime'], beachData['station'], beachData['rain_gauge'],
+                          beachVals['etcoc'], beachVals['salinity'], beachVals['tide'],
+                          moonPhases[i], beachVals['weather'],
+                          stats['sum24'], stats['sum48'], stats['sum72'], stats['sum96'], stats['sum120'], stats['sum144'], stats['sum168'],
+                          sum1daydelay, sum2daydelay, sum3daydelay,
+                          stats['dryCnt'], beachData['insp_type'], stats['rainfallIntensity'],
+                          xmrgData['radarSum24'], xmrgData['radarSum48'], xmrgData['radarSum72'], xmrgData['radarSum96'],
+                          xmrgData['radarSum120'], xmrgData['radarSum144'], xmrgData['radarSum168'],
+                          xmrgData['radarsum1daydelay'], xmrgData['radarsum2daydelay'], xmrgData['radarsum3daydelay'],
+                          xmrgData['radarDryCnt'], xmrgData['radarIntensity'],
+                          averages['sun2WindSpd'], cardPts['sun2WindDir'], averages['sun2WaterTemp'], averages['sun2Salinity'],
+                          averages['nosWindSpd'], cardPts['nosWindDir'], averages['nosWaterTemp'], averages['nosWaterLevel']))
+
+    #The summary dates are the sample date and time, so the range runs up to the start of the day after endDate.
+    deleteSQL = "DELETE FROM station_summary WHERE date >= ? AND date < ?"
+    deleteParams = [startDate, (datetime.datetime.strptime(endDate, '%Y-%m-%d') + datetime.timedelta(days=1)).strftime('%Y-%m-%d')]
+    if(stations != None and len(stations)):
+      deleteSQL += " AND station IN (%s)" % (",".join(["?"] * len(stations)))
+      deleteParams.extend(stations)
+    sql = "INSERT INTO station_summary \
+          (date,station,rain_gauge,etcoc,salinity,tide,moon_phase,weather, \
+          rain_summary_24,rain_summary_48,rain_summary_72,rain_summary_96,rain_summary_120,rain_summary_144,rain_summary_168, \
+          rain_total_one_day_delay,rain_total_two_day_delay,rain_total_three_day_delay,\
+          preceding_dry_day_count,inspection_type,rainfall_intensity_24,\
+          radar_rain_summary_24,radar_rain_summary_48,radar_rain_summary_72,radar_rain_summary_96,radar_rain_summary_120,radar_rain_summary_144,\
+          radar_rain_summary_168,radar_rain_total_one_day_delay,radar_rain_total_two_day_delay,radar_rain_total_three_day_delay,radar_preceding_dry_day_cnt,\
+          radar_rainfall_intensity_24,sun2_wind_speed,sun2_wind_dir,sun2_water_temp,sun2_salinity,nos8661070_wind_spd,nos8661070_wind_dir,\
+          nos8661070_water_temp,nos8661070_water_level ) \
+          VALUES(%s)" % (",".join(["?"] * 41))
+    try:
+      dbCursor = self.DB.cursor()
+      dbCursor.execute(deleteSQL, deleteParams)
+      dbCursor.executemany(sql, summaryRows)
+      dbCursor.close()
+      self.DB.commit()
+    except sqlite3.Error, e:
+      self.DB.rollback()
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      else:
+        print("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      return(-1)
+
+    elapsed = time.time() - startTime
+    rowsPerSec = len(summaryRows)
+    if(elapsed > 0):
+      rowsPerSec = len(summaryRows) / elapsed
+    msg = "Rebuilt %d station summaries from: %s to: %s in %.3f seconds, %.1f rows/sec." % (len(summaryRows), startDate, endDate, elapsed, rowsPerSec)
+    if(self.logger != None):
+      self.logger.info(msg)
+    else:
+      print(msg)
+    return(len(summaryRows))
+
   def createXMRGStats(self, dateTime, platformHandle):
-    xmrgData = {}
-    #Query the rainfall totals over the given hours range. 
-    #Get the last 24 hours summary
-    xmrgData['radarSum24'] = self.getLastNHoursSummaryFromRadarPrecip(dateTime, platformHandle, 24)
-    if(xmrgData['radarSum24'] == -9999.0):
-      xmrgData['radarSum24'] = None
-    #Get the last 48 hours summary
-    xmrgData['radarSum48'] = self.getLastNHoursSummaryFromRadarPrecip(dateTime, platformHandle, 48)
-    if(xmrgData['radarSum48'] == -9999.0):
-      xmrgData['radarSum48'] = None
-    #Get the last 72 hours summary
-    xmrgData['radarSum72'] = self.getLastNHoursSummaryFromRadarPrecip(dateTime, platformHandle, 72)
-    if(xmrgData['radarSum72'] == -9999.0):
-      xmrgData['radarSum72'] = None
-    #Get the last 96 hours summary
-    xmrgData['radarSum96'] = self.getLastNHoursSummaryFromRadarPrecip(dateTime, platformHandle, 96)
-    if(xmrgData['radarSum96'] == -9999.0):
-      xmrgData['radarSum96'] = None
-    #Get the last 120 hours summary
-    xmrgData['radarSum120'] = self.getLastNHoursSummaryFromRadarPrecip(dateTime, platformHandle, 120)
-    if(xmrgData['radarSum120'] == -9999.0):
-      xmrgData['radarSum120'] = None
-    #Get the last 144 hours summary
-    xmrgData['radarSum144'] = self.getLastNHoursSummaryFromRadarPrecip(dateTime, platformHandle, 144)
-    if(xmrgData['radarSum144'] == -9999.0):
-      xmrgData['radarSum144'] = None
-    #Get the last 168 hours summary
-    xmrgData['radarSum168'] = self.getLastNHoursSummaryFromRadarPrecip(dateTime, platformHandle, 168)
-    if(xmrgData['radarSum168'] == -9999.0):
-      xmrgData['radarSum168'] = None
-  
-    xmrgData['radarIntensity'] = self.calcRadarRainfallIntensity( platformHandle, dateTime, 60)
-    if(xmrgData['radarSum24'] == 'NULL' or xmrgData['radarIntensity'] == -9999):
+    return(self.createXMRGStatsForDates([dateTime], platformHandle)[0])
+
+  """
+  Function: createXMRGStatsForDates
+  Purpose: Calculates the radar rainfall statistics for a list of dates. The radar series for the platform is
+   loaded once and the window sums, intensity and dry day counts for all the dates are computed from it.
+  Parameters:
+    dateTimes is a list of the dates, YYYY-MM-DDTHH:MM:SS, to calculate the statistics for.
+    platformHandle is the rain gauge name used to denote the radar area of interest.
+    windows is the list of hour windows to sum.
+  Return: A list, one entry per date, of dictionaries keyed radarSumN for each window, radarIntensity, radarDryCnt
+    and radarsum1daydelay, radarsum2daydelay, radarsum3daydelay. Values we couldn't calculate are None.
+  """
+  def createXMRGStatsForDates(self, dateTimes, platformHandle, windows=[24,48,72,96,120,144,168]):
+    statsList = []
+    radarPlatform = 'nws.%s.radar' % (platformHandle)
+    anchors = [dateToEpoch(dateTime) for dateTime in dateTimes]
+    sensorID = self.sensorExists('precipitation_radar_weighted_average', 'in', radarPlatform)
+    series = None
+    if(sensorID != None and sensorID != -1):
+      #We load the entire history up to the last date so the dry day counts can go back as far as they need to. Only
+      #the values with rainfall are used in the radar calcs, so there is no need to pull the 0 values.
+      series = self.loadPrecipSeries('precipitation_radar_weighted_average', 'in', radarPlatform, sensorID=sensorID,
+                                     endDate=max(dateTimes), positiveOnly=True)
+    else:
+      if(self.logger != None):
+        self.logger.error("No sensor id found for platform: %s." % (radarPlatform))
+
+    if(series != None):
+      #Currently we are not putting radar summaries of 0 in the database, so if there are no records, then our sum is 0.
+      sums = series.windowSums(anchors, windows, True, 0.0)
+      #We do not store radar data that has 0 for precipitation, so no data means an intensity of 0.
+      intensities = [max(val, 0.0) for val in series.intensity(anchors, 60)]
+      dryCnts = series.daysSinceRain(anchors)
+      
+    for i in range(len(dateTimes)):
+      xmrgData = {}
+      for ndx in range(len(windows)):
+        xmrgData['radarSum%d' % (windows[ndx])] = None
       xmrgData['radarIntensity'] = None
+      xmrgData['radarDryCnt'] = None
+      if(series != None):
+        for ndx in range(len(windows)):
+          xmrgData['radarSum%d' % (windows[ndx])] = sums[i][ndx]
+        xmrgData['radarIntensity'] = intensities[i]
+        if(dryCnts[i] != -9999):
+          xmrgData['radarDryCnt'] = dryCnts[i]
+      
+      #calculate the X day delay totals
+      #1 day delay
+      xmrgData['radarsum1daydelay'] = None
+      if(xmrgData.get('radarSum48') != None and xmrgData.get('radarSum24') != None):
+        xmrgData['radarsum1daydelay'] = (xmrgData['radarSum48'] - xmrgData['radarSum24'])
+      #2 day delay
+      xmrgData['radarsum2daydelay'] = None
+      if(xmrgData.get('radarSum72') != None and xmrgData.get('radarSum48') != None):
+        xmrgData['radarsum2daydelay'] = (xmrgData['radarSum72'] - xmrgData['radarSum48'])
+      #3 day delay
+      xmrgData['radarsum3daydelay'] = None
+      if(xmrgData.get('radarSum96') != None and xmrgData.get('radarSum72') != None):
+        xmrgData['radarsum3daydelay'] = (xmrgData['radarSum96'] - xmrgData['radarSum72'])    
+      statsList.append(xmrgData)
+    
+    return(statsList)
+
+  """
+  Function: getRainGaugeStats
+  Purpose: Calculates the rain gauge statistics for a list of dates. The daily summary and the 10 minute rainfall
+   series are each loaded once and the window sums and intensity for all the dates are computed from them. The
+   preceding dry day counts are looked up in the dry day index.
+  Parameters:
+    dateTimes is a list of the dates, YYYY-MM-DDTHH:MM:SS, to calculate the statistics for.
+    rainGauge is the rain gauge name.
+    windows is the list of hour windows to sum.
+  Return: A list, one entry per date, of dictionaries keyed sumN for each window, dryCnt and rainfallIntensity.
+    Values we couldn't calculate are None.
+  """
+  def getRainGaugeStats(self, dateTimes, rainGauge, windows=[24,48,72,96,120,144,168]):
+    statsList = []
+    platformHandle = 'dhec.%s.raingauge' % (rainGauge)
+    anchors = [dateToEpoch(dateTime) for dateTime in dateTimes]
+    sums = None
+    dryCnts = None
+    intensities = None
     
-    xmrgData['radarDryCnt'] = None
-    if(xmrgData['radarSum24'] != None):
-      xmrgData['radarDryCnt'] = self.getPrecedingRadarDryDaysCount(dateTime, platformHandle)
-      if(xmrgData['radarDryCnt'] == -9999):
-        xmrgData['radarDryCnt'] = None
+    mTypeID = self.getMTypeFromObsName('precipitation_accumulated_daily', 'in', platformHandle, 1)
+    if(mTypeID != None):
+      #The dry day counts come from the dry day index, so the summaries only need to cover the longest window. If the
+      #index can't be used, the dry day count can go back any number of days, so we get the entire history.
+      dryCnts = self.getIndexedDryDaysCounts(dateTimes, platformHandle)
+      startDate = None
+      if(dryCnts != None):
+        startDate = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(min(anchors) - (max(windows) * 3600)))
+      dailySeries = self.loadPrecipSeries('precipitation_accumulated_daily', 'in', platformHandle, mTypeID=mTypeID,
+                                          startDate=startDate, endDate=max(dateTimes))
+      if(dailySeries != None):
+        sums = dailySeries.windowSums(anchors, windows)
+        if(dryCnts == None):
+          dryCnts = dailySeries.precedingDryDays(anchors)
+    else:
+      if(self.logger != None):
+        self.logger.error("No m_type_id for: precipitation_accumulated_daily(in) found for platform: %s" %(platformHandle))
     
-    #calculate the X day delay totals
-    #1 day delay
-    xmrgData['radarsum1daydelay'] = None
-    if(xmrgData['radarSum48'] != None and xmrgData['radarSum24'] != None):
-      xmrgData['radarsum1daydelay'] = (xmrgData['radarSum48'] - xmrgData['radarSum24'])
-    #2 day delay
-    xmrgData['radarsum2daydelay'] = None
-    if(xmrgData['radarSum72'] != None and xmrgData['radarSum48'] != None):
-      xmrgData['radarsum2daydelay'] = (xmrgData['radarSum72'] - xmrgData['radarSum48'])
-    #3 day delay
-    xmrgData['radarsum3daydelay'] = None
-    if(xmrgData['radarSum96'] != None and xmrgData['radarSum72'] != None):
-      xmrgData['radarsum3daydelay'] = (xmrgData['radarSum96'] - xmrgData['radarSum72'])    
+    mTypeID = self.getMTypeFromObsName('precipitation', 'in', platformHandle, 1)
+    if(mTypeID != None):
+      startDate = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(min(anchors) - (24 * 3600)))
+      rainSeries = self.loadPrecipSeries('precipitation', 'in', platformHandle, mTypeID=mTypeID,
+                                         startDate=startDate, endDate=max(dateTimes))
+      if(rainSeries != None):
+        intensities = rainSeries.intensity(anchors, 10)
+    else:
+      if(self.logger != None):
+        self.logger.error("No m_type_id for: precipitation(in) found for platform: %s" %(platformHandle))
     
-    return(xmrgData)
+    for i in range(len(dateTimes)):
+      gaugeStats = {}
+      for ndx in range(len(windows)):
+        gaugeStats['sum%d' % (windows[ndx])] = None
+        if(sums != None):
+          gaugeStats['sum%d' % (windows[ndx])] = sums[i][ndx]
+      gaugeStats['dryCnt'] = None
+      if(dryCnts != None and dryCnts[i] != -9999):
+        gaugeStats['dryCnt'] = dryCnts[i]
+      gaugeStats['rainfallIntensity'] = None
+      if(intensities != None and intensities[i] != -9999.0):
+        gaugeStats['rainfallIntensity'] = intensities[i]
+      statsList.append(gaugeStats)
+      
+    return(statsList)
      
+  """
+  Function: usePartitions
+  Purpose: Has the windowed summaries also query the yearly partitions archiveRollover moves the old multi_obs rows
+   into, so windows that reach back past the rollover cutoff still see all of the data.
+  Parameters:
+    archiveDir is the directory the yearly partition directories are in, None to stop using them.
+  """
+  def usePartitions(self, archiveDir):
+    if(self.partitions != None):
+      self.partitions.close()
+      self.partitions = None
+    if(archiveDir != None):
+      self.partitions = yearPartitions(archiveDir, self.logger)
+
+  """
+  Function: getPartitionsSum
+  Purpose: Sums an observation over the last N hours in the partitions the window overlaps.
+  Parameters:
+    obsName is the observation standard name.
+    uom is the unit of measure.
+    platformHandle is the platform.
+    dateTime is the end of the window, not included.
+    prevHourCnt is the number of hours to go back from dateTime.
+    whereClause is an optional extra condition, for example "AND m_value > 0.0".
+  Return: The sum, None if we aren't using partitions or none of them had data for the window.
+  """
+  def getPartitionsSum(self, obsName, uom, platformHandle, dateTime, prevHourCnt, whereClause=""):
+    if(self.partitions == None):
+      return(None)
+    #Two m_types can have the same observation and uom, the number of values tells them apart in the partitions.
+    mTypeID = self.getMTypeFromObsName(obsName, uom, platformHandle, 1)
+    if(mTypeID == None or mTypeID == -1):
+      return(None)
+    numTypes = self.getNumTypes(mTypeID)
+    if(numTypes == -9999):
+      return(None)
+    endEpoch = dateToEpoch(dateTime)
+    startDate = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(endEpoch - (prevHourCnt * 3600)))
+    endDate = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(endEpoch))
+    sql = "SELECT SUM(m_value) FROM multi_obs\
+           WHERE m_date >= :startDate AND m_date < :endDate AND sensor_id = :sensorID %s" % (whereClause)
+    rows = self.partitions.queryWindow(sql, obsName, uom, platformHandle, startDate, endDate, 1, numTypes)
+    if(rows == None):
+      self.rowErrorCnt += 1
+      return(None)
+    sums = [float(row[0]) for row in rows if(row[0] != None)]
+    if(len(sums) == 0):
+      return(None)
+    return(sum(sums))
+
+  """
+  Function: getNumTypes
+  Purpose: Returns the number of values an m_type has, cached by the m_type id.
+  Parameters:
+    mTypeID is the m_type id.
+  Return: The num_types, None if the m_type doesn't have one, -9999 if there was an error.
+  """
+  def getNumTypes(self, mTypeID):
+    if(mTypeID not in self.numTypesCache):
+      dbCursor = self.executeQuery("SELECT num_types FROM m_type WHERE row_id = %d" % (mTypeID))
+      if(dbCursor == None):
+        return(-9999)
+      row = dbCursor.fetchone()
+      dbCursor.close()
+      self.numTypesCache[mTypeID] = None
+      if(row != None):
+        self.numTypesCache[mTypeID] = row[0]
+    return(self.numTypesCache[mTypeID])
+
+  """
+  Function: getPartitionsRows
+  Purpose: Returns an observation's values from the partitions a date window overlaps.
+  Parameters:
+    obsName is the observation standard name.
+    uom is the unit of measure.
+    platformHandle is the platform.
+    mTypeID is the observation's m_type id in the live database, used to pick the same m_type in the partitions.
+    startDate is the earliest m_date to return, None to start with the oldest partition.
+    endDate is the m_date to return up to, but not including, None for no limit.
+    positiveOnly if True only returns the values greater than 0.
+  Return: A list of (m_date, m_value) tuples in date order, an empty list if we aren't using partitions. None if
+    there was an error.
+  """
+  def getPartitionsRows(self, obsName, uom, platformHandle, mTypeID, startDate=None, endDate=None, positiveOnly=False):
+    if(self.partitions == None):
+      return([])
+    numTypes = self.getNumTypes(mTypeID)
+    if(numTypes == -9999):
+      return(None)
+    if(startDate == None):
+      startDate = '0001-01-01T00:00:00'
+    if(endDate == None):
+      endDate = '9999-12-31T23:59:59'
+    sql = "SELECT m_date,m_value FROM multi_obs\
+           WHERE m_date >= :startDate AND m_date < :endDate AND sensor_id = :sensorID AND m_value IS NOT NULL"
+    if(positiveOnly):
+      sql += " AND m_value > 0.0"
+    sql += " ORDER BY m_date ASC"
+    rows = self.partitions.queryWindow(sql, obsName, uom, platformHandle, startDate, endDate, 1, numTypes)
+    if(rows == None):
+      self.rowErrorCnt += 1
+      return(None)
+    rows = [(row[0], row[1]) for row in rows]
+    rows.sort()
+    return(rows)
+
+  """
+  Function: loadPrecipSeries
+  Purpose: Loads a precipitation series from the live multi_obs table and, if we are using them, the yearly
+   partitions, so series that reach back past the rollover cutoff have all of their data.
+  Parameters:
+    obsName is the observation standard name.
+    uom is the unit of measure.
+    platformHandle is the platform.
+    mTypeID is the m_type id of the observation, looked up from obsName and uom if None.
+    sensorID, if provided, is the sensor id to load the live rows for instead of the m_type.
+    startDate, if provided, is the earliest m_date to load.
+    endDate, if provided, is the m_date to load up to, but not including.
+    positiveOnly if True only loads the values greater than 0.
+  Return: The precipSeries, None if it couldn't be loaded.
+  """
+  def loadPrecipSeries(self, obsName, uom, platformHandle, mTypeID=None, sensorID=None, startDate=None, endDate=None, positiveOnly=False):
+    if(mTypeID == None):
+      mTypeID = self.getMTypeFromObsName(obsName, uom, platformHandle, 1)
+      if(mTypeID == None or mTypeID == -1):
+        return(None)
+    series = precipSeries(logger=self.logger)
+    if(series.loadFromDB(self.DB, platformHandle, mTypeID=mTypeID, sensorID=sensorID, startDate=startDate, endDate=endDate, positiveOnly=positiveOnly) == False):
+      return(None)
+    rows = self.getPartitionsRows(obsName, uom, platformHandle, mTypeID, startDate, endDate, positiveOnly)
+    if(rows == None):
+      return(None)
+    if(len(rows)):
+      dates = numpy.concatenate((numpy.array([dateToEpoch(row[0]) for row in rows], dtype=numpy.int64), series.dates))
+      values = numpy.concatenate((numpy.array([float(row[1]) for row in rows], dtype=numpy.float64), series.values))
+      order = numpy.argsort(dates, kind='mergesort')
+      series.setData(dates[order], values[order])
+    return(series)
+
   def getLastNHoursPrecipSummary(self, dateTime, mTypeID, platformHandle, prevHourCnt):
     sql = "SELECT SUM(m_value) \
            FROM multi_obs \
@@ -635,8 +1378,15 @@ class dhecDB(xeniaSQLite):
   """
   def getLastNHoursSummaryFromPrecipSummary(self, dateTime, rain_gauge, prevHourCnt):
     platformHandle = 'dhec.%s.raingauge' % (rain_gauge)
-    mTypeID = xeniaSQLite.getMTypeFromObsName(self, 'precipitation_accumulated_daily', 'in',platformHandle,1)
+    mTypeID = self.getMTypeFromObsName('precipitation_accumulated_daily', 'in',platformHandle,1)
     sum = self.getLastNHoursPrecipSummary(dateTime, mTypeID, platformHandle, prevHourCnt)
+    #Add in any of the window that has been rolled over into the partitions.
+    partitionSum = self.getPartitionsSum('precipitation_accumulated_daily', 'in', platformHandle, dateTime, prevHourCnt)
+    if(partitionSum != None):
+      if(sum == -9999.0):
+        sum = partitionSum
+      else:
+        sum += partitionSum
     return(sum)
   """
   Function: getLastNHoursSummaryFromRadarPrecipSummary
@@ -652,7 +1402,7 @@ class dhecDB(xeniaSQLite):
     platformHandle = 'nws.%s.radar' % (rain_gauge)
     #mTypeID = xeniaSQLite.getMTypeFromObsName(self, 'precipitation_radar_weighted_average', 'in',platformHandle,1)
     #Get the sensor ID for the obs we are interested in so we can use it to query the data.
-    sensorID = xeniaSQLite.sensorExists(self, 'precipitation_radar_weighted_average', 'in', platformHandle)
+    sensorID = self.sensorExists('precipitation_radar_weighted_average', 'in', platformHandle)
     
     #if(mTypeID != None):
       #sum = self.getLastNHoursPrecipSummary(datetime, mTypeID, platformHandle, prevHourCnt)
@@ -684,6 +1434,10 @@ class dhecDB(xeniaSQLite):
           #any records, then our sum is 0.
           else:
             sum = 0.0
+          partitionSum = self.getPartitionsSum('precipitation_radar_weighted_average', 'in', platformHandle,
+                                               dateTime, prevHourCnt, "AND m_value > 0.0")
+          if(partitionSum != None):
+            sum += partitionSum
       except sqlite3.Error, e:
         self.rowErrorCnt += 1
         if(self.logger != None):
@@ -698,7 +1452,7 @@ class dhecDB(xeniaSQLite):
 
   def getLastNHoursSummary(self, dateTime, rain_gauge, prevHourCnt):
     platformHandle = 'dhec.%s.raingauge' % (rain_gauge)
-    mTypeID = xeniaSQLite.getMTypeFromObsName(self, 'precipitation', 'in',platformHandle,1)
+    mTypeID = self.getMTypeFromObsName('precipitation', 'in',platformHandle,1)
     sql = "SELECT SUM(m_value) \
            FROM multi_obs \
            WHERE\
@@ -711,8 +1465,15 @@ class dhecDB(xeniaSQLite):
       dbCursor = self.DB.cursor()
       dbCursor.execute(sql)
       sum = dbCursor.fetchone()[0]
+      #Add in any of the window that has been rolled over into the partitions.
+      partitionSum = self.getPartitionsSum('precipitation', 'in', platformHandle, dateTime, prevHourCnt)
       if(sum != None):
-        return(float(sum))      
+        sum = float(sum)
+        if(partitionSum != None):
+          sum += partitionSum
+        return(sum)
+      elif(partitionSum != None):
+        return(partitionSum)
     
     except sqlite3.Error, e:
       self.rowErrorCnt += 1
@@ -729,10 +1490,15 @@ class dhecDB(xeniaSQLite):
     rainGauge is the rain  gauge we are query the rainfall summary for.
   """
   def getPrecedingDryDaysCount(self, dateTime, rainGauge):
+    platformHandle = "dhec.%s.raingauge" %(rainGauge)
+    #Use the dry day index if we can, it is a single indexed lookup instead of rescanning the summaries.
+    iDryCnt = self.getIndexedDryDaysCount(dateTime, platformHandle)
+    if(iDryCnt != None):
+      return(iDryCnt)
     iDryCnt = 0
     secondsInDay = 24 * 60 * 60
     platformHandle = "dhec.%s.raingauge" %(rainGauge)
-    mTypeID = xeniaSQLite.getMTypeFromObsName(self,"precipitation_accumulated_daily","in",platformHandle,1)
+    mTypeID = self.getMTypeFromObsName("precipitation_accumulated_daily","in",platformHandle,1)
     #When determining the number of days back to go, we use 2 in the  m_date <=strftime('%%Y-%%m-%%dT23:59:00', datetime('%s', '-2 day') )
     #comparison below since the dates on the rain gauge summary data is at hour 23:59.
     #Might change this to drop the hour/minute/second format which would then allow -1 day to be
@@ -770,6 +1536,259 @@ class dhecDB(xeniaSQLite):
       iDryCnt = -9999
     return(iDryCnt)
   
+  """
+  Function: createDryDayIndex
+  Purpose: Creates the precip_dry_day_index table if it does not exist. The table has a row for each rain gauge daily
+   summary with the number of consecutive dry days that end on it: 0 if the day had rain, -9999 if the dry run has a
+   missing day in it.
+  Parameters: None
+  Return: True if successful, otherwise False.
+  """
+  def createDryDayIndex(self):
+    if(self.dryDayIndexReady):
+      return(True)
+    try:
+      dbCursor = self.DB.cursor()
+      dbCursor.execute("CREATE TABLE IF NOT EXISTS precip_dry_day_index (\
+                        platform_handle TEXT,\
+                        m_date TEXT,\
+                        m_value REAL,\
+                        dry_count INTEGER,\
+                        PRIMARY KEY(platform_handle, m_date))")
+      dbCursor.close()
+      self.DB.commit()
+      self.dryDayIndexReady = True
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("Unable to create the precip_dry_day_index table. ErrMsg: %s" % (e.args[0]))
+      return(False)
+    return(True)
+
+  """
+  Function: rebuildDryDayIndex
+  Purpose: Rebuilds the dry day index for a rain gauge from its daily summaries, one pass over the data.
+  Parameters:
+    platformHandle is the rain gauge platform.
+  Return: True if successful, otherwise False.
+  """
+  def rebuildDryDayIndex(self, platformHandle):
+    if(self.createDryDayIndex() == False):
+      return(False)
+    mTypeID = self.getMTypeFromObsName("precipitation_accumulated_daily","in",platformHandle,1)
+    if(mTypeID == None):
+      return(False)
+    #The summaries older than the rollover cutoff are in the partitions. Keyed on the date so a summary that is in
+    #both only gets one index row, the live one.
+    rows = self.getPartitionsRows("precipitation_accumulated_daily", "in", platformHandle, mTypeID)
+    if(rows == None):
+      return(False)
+    rows = dict(rows)
+    dbCursor = xeniaSQLite.executeQuery(self, "SELECT m_date,m_value FROM multi_obs\
+                                               WHERE m_type_id = %d AND platform_handle = '%s' AND m_value IS NOT NULL\
+                                               ORDER BY m_date ASC" % (mTypeID, platformHandle))
+    if(dbCursor == None):
+      return(False)
+    rows.update([(row['m_date'], row['m_value']) for row in dbCursor])
+    dbCursor.close()
+    rows = sorted(rows.items())
+    series = precipSeries([dateToEpoch(row[0]) for row in rows], [row[1] for row in rows], self.logger)
+    series.buildDryRunIndex()
+    try:
+      dbCursor = self.DB.cursor()
+      dbCursor.execute("DELETE FROM precip_dry_day_index WHERE platform_handle = ?", (platformHandle,))
+      dbCursor.executemany("INSERT INTO precip_dry_day_index (platform_handle,m_date,m_value,dry_count) VALUES(?,?,?,?)",
+                           [(platformHandle, rows[i][0], rows[i][1], int(series.dryRun[i])) for i in range(len(rows))])
+      dbCursor.close()
+      self.DB.commit()
+    except sqlite3.Error, e:
+      self.DB.rollback()
+      if(self.logger != None):
+        self.logger.error("Unable to rebuild the dry day index for: %s ErrMsg: %s" % (platformHandle, e.args[0]))
+      return(False)
+    return(True)
+
+  """
+  Function: updateDryDayIndex
+  Purpose: Adds daily summaries to the dry day index. When all of them are after the last summary in the index, the
+   run lengths are carried on from it in date order and appended, so the history isn't reread. If any of them are
+   on or before summaries already in the index, the gauge's index is rebuilt since the later run lengths change.
+  Parameters:
+    platformHandle is the rain gauge platform.
+    summaries is a list of (dateTime, rainfall) tuples for the summaries.
+  Return: True if successful, otherwise False.
+  """
+  def updateDryDayIndex(self, platformHandle, summaries):
+    secondsInDay = 24 * 60 * 60
+    if(self.createDryDayIndex() == False):
+      return(False)
+    summaries = sorted([(dateTime, float(rainfall)) for dateTime, rainfall in summaries if(rainfall != None)])
+    if(len(summaries) == 0):
+      return(True)
+    try:
+      dbCursor = self.DB.cursor()
+      dbCursor.execute("SELECT m_date,m_value,dry_count FROM precip_dry_day_index\
+                        WHERE platform_handle = ? ORDER BY m_date DESC LIMIT 1",
+                       (platformHandle,))
+      prevRow = dbCursor.fetchone()
+      backDated = (prevRow != None and summaries[0][0] <= prevRow[0])
+      for i in range(1, len(summaries)):
+        if(summaries[i][0] == summaries[i-1][0]):
+          backDated = True
+      if(backDated):
+        dbCursor.close()
+        return(self.rebuildDryDayIndex(platformHandle))
+      rows = []
+      for dateTime, rainfall in summaries:
+        dryCnt = 0
+        if(rainfall == 0.0):
+          dryCnt = 1
+          if(prevRow != None and prevRow[1] == 0.0):
+            if(prevRow[2] != -9999 and (dateToEpoch(dateTime) - dateToEpoch(prevRow[0])) <= secondsInDay):
+              dryCnt = prevRow[2] + 1
+            else:
+              dryCnt = -9999
+        prevRow = (dateTime, rainfall, dryCnt)
+        rows.append((platformHandle, dateTime, rainfall, dryCnt))
+      dbCursor.executemany("INSERT INTO precip_dry_day_index (platform_handle,m_date,m_value,dry_count) VALUES(?,?,?,?)", rows)
+      dbCursor.close()
+      self.DB.commit()
+    except sqlite3.Error, e:
+      self.DB.rollback()
+      if(self.logger != None):
+        self.logger.error("Unable to update the dry day index for: %s ErrMsg: %s" % (platformHandle, e.args[0]))
+      return(False)
+    return(True)
+
+  """
+  Function: getIndexedDryDaysCount
+  Purpose: Looks up the preceding dry day count for a rain gauge in the dry day index. Uses the same rules as
+   getPrecedingDryDaysCount, the search starts with the summary for 2 days prior since the summaries are stamped
+   at 23:59.
+  Parameters:
+    dateTime is the date we are looking for.
+    platformHandle is the rain gauge platform.
+  Return: The dry day count, -9999 if there was a missing day in the dry period, None if the index can't be used.
+  """
+  def getIndexedDryDaysCount(self, dateTime, platformHandle):
+    dryCnts = self.getIndexedDryDaysCounts([dateTime], platformHandle)
+    if(dryCnts == None):
+      return(None)
+    return(dryCnts[0])
+
+  """
+  Function: getIndexedDryDaysCounts
+  Purpose: Looks up the preceding dry day counts for a list of dates in the dry day index. Only the index rows from
+   the one the earliest date starts its search on up to the latest date are read, then each date is bisected into
+   them. If the gauge has nothing in the index yet, it is built first.
+  Parameters:
+    dateTimes is a list of the dates, YYYY-MM-DDTHH:MM:SS.
+    platformHandle is the rain gauge platform.
+  Return: A list of the dry day counts, -9999 if there was a missing day in the dry period, None if the index can't
+    be used.
+  """
+  def getIndexedDryDaysCounts(self, dateTimes, platformHandle):
+    secondsInDay = 24 * 60 * 60
+    if(self.createDryDayIndex() == False):
+      return(None)
+    anchors = [dateToEpoch(dateTime) for dateTime in dateTimes]
+    #The search for each date starts with the summary at or before 23:59 two days prior.
+    firstCutoff = time.strftime('%Y-%m-%dT23:59:00', time.gmtime(min(anchors) - 2 * secondsInDay))
+    lastCutoff = time.strftime('%Y-%m-%dT23:59:00', time.gmtime(max(anchors) - 2 * secondsInDay))
+    try:
+      dbCursor = self.DB.cursor()
+      dbCursor.execute("SELECT m_date FROM precip_dry_day_index WHERE platform_handle = ? LIMIT 1", (platformHandle,))
+      if(dbCursor.fetchone() == None):
+        if(self.rebuildDryDayIndex(platformHandle) == False):
+          dbCursor.close()
+          return(None)
+      dbCursor.execute("SELECT m_date,m_value,dry_count FROM precip_dry_day_index\
+                        WHERE platform_handle = ? AND m_date <= ? AND\
+                        m_date >= IFNULL((SELECT MAX(m_date) FROM precip_dry_day_index WHERE platform_handle = ? AND m_date <= ?), '')\
+                        ORDER BY m_date ASC",
+                       (platformHandle, lastCutoff, platformHandle, firstCutoff))
+      rows = dbCursor.fetchall()
+      dbCursor.close()
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("Dry day index lookup failed for: %s ErrMsg: %s" % (platformHandle, e.args[0]))
+      return(None)
+    #The index already has the run lengths, so hand them to the series instead of having it rebuild them.
+    series = precipSeries([dateToEpoch(row[0]) for row in rows], [row[1] for row in rows], self.logger)
+    series.dryRun = numpy.array([row[2] for row in rows], dtype=numpy.int64)
+    return(series.precedingDryDays(anchors))
+
+  """
+  Function: createFileCheckpointTable
+  Purpose: Creates the rain_gauge_file_checkpoint table if it doesn't exist. For each rain gauge file it holds how
+   far into the file we have processed and a checksum of that part of the file, so the next run only reads the
+   lines appended since.
+  Return: True if the table is ready, otherwise False.
+  """
+  def createFileCheckpointTable(self):
+    if(self.fileCheckpointReady):
+      return(True)
+    try:
+      dbCursor = self.DB.cursor()
+      dbCursor.execute("CREATE TABLE IF NOT EXISTS rain_gauge_file_checkpoint (\
+                        file_name TEXT PRIMARY KEY,\
+                        byte_offset INTEGER,\
+                        prefix_checksum INTEGER,\
+                        update_date TEXT)")
+      dbCursor.close()
+      self.DB.commit()
+      self.fileCheckpointReady = True
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("Unable to create the rain_gauge_file_checkpoint table. ErrMsg: %s" % (e.args[0]))
+      return(False)
+    return(True)
+
+  """
+  Function: getFileCheckpoint
+  Purpose: Returns the checkpoint saved for a rain gauge file.
+  Parameters:
+    fileName is the name of the file.
+  Return: A dictionary with the byteOffset and prefixChecksum, None if the file has no checkpoint.
+  """
+  def getFileCheckpoint(self, fileName):
+    if(self.createFileCheckpointTable() == False):
+      return(None)
+    sql = "SELECT byte_offset,prefix_checksum FROM rain_gauge_file_checkpoint WHERE file_name = ?"
+    try:
+      dbCursor = self.DB.cursor()
+      dbCursor.execute(sql, (fileName,))
+      row = dbCursor.fetchone()
+      dbCursor.close()
+      if(row != None):
+        return({'byteOffset' : int(row[0]), 'prefixChecksum' : int(row[1])})
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+    return(None)
+
+  """
+  Function: saveFileCheckpoint
+  Purpose: Saves how far into a rain gauge file we have processed. Call once the file's rows have been committed.
+  Parameters:
+    fileName is the name of the file.
+    byteOffset is the offset of the first byte not processed yet.
+    prefixChecksum is the crc32 of the file up to byteOffset.
+  Return: True if saved, otherwise False.
+  """
+  def saveFileCheckpoint(self, fileName, byteOffset, prefixChecksum):
+    if(self.createFileCheckpointTable() == False):
+      return(False)
+    sql = "INSERT OR REPLACE INTO rain_gauge_file_checkpoint (file_name,byte_offset,prefix_checksum,update_date)\
+           VALUES(?,?,?,?)"
+    try:
+      self.DB.execute(sql, (fileName, byteOffset, prefixChecksum, time.strftime('%Y-%m-%dT%H:%M:%S')))
+      self.DB.commit()
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      return(False)
+    return(True)
+
   """
   Function: getPrecedingRadarDryDaysCount
   Purpose: For the given date, this function calculates how many days previous had no rainfall, if any.
@@ -784,7 +1803,7 @@ class dhecDB(xeniaSQLite):
     
     iDryCnt = -9999
     platformHandle = "nws.%s.radar" %(rainGauge)
-    sensorId = xeniaSQLite.sensorExists(self,"precipitation_radar_weighted_average", "in", platformHandle)
+    sensorId = self.sensorExists("precipitation_radar_weighted_average", "in", platformHandle)
     if(sensorId != None and sensorId != -1):
       #We want to start our dry day search the day before our dateTime.
       sql = "SELECT m_date FROM multi_obs WHERE m_date < '%s' AND sensor_id=%d AND m_value > 0 ORDER BY m_date DESC LIMIT 1;"\
@@ -810,7 +1829,7 @@ class dhecDB(xeniaSQLite):
     """        
     secondsInDay = 24 * 60 * 60
     platformHandle = "nws.%s.radar" %(rainGauge)
-    mTypeID = xeniaSQLite.getMTypeFromObsName(self,"precipitation_radar_weighted_average","in",platformHandle,1)
+    mTypeID = self.getMTypeFromObsName("precipitation_radar_weighted_average","in",platformHandle,1)
     sql = "SELECT DISTINCT(strftime('%%Y-%%m-%%d', m_date)) AS m_date\
           FROM multi_obs WHERE \
           m_date <= strftime('%%Y-%%m-%%d', datetime('%s', '-1 day') ) AND \
@@ -908,7 +1927,7 @@ class dhecDB(xeniaSQLite):
   def calcRainfallIntensity(self, rainGauge, date, intervalInMinutes=10):
     rainfallIntensity = -9999.0
     platformHandle = 'dhec.%s.raingauge' % (rainGauge)
-    mTypeID = xeniaSQLite.getMTypeFromObsName(self, 'precipitation', 'in',platformHandle,1)
+    mTypeID = self.getMTypeFromObsName('precipitation', 'in',platformHandle,1)
     if(mTypeID != None):
       rainfallIntensity = self.calcIntensity( platformHandle, mTypeID, date, intervalInMinutes)
     else:
@@ -930,7 +1949,7 @@ class dhecDB(xeniaSQLite):
   def calcRadarRainfallIntensity(self, rainGauge, date, intervalInMinutes=60):
     rainfallIntensity = -9999.0
     platformHandle = 'nws.%s.radar' % (rainGauge)
-    mTypeID = xeniaSQLite.getMTypeFromObsName(self, 'precipitation_radar_weighted_average', 'in',platformHandle,1)
+    mTypeID = self.getMTypeFromObsName('precipitation_radar_weighted_average', 'in',platformHandle,1)
     if(mTypeID != None):
       rainfallIntensity = self.calcIntensity( platformHandle, mTypeID, date, intervalInMinutes)
       #We do not store radar data that has 0 for precipitation, so we want to make sure not to send
@@ -941,6 +1960,36 @@ class dhecDB(xeniaSQLite):
       self.logger.error("No m_type_id for: precipitation_radar_weighted_average(in) found for platform: %s" %(platformHandle))
     return(rainfallIntensity)
 
+  """
+  Function: getTideIndex
+  Purpose: Returns the tideLevelIndex for the tide station. The station's daily_tide_range rows are loaded the
+   first time it is asked for and kept for the life of the object.
+  Parameters:
+    tideStationID is the tide station id.
+  Return: The tideLevelIndex object.
+  """
+  def getTideIndex(self, tideStationID):
+    tideStationID = int(tideStationID)
+    if(tideStationID not in self.tideIndexes):
+      tideIndex = tideLevelIndex(tideStationID, self.logger)
+      if(tideIndex.loadFromDB(self.DB) == False):
+        self.rowErrorCnt += 1
+      elif(self.logger != None):
+        self.logger.debug("Loaded %d tide points for station: %d" % (len(tideIndex.epochs), tideStationID))
+      self.tideIndexes[tideStationID] = tideIndex
+    return(self.tideIndexes[tideStationID])
+
+  """
+  Function: getTideLevelsForDates
+  Purpose: For the given tide station, looks up the tide stage for a list of dates.
+  Parameters:
+    tideStationID is the station to retrieve the data from.
+    dates is a list of the dates, YYYY-MM-DDTHH:MM:SS, to retrieve.
+  Return: A list of the tide stages, -9999 for a date we don't have the tide for.
+  """
+  def getTideLevelsForDates(self, tideStationID, dates):
+    return(self.getTideIndex(tideStationID).getTideLevels(dates))
+
   """
   Function: getTideLevel
   Purpose: For the given tide station and date, this retrieves the tidal information.
@@ -950,58 +1999,7 @@ class dhecDB(xeniaSQLite):
     date is the date to retrieve.
   """    
   def getTideLevel(self, tideStationID, date):
-    tideLevel = -9999
-    #0 is Full stage, either Ebb or Flood, 100 is 1/4, 200 is 1/2 and 300 is 3/4. Below we add either
-    #the 2000 for flood or 4000 for ebb.
-    tideStages = [0, 100, 200, 300]
-    sql = "SELECT date,level,level_code FROM daily_tide_range \
-            WHERE station_id = %d AND ( date >= strftime( '%%Y-%%m-%%dT%%H:%%M:%%S', '%s', '-12 hours') AND \
-            date < strftime( '%%Y-%%m-%%dT%%H:%%M:%%S', '%s', '12 hours') ) \
-            ORDER BY date ASC" % (tideStationID, date, date) 
-    try:
-      epochT1 = time.mktime(time.strptime(date, '%Y-%m-%dT%H:%M:%S'))
-      prevTime = -1.0
-      curTime = -1.0
-      prevRow = []
-      dbCursor = self.DB.cursor()
-      dbCursor.execute(sql)
-      for row in dbCursor:
-        curTime = time.mktime(time.strptime(row['date'], '%Y-%m-%dT%H:%M:%S'))
-        if(prevTime != -1.0):
-          if((epochT1 >= prevTime) and 
-              (epochT1 < curTime)):
-              #Figure out if the tide is in Ebb or Flood
-              tideState = -1
-              prevLevel = float(prevRow['level'])
-              curLevel = float(row['level'])
-              if(prevLevel < curLevel):
-                tideState = 2000
-              else:
-                tideState = 4000
-              #Now figure out if it is 0, 1/4, 1/2, 3/4 stage. We divide the time between the 2 tide changes
-              #up into 4 pieces, then figure out where our query time falls.
-              totalTime = curTime - prevTime
-              qtrTime = totalTime / 4.0
-              tidePos = -1
-              
-              for i in range(0, 4):
-                if((epochT1 >= prevTime) and
-                    (epochT1 < (prevTime + qtrTime))):
-                   tidePost = i
-                   tideLevel = tideState + tideStages[i]
-                   return(tideLevel)
-                   
-                prevTime += qtrTime
-        prevRow = row
-        prevTime = curTime
-                
-    except sqlite3.Error, e:
-      self.rowErrorCnt += 1
-      if(self.logger != None):
-        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
-      else:
-        print("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
-    return(tideLevel)
+    return(self.getTideLevelsForDates(tideStationID, [date])[0])
   """
   Function: getPlatforms
   Purpose: Returns the platforms(rain gauges, monitoring stations) from the platforms table
@@ -1097,6 +2095,8 @@ class dhecDB(xeniaSQLite):
     sql = "DELETE FROM precipitation_radar WHERE collection_date < strftime('%%Y-%%m-%%dT%%H:%%M:%%S', '%s');" % (olderThanDate)
     dbCursor = self.executeQuery(sql)
     if(dbCursor != None):
+      #Keep the hour manifest in step with the radar table.
+      radarHourManifest(self.DB, self.logger).deleteOlderThan(olderThanDate)
       try:
         self.DB.commit()
         return(True)  
@@ -1153,6 +2153,10 @@ class dhecDB(xeniaSQLite):
     endTime is the starting time in YYYY-MM-DDTHH:MM:SS format.
   """
   def calculateWeightedAvg(self, watershedName, startTime, endTime):
+    #If the cell weights have been built for the watershed, use them instead of the spatial query.
+    weighted_avg = radarCellWeights(self.DB, self.logger).getWeightedAvg('boundaries', watershedName, startTime, endTime)
+    if(weighted_avg != None):
+      return(weighted_avg)
     weighted_avg = -9999
     #Get the percentages that the intersecting radar grid make up of the watershed boundary.      
     sql = "SELECT * FROM(\
@@ -1182,37 +2186,62 @@ class dhecDB(xeniaSQLite):
   
   """
   Function: importTideFile
-  Purpose: Imports the tide file passed in the tideFilePath string.
+  Purpose: Imports the tide file passed in the tideFilePath string. The file is parsed up front and the rows are
+   written with one parameterized executemany in a single transaction. Rows already in the table for a station and
+   date are replaced, so overlapping files can be imported.
   Parameters:
     tideFilePath is the fully qualified path the the file to import.
+  Return: True if the file was imported, otherwise False.
   """
   def importTideFile(self,tideFilePath):
     from dhecRainGaugeProcessing import processTideData
     
+    startTime = time.time()
     tideFile = processTideData()
-    tideFile.openFile(tideFilePath)
-    stationID, date, level, tideType = tideFile.readLine()
-    
-    while(stationID != None and stationID != ""):      
-      if(stationID != None):
-        #print( "ID: %s Date: %s Level: %f Type: %s" %(stationID, date, level, tideType))
+    if(tideFile.openFile(tideFilePath) == False):
+      if(self.logger != None):
+        self.logger.error("Unable to open tide file: %s" %(tideFilePath))
+      return(False)
+    tideRows = []
+    skippedCnt = 0
+    while(True):
+      try:
         stationID, date, level, tideType = tideFile.readLine()
-        sql = "INSERT INTO daily_tide_range (station_id,date,level,level_code)\
-                VALUES(%d,'%s',%f,'%s')"\
-                %(int(stationID),date,level,tideType)
-        dbCursor = self.executeQuery(sql)
-        if(dbCursor == None):
-          #We had an error, so we're going to bail.
-          return(None)
-        
-      else:
+      except ValueError, e:
+        #Bad date or level on the line.
+        skippedCnt += 1
         if(self.logger != None):
-          self.error("Error importing tide file: %s on line: %d" %(tideFilePath,tideFile.lineNo))
-        return(False)
-      
-      stationID, date, level, tideType = tideFile.readLine()
-    #Commit the entries into the database.
-    self.commit()
+          self.logger.error("Error importing tide file: %s on line: %d %s" %(tideFilePath,tideFile.lineNo,str(e)))
+        continue
+      if(stationID == None):
+        break
+      #Header and blank lines don't have the 5 columns.
+      if(stationID == ""):
+        skippedCnt += 1
+        continue
+      tideRows.append((int(stationID),date,level,tideType))
+    tideFile.tideFile.close()
+
+    sql = "INSERT OR REPLACE INTO daily_tide_range (station_id,date,level,level_code) VALUES(?,?,?,?)"
+    try:
+      dbCursor = self.DB.cursor()
+      dbCursor.executemany(sql, tideRows)
+      dbCursor.close()
+      #Commit the entries into the database.
+      self.DB.commit()
+    except sqlite3.Error, e:
+      self.DB.rollback()
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      else:
+        print("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      return(False)
+    #The tide indexes for the stations we loaded are out of date now.
+    for stationID in set([row[0] for row in tideRows]):
+      if(stationID in self.tideIndexes):
+        del self.tideIndexes[stationID]
+    if(self.logger != None):
+      self.logger.info("Imported %d tide points, skipped %d lines from: %s in %.3f seconds." %(len(tideRows),skippedCnt,tideFilePath,time.time()-startTime))
     return(True)  
   """
   Function: getAverageForObs\
@@ -1352,113 +2381,319 @@ class dhecDB(xeniaSQLite):
   """    
   def backupData(self, dbBackupFile, dbBackupSQLSchemaFile):
     self.logger.info("Beginning data backup/rollover.")
-    
-    curYear = time.strftime('%Y', time.localtime())
-    backupDB = None
-    filePath = "%s%s/" % (dbBackupFile, curYear)
-    backupFilename = "%s%s-dhec.db" % (filePath, curYear)
-    ################################################################################
-    #Test to see if the database exists.
-    if(not os.path.isfile(backupFilename)):    
-      #Check to see if the directory exists
-      if(not os.path.exists(filePath)):
-        os.mkdir(filePath)
-        self.logger.info("Directory: %s does not exist, creating." % (filePath))
-      
-      if(dbBackupSQLSchemaFile == None):  
-        self.logger.info("File: %s does not exist, cannot continue." % (backupFilename))
-        return
-      #We've got a SQL file to create the schema with.
-      else:
-        backupDB = dhecDB(backupFilename, "dhec_logger")
-        backupDB.DB.close()
-        shellCmd = "sqlite3 \"%s\" < \"%s\""%(backupFilename,dbBackupSQLSchemaFile)
-        ret = os.system(shellCmd)
-        self.logger.debug("Created database: %s with schema file: %s" %(backupFilename,dbBackupSQLSchemaFile))
-    else:
-      backupDB = dhecDB(backupFilename, "dhec_logger")
-      self.logger.info("Connecting to database: %s" % (backupFilename))
-
-    ################################################################################
-      
-    ################################################################################
-    #On a platform by platform basis, get all data that is not in the current month.    
-    dbCursor = self.getPlatforms()
     #Cutoff date, we want to keep last 30 days.      
     cutoffDate = time.strftime("%Y-%m-%dT00:00:00", time.localtime(time.time() - (30 * 24 * 60 * 60)))
-    #for platformHandle in platList:
-    for row in dbCursor: 
-      platformHandle = row['platform_handle']   
-      if(self.logger):
-        self.logger.info("Processing multi_obs table data for platform: %s" % (platformHandle))
-      sql = "SELECT m_date,m_lat, m_lon,m_z\
-                ,multi_obs.platform_handle \
-                ,obs_type.standard_name \
-                ,uom_type.standard_name as uom \
-                ,multi_obs.m_type_id \
-                ,m_value \
-                ,qc_level \
-                ,sensor.row_id as sensor_id\
-                ,sensor.s_order \
-              FROM multi_obs \
-                left join sensor on sensor.row_id=multi_obs.sensor_id \
-                left join m_type on m_type.row_id=multi_obs.m_type_id \
-                left join m_scalar_type on m_scalar_type.row_id=m_type.m_scalar_type_id \
-                left join obs_type on obs_type.row_id=m_scalar_type.obs_type_id \
-                left join uom_type on uom_type.row_id=m_scalar_type.uom_type_id \
-                WHERE m_date < '%s' AND\
-                multi_obs.platform_handle = '%s'\
-                ORDER BY m_date DESC" \
-                % (cutoffDate,platformHandle)        
-      resultsCursor = self.executeQuery(sql)
-      rowCnt = 0
-      if(resultsCursor != None):
-        for item in resultsCursor:
-          obsName = ''
-          uom = ''
-          mVals = []
-          mVals.append(float(item['m_value']))
-          z = item['m_z']
-          if(z == None):
-            z = 0
-          sOrder = item['s_order']
-          if(sOrder == None):
-            sOrder = 1
-          if(backupDB.addMeasurement(item['standard_name'], 
-                                     item['uom'],
-                                     platformHandle,
-                                     item['m_date'],
-                                     item['m_lat'], item['m_lon'],
-                                     z,
-                                     mVals,
-                                     sOrder,
-                                     False) != True):
-            if(self.logger):
-              self.logger.critical( "%s Function: %s Line: %d File: %s"\
-                                 %(backupDB.lastErrorMsg,backupDB.lastErrorFunc, backupDB.lastErrorLineNo, backupDB.lastErrorFile) )
-            
-          
-          rowCnt += 1               
-        if(not backupDB.commit()):
-          self.logger.error(backupDB.lastErrorMsg)
-          sys.exit(- 1)
-        self.logger.info("Successfully processed and committed: %d rows into backup." % (rowCnt))
-        resultsCursor.close()
-        
-        #Now we delete the records from the source DB.
-        self.logger.info("Deleting backed up records from source database.")
-        sql = "DELETE FROM multi_obs WHERE m_date < '%s' and platform_handle='%s'" % (cutoffDate, platformHandle)
-        resultsCursor = self.executeQuery(sql)
-        if(resultsCursor != None):
-          if(not self.commit()):
-            self.logger.error(self.lastErrorMsg)
-            sys.exit(- 1)
-        else:
-          self.logger.error(self.lastErrorMsg)
-          sys.exit(- 1)
-        resultsCursor.close()
-    dbCursor.close()
-   
+    if(self.archiveRollover(dbBackupFile, dbBackupSQLSchemaFile, cutoffDate) == -1):
+      sys.exit(- 1)
     self.logger.info("Finished data backup/rollover.")
 
+  """
+  Function: createArchiveDB
+  Purpose: Creates a yearly archive database with the schema file if it doesn't exist yet.
+  Parameters:
+    archiveFile is the archive database file.
+    schemaFile is the SQL file to create the schema with, if None the archive has to exist already.
+  Return: True if the archive exists, otherwise False.
+  """
+  def createArchiveDB(self, archiveFile, schemaFile):
+    if(os.path.isfile(archiveFile)):
+      return(True)
+    filePath = os.path.dirname(archiveFile)
+    #Check to see if the directory exists
+    if(len(filePath) and not os.path.exists(filePath)):
+      os.makedirs(filePath)
+      self.logger.info("Directory: %s does not exist, creating." % (filePath))
+    if(schemaFile == None):  
+      self.logger.error("File: %s does not exist and no schema file to create it with, cannot continue." % (archiveFile))
+      return(False)
+    shellCmd = "sqlite3 \"%s\" < \"%s\""%(archiveFile, schemaFile)
+    os.system(shellCmd)
+    if(not os.path.isfile(archiveFile)):
+      self.logger.error("Unable to create database: %s with schema file: %s" % (archiveFile, schemaFile))
+      return(False)
+    self.logger.debug("Created database: %s with schema file: %s" %(archiveFile, schemaFile))
+    return(True)
+
+  """
+  Function: createRolloverTable
+  Purpose: Creates the archive_rollover table if it doesn't exist. It holds how far the rollover into each archive
+   file has gotten, it is updated in the same transaction that moves the rows so an interrupted rollover picks up
+   after the last chunk that was committed.
+  Return: True if the table is ready, otherwise False.
+  """
+  def createRolloverTable(self):
+    if(self.rolloverTableReady):
+      return(True)
+    try:
+      dbCursor = self.DB.cursor()
+      dbCursor.execute("CREATE TABLE IF NOT EXISTS archive_rollover (\
+                        archive_file TEXT PRIMARY KEY,\
+                        cutoff_date TEXT,\
+                        last_m_date TEXT,\
+                        rows_moved INTEGER,\
+                        status TEXT,\
+                        update_date TEXT)")
+      dbCursor.close()
+      self.DB.commit()
+      self.rolloverTableReady = True
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("Unable to create the archive_rollover table. ErrMsg: %s" % (e.args[0]))
+      return(False)
+    return(True)
+
+  """
+  Function: getRolloverProgress
+  Purpose: Returns where the last rollover into an archive file got to.
+  Parameters:
+    archiveFile is the archive database file.
+  Return: A dictionary with the cutoffDate, lastMDate, rowsMoved and status('running' or 'done'), None if there
+    hasn't been a rollover into the file.
+  """
+  def getRolloverProgress(self, archiveFile):
+    if(self.createRolloverTable() == False):
+      return(None)
+    sql = "SELECT cutoff_date,last_m_date,rows_moved,status FROM archive_rollover WHERE archive_file = ?"
+    try:
+      dbCursor = self.DB.cursor()
+      dbCursor.execute(sql, (archiveFile,))
+      row = dbCursor.fetchone()
+      dbCursor.close()
+      if(row != None):
+        return({'cutoffDate' : row[0], 'lastMDate' : row[1], 'rowsMoved' : row[2], 'status' : row[3]})
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+    return(None)
+
+  """
+  Function: archiveRollover
+  Purpose: Moves the multi_obs rows older than the cutoff date into yearly archive databases, the rows for a year go
+   into <archiveDir><year>/<year>-dhec.db. The archive is ATTACHed and the rows are copied with INSERT...SELECT and
+   deleted with a DELETE, a chunk at a time. Each chunk is one transaction across both files: the copied rows are
+   counted in the archive before the source rows are deleted, and the progress is saved in archive_rollover, so if
+   the rollover is interrupted no rows are lost or left half copied and running it again with the same cutoff date
+   carries on from the last chunk.
+   The sensor and m_type ids are matched up by observation, uom, platform and s_order, rows for sensors that are
+   not in the archive stay in the live database.
+  Parameters:
+    archiveDir is the directory the yearly archive directories are in.
+    schemaFile is the SQL file used to create an archive that doesn't exist.
+    cutoffDate is the date, rows with an m_date before it are moved.
+    platforms is an optional list of platform handles to limit the rollover to.
+    observations is an optional list of (obsName, uom) tuples to limit the rollover to.
+    chunkSize is about how many rows are moved per transaction.
+  Return: The number of rows moved, -1 if there was an error.
+  """
+  def archiveRollover(self, archiveDir, schemaFile, cutoffDate, platforms=None, observations=None, chunkSize=10000):
+    #The metadata ids are left out since they refer to rows in the live database.
+    copyCols = "row_entry_date,row_update_date,platform_handle,sensor_id,m_type_id,m_date,m_lon,m_lat,m_z,\
+                m_value,m_value_2,m_value_3,m_value_4,m_value_5,m_value_6,m_value_7,m_value_8,\
+                qc_level,qc_flag,qc_level_2,qc_flag_2,d_label_theta,d_top_of_hour,d_report_hour"
+    selectCols = ",".join([{'sensor_id' : 'id_map.archive_sensor_id',
+                            'm_type_id' : 'id_map.archive_m_type_id'}.get(col.strip(), 'multi_obs.%s' % (col.strip()))
+                           for col in copyCols.split(',')])
+    chunkWhere = "FROM main.multi_obs multi_obs\
+                  JOIN temp.rollover_id_map id_map\
+                    ON id_map.sensor_id = multi_obs.sensor_id AND id_map.m_type_id = multi_obs.m_type_id\
+                  WHERE multi_obs.m_date > ? AND multi_obs.m_date <= ?"
+    mapWhere = []
+    mapParams = []
+    if(platforms != None):
+      mapWhere.append("src.platform_handle IN (%s)" % (",".join(["?"] * len(platforms))))
+      mapParams.extend(platforms)
+    if(observations != None):
+      mapWhere.append("(%s)" % (" OR ".join(["(src.obs_name = ? AND src.uom = ?)"] * len(observations))))
+      for obsName,uom in observations:
+        mapParams.extend([obsName, uom])
+    #If more than one archive sensor matches, the first one is used.
+    mapSQL = "INSERT OR IGNORE INTO temp.rollover_id_map (sensor_id,m_type_id,archive_sensor_id,archive_m_type_id)\
+              SELECT src.sensor_id,src.m_type_id,arc.sensor_id,arc.m_type_id\
+              FROM (%s) src JOIN (%s) arc\
+                ON arc.platform_handle = src.platform_handle AND arc.obs_name = src.obs_name AND\
+                   arc.uom = src.uom AND arc.s_order = src.s_order AND arc.num_types = src.num_types"\
+              % (sensorMetadataSQL % {'db' : 'main'}, sensorMetadataSQL % {'db' : 'archive'})
+    if(len(mapWhere)):
+      mapSQL += " WHERE %s" % (" AND ".join(mapWhere))
+    mapSQL += " ORDER BY arc.sensor_id ASC"
+
+    if(self.createRolloverTable() == False):
+      return(-1)
+    totalMoved = 0
+    startTime = time.time()
+    yearSQL = "SELECT MIN(m_date) FROM multi_obs WHERE m_date >= ? AND m_date < ?"
+    yearStart = ''
+    while(True):
+      #Find the next year with rows older than the cutoff, using the m_date index.
+      try:
+        dbCursor = self.DB.cursor()
+        dbCursor.execute(yearSQL, (yearStart, cutoffDate))
+        row = dbCursor.fetchone()
+        dbCursor.close()
+      except sqlite3.Error, e:
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], yearSQL))
+        return(-1)
+      if(row == None or row[0] == None):
+        break
+      year = int(row[0][0:4])
+      yearStart = "%04d-01-01T00:00:00" % (year + 1)
+      yearCutoff = min(yearStart, cutoffDate)
+      archiveFile = partitionFileName(archiveDir, year)
+      if(self.createArchiveDB(archiveFile, schemaFile) == False):
+        return(-1)
+      #Pick up where an interrupted rollover with the same cutoff left off. The dates are compared as text, so the
+      #start has to be a date string or sqlite would compare it as a number.
+      yearFirst = "%04d-01-01" % (year)
+      lastDate = yearFirst
+      rowsMoved = 0
+      progress = self.getRolloverProgress(archiveFile)
+      if(progress != None and progress['status'] == 'running' and progress['cutoffDate'] == cutoffDate):
+        lastDate = progress['lastMDate']
+        rowsMoved = progress['rowsMoved']
+        self.logger.info("Resuming rollover into: %s after: %s, %d rows already moved." % (archiveFile, lastDate, rowsMoved))
+      self.logger.info("Rolling rows before: %s over into: %s" % (yearCutoff, archiveFile))
+      try:
+        #ATTACH can't be run inside a transaction.
+        self.DB.commit()
+        dbCursor = self.DB.cursor()
+        sql = "ATTACH DATABASE ? AS archive"
+        dbCursor.execute(sql, (archiveFile,))
+        sql = "CREATE TEMP TABLE IF NOT EXISTS rollover_id_map (\
+               sensor_id INTEGER,\
+               m_type_id INTEGER,\
+               archive_sensor_id INTEGER,\
+               archive_m_type_id INTEGER,\
+               PRIMARY KEY(sensor_id, m_type_id))"
+        dbCursor.execute(sql)
+        sql = "DELETE FROM temp.rollover_id_map"
+        dbCursor.execute(sql)
+        sql = mapSQL
+        dbCursor.execute(sql, mapParams)
+        #Two live sensors going into the same archive sensor would collide in the archive, so their rows are left alone.
+        sql = "DELETE FROM temp.rollover_id_map WHERE archive_sensor_id IN\
+               (SELECT archive_sensor_id FROM temp.rollover_id_map GROUP BY archive_sensor_id HAVING COUNT(*) > 1)"
+        dbCursor.execute(sql)
+        sql = "INSERT OR REPLACE INTO archive_rollover (archive_file,cutoff_date,last_m_date,rows_moved,status,update_date)\
+               VALUES(?,?,?,?,'running',?)"
+        dbCursor.execute(sql, (archiveFile, cutoffDate, lastDate, rowsMoved, time.strftime('%Y-%m-%dT%H:%M:%S')))
+        self.DB.commit()
+
+        while(True):
+          #The last m_date of the next chunk. Going by m_date lets the index do the work, rows sharing the last
+          #m_date all go in the same chunk.
+          sql = "SELECT m_date FROM multi_obs WHERE m_date > ? AND m_date < ? ORDER BY m_date ASC LIMIT 1 OFFSET ?"
+          dbCursor.execute(sql, (lastDate, yearCutoff, chunkSize - 1))
+          row = dbCursor.fetchone()
+          if(row != None):
+            chunkEnd = row[0]
+          else:
+            #Last chunk, everything up to the cutoff.
+            sql = "SELECT MAX(m_date) FROM multi_obs WHERE m_date > ? AND m_date < ?"
+            dbCursor.execute(sql, (lastDate, yearCutoff))
+            chunkEnd = dbCursor.fetchone()[0]
+            if(chunkEnd == None):
+              break
+          sql = "SELECT COUNT(*) %s" % (chunkWhere)
+          dbCursor.execute(sql, (lastDate, chunkEnd))
+          chunkCnt = dbCursor.fetchone()[0]
+          if(chunkCnt):
+            sql = "INSERT OR IGNORE INTO archive.multi_obs (%s) SELECT %s %s" % (copyCols, selectCols, chunkWhere)
+            dbCursor.execute(sql, (lastDate, chunkEnd))
+            #Make sure every row in the chunk is in the archive before it is deleted. Rows the archive already had are
+            #counted too, they were ignored by the insert.
+            sql = "SELECT COUNT(*) %s AND EXISTS (SELECT 1 FROM archive.multi_obs archive_obs\
+                   WHERE archive_obs.m_date = multi_obs.m_date AND archive_obs.m_type_id = id_map.archive_m_type_id AND\
+                         archive_obs.sensor_id = id_map.archive_sensor_id)" % (chunkWhere)
+            dbCursor.execute(sql, (lastDate, chunkEnd))
+            archivedCnt = dbCursor.fetchone()[0]
+            if(archivedCnt != chunkCnt):
+              self.DB.rollback()
+              self.logger.error("Rollover into: %s only found %d of %d rows from: %s to: %s in the archive, rolled back."\
+                                % (archiveFile, archivedCnt, chunkCnt, lastDate, chunkEnd))
+              self.detachArchive()
+              return(-1)
+            sql = "DELETE FROM main.multi_obs WHERE row_id IN (SELECT multi_obs.row_id %s)" % (chunkWhere)
+            dbCursor.execute(sql, (lastDate, chunkEnd))
+            if(dbCursor.rowcount != chunkCnt):
+              self.DB.rollback()
+              self.logger.error("Rollover into: %s deleted %d of %d rows from: %s to: %s, rolled back."\
+                                % (archiveFile, dbCursor.rowcount, chunkCnt, lastDate, chunkEnd))
+              self.detachArchive()
+              return(-1)
+          rowsMoved += chunkCnt
+          totalMoved += chunkCnt
+          lastDate = chunkEnd
+          sql = "UPDATE archive_rollover SET last_m_date = ?, rows_moved = ?, update_date = ? WHERE archive_file = ?"
+          dbCursor.execute(sql, (lastDate, rowsMoved, time.strftime('%Y-%m-%dT%H:%M:%S'), archiveFile))
+          self.DB.commit()
+          self.logger.debug("Moved %d rows up to: %s into: %s" % (chunkCnt, lastDate, archiveFile))
+
+        #Rows that didn't match a sensor in the archive are left behind.
+        sql = "SELECT COUNT(*) FROM multi_obs WHERE m_date >= ? AND m_date < ?"
+        dbCursor.execute(sql, (yearFirst, yearCutoff))
+        leftCnt = dbCursor.fetchone()[0]
+        sql = "UPDATE archive_rollover SET status = 'done', update_date = ? WHERE archive_file = ?"
+        dbCursor.execute(sql, (time.strftime('%Y-%m-%dT%H:%M:%S'), archiveFile))
+        self.DB.commit()
+        dbCursor.close()
+      except sqlite3.Error, e:
+        self.DB.rollback()
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+        self.detachArchive()
+        return(-1)
+      self.detachArchive()
+      self.logger.info("Moved %d rows into: %s" % (rowsMoved, archiveFile))
+      if(leftCnt):
+        msg = "%d rows before: %s were not moved into: %s, their sensors are not in the archive or were not selected."\
+              % (leftCnt, yearCutoff, archiveFile)
+        #When the rollover is limited to some platforms or observations, the rest are expected to be left.
+        if(len(mapWhere)):
+          self.logger.info(msg)
+        else:
+          self.logger.error(msg)
+
+    #The rollover may have added partitions.
+    if(self.partitions != None):
+      self.partitions.refresh()
+    elapsed = time.time() - startTime
+    if(elapsed > 0):
+      self.logger.info("Rollover moved %d rows in %.1f seconds, %.1f rows/sec." % (totalMoved, elapsed, totalMoved / elapsed))
+    return(totalMoved)
+
+  """
+  Function: detachArchive
+  Purpose: Detaches the archive database archiveRollover attached.
+  """
+  def detachArchive(self):
+    try:
+      self.DB.commit()
+      self.DB.execute("DETACH DATABASE archive")
+    except sqlite3.Error, e:
+      self.logger.error("Unable to detach the archive database. ErrMsg: %s" % (e.args[0]))
+
+  """
+  Function: dropPartitionsBefore
+  Purpose: Expires the archived multi_obs rows by dropping the yearly partition files for the years that end on or
+   before a date, their archive_rollover progress is removed too.
+  Parameters:
+    archiveDir is the directory the yearly partition directories are in.
+    olderThanDate is the date, YYYY-MM-DDTHH:MM:SS.
+  Return: A list of the years dropped.
+  """
+  def dropPartitionsBefore(self, archiveDir, olderThanDate):
+    partitions = self.partitions
+    if(partitions == None or partitions.archiveDir != archiveDir):
+      partitions = yearPartitions(archiveDir, self.logger)
+    dropped = partitions.dropBefore(olderThanDate)
+    if(partitions != self.partitions):
+      partitions.close()
+    if(len(dropped) and self.createRolloverTable()):
+      sql = "DELETE FROM archive_rollover WHERE archive_file = ?"
+      try:
+        self.DB.executemany(sql, [(partitionFileName(archiveDir, year),) for year in dropped])
+        self.DB.commit()
+      except sqlite3.Error, e:
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+    return(dropped)
+
   
\ No newline at end of file
@@ -4,8 +4,10 @@ import array
 import struct
 import csv
 import time
+import zlib
 import optparse
 import logging
+import numpy
 import logging.handlers
 from collections import defaultdict  
 from lxml import etree
@@ -28,6 +30,32 @@ def procTraceback(excInfo):
   return(excMsgs[0] + excMsgs[1] + excMsgs[2])
 
 
+"""
+Function: columnToArray
+Purpose: Converts a column of strings from a csv file into a numpy array of floats.
+Parameters:
+  values is the list of strings.
+  missingValue is used for the empty strings.
+Return: A tuple of the float array and a boolean array marking the values that weren't numbers.
+"""
+def columnToArray(values, missingValue):
+  values = numpy.array(values, dtype=str)
+  empty = (values == '')
+  bad = numpy.zeros(len(values), dtype=bool)
+  try:
+    floats = numpy.where(empty, 'nan', values).astype(numpy.float64)
+  except ValueError:
+    #Do them one at a time to find the bad ones.
+    floats = numpy.empty(len(values), dtype=numpy.float64)
+    for i in range(len(values)):
+      try:
+        floats[i] = float(values[i]) if not empty[i] else numpy.nan
+      except ValueError:
+        floats[i] = numpy.nan
+        bad[i] = True
+  floats[empty] = missingValue
+  return(floats, bad)
+
 """
 Class: processTideData
 Purpose: This class reads a file from the tidesandcurrents NOAA site and parses the data line by line.
@@ -101,6 +129,9 @@ class readRainGaugeData:
     #Create and hook into the logger.
     self.logger = logging.getLogger("dhec_logger.readRainGaugeData")
     self.logger.info("creating an instance of readRainGaugeData")
+    self.startOffset = 0      #Byte offset in the file we started reading at.
+    self.endOffset = 0        #Byte offset of the end of the last line read.
+    self.prefixChecksum = 0   #crc32 of the file up to endOffset.
     
   
   """
@@ -108,14 +139,45 @@ class readRainGaugeData:
   Purpose: Opens the dhec csv file using a Python csv object.
   Parameters:
     filePath is the fully qualified path to the file we want to process
+    checkpoint is an optional dictionary with the byteOffset and prefixChecksum saved from the last time the file
+      was processed. If the file still starts with the same bytes, only the lines after byteOffset are read. If the
+      file is shorter or the checksum doesn't match, the file was truncated or replaced and it is read from the start.
+    completeLinesOnly if True, a last line without a newline is left for the next read since it may still be
+      being written.
   Return: True if the file was successfully opened, otherwise false. If an exception is thrown,
     an error message will be in self.lastErrorMsg
   """
-  def openFile(self, filePath):
+  def openFile(self, filePath, checkpoint=None, completeLinesOnly=False):
     self.filePath = filePath
+    self.startOffset = 0
+    self.prefixChecksum = 0
     try:
       #Open the file for reading in ascii mode.
-      self.file = csv.reader(open(self.filePath, "rb"))      
+      inFile = open(self.filePath, "rb")
+      if(checkpoint != None and checkpoint['byteOffset'] > 0):
+        prefix = inFile.read(checkpoint['byteOffset'])
+        if(len(prefix) == checkpoint['byteOffset'] and (zlib.crc32(prefix) & 0xffffffff) == checkpoint['prefixChecksum']):
+          self.startOffset = checkpoint['byteOffset']
+          self.prefixChecksum = checkpoint['prefixChecksum']
+        else:
+          self.logger.info("File: %s was truncated or replaced since it was last processed, reading the whole file." % (self.filePath))
+          inFile.seek(0)
+        prefix = None
+      newData = inFile.read()
+      inFile.close()
+      if(completeLinesOnly):
+        newData = newData[0:newData.rfind('\n') + 1]
+      self.endOffset = self.startOffset + len(newData)
+      self.prefixChecksum = zlib.crc32(newData, self.prefixChecksum) & 0xffffffff
+      self.lines = newData.splitlines(True)
+      self.file = csv.reader(self.lines)
+    except IOError, e:
+      self.lastErrorMsg = ('File %s: %s' % (self.filePath, e))
+      if(self.logger != None):
+        self.logger.error( "Exception occured:", exc_info=1 )
+      else:
+        print(traceback.print_exc())
+      return(False)
     except csv.Error, e:
       self.lastErrorMsg = ('file %s, line %d: %s' % (filename, self.file.line_num, e))
       if(self.logger != None):
@@ -204,6 +266,167 @@ class readRainGaugeData:
         print(traceback.print_exc())
             
     return(dataRow)
+
+  """
+  Function: readColumns
+  Purpose: Reads all the remaining rows from the opened csv file into arrays, one per column. The same rows
+   processLine accepts are accepted here. Most lines are plain numbers with no empty fields, so those are
+   grouped by column count and each group is converted with a single numpy.fromstring. Only the odd lines go
+   through the csv module one at a time. The dates are worked out with array arithmetic from the year, julian
+   day and time instead of a strptime per row.
+  Parameters:
+    utcOffset is the number of seconds to add to each date. The rain gauges are always on standard time, so
+      passing time.timezone converts them to UTC.
+  Return: A dictionary of lists keyed on ID, dateTime, batteryVoltage, programCode, rainfall, windSpeed, windDir
+    and lineNo, one entry per good row, and linesSkipped and lineCnt with the number of bad rows and total rows.
+  """
+  def readColumns(self, utcOffset=0):
+    lines = [line.rstrip('\r\n') for line in self.lines]
+    linesSkipped = 0
+    #Line indexes of the plain lines keyed on the number of columns, the rest are parsed with the csv module.
+    plainLines = {7 : [], 9 : []}
+    otherLines = []
+    for i in range(len(lines)):
+      line = lines[i]
+      colCnt = line.count(',') + 1
+      if(colCnt in plainLines and ',,' not in line and '"' not in line and line[0:1] != ',' and line[-1:] != ','):
+        plainLines[colCnt].append(i)
+      else:
+        otherLines.append(i)
+
+    lineNdx = []
+    blocks = []
+    for colCnt in plainLines:
+      ndxList = plainLines[colCnt]
+      if(len(ndxList) == 0):
+        continue
+      values = numpy.fromstring(','.join([lines[i] for i in ndxList]), dtype=numpy.float64, sep=',')
+      if(len(values) != len(ndxList) * colCnt):
+        #Something in there isn't a number, let the csv path sort it out.
+        otherLines.extend(ndxList)
+        continue
+      block = numpy.empty((len(ndxList), 11), dtype=numpy.float64)
+      block[:, 0:colCnt] = values.reshape(len(ndxList), colCnt)
+      if(colCnt == 7):
+        block[:, 7:9] = -1.0
+      block[:, 9] = (colCnt > 7)    #Has wind columns.
+      block[:, 10] = 0              #Rainfall missing.
+      lineNdx.extend(ndxList)
+      blocks.append(block)
+
+    otherLines.sort()
+    fields = [[] for i in range(9)]
+    otherNdx = []
+    hasWind = []
+    for i in otherLines:
+      try:
+        rows = list(csv.reader([lines[i]]))
+      except csv.Error, e:
+        self.logger.error("Line: %d could not be parsed: %s" % (i + 1, e))
+        linesSkipped += 1
+        continue
+      row = []
+      if(len(rows)):
+        row = rows[0]
+      if(len(row) == 0):
+        self.logger.debug('Empty row on line: %d moving to next row' % (i + 1))
+        linesSkipped += 1
+      elif(len(row) < 7):
+        self.logger.error("Row: '%s' does not have enough columns to process on line: %d moving to next row" % (row, i + 1))
+        linesSkipped += 1
+      elif(len(row) > 9):
+        self.logger.error("Row: '%s' has too many columns to process on line: %d moving to next row" % (row, i + 1))
+        linesSkipped += 1
+      elif(len(row[0]) == 0):
+        self.logger.error("ID field empty on line: %d in row: '%s'" % (i + 1, row))
+        linesSkipped += 1
+      elif(len(row[1]) == 0 or len(row[2]) == 0 or len(row[3]) == 0):
+        self.logger.error("Missing a date field on line: %d in row: '%s', moving to next row" % (i + 1, row))
+        linesSkipped += 1
+      else:
+        otherNdx.append(i)
+        for col in range(7):
+          fields[col].append(row[col])
+        #Are there more than rainfall values?
+        if(len(row) > 7):
+          fields[7].append(row[7])
+          fields[8].append(row[8] if len(row) > 8 else '')
+          hasWind.append(True)
+        else:
+          fields[7].append('')
+          fields[8].append('')
+          hasWind.append(False)
+    if(len(otherNdx)):
+      #Empty fields are -1 like the rainGaugeData defaults. Rows with something that isn't a number are marked
+      #with a NaN ID so they are dropped below.
+      block = numpy.empty((len(otherNdx), 11), dtype=numpy.float64)
+      for col in range(9):
+        values, bad = columnToArray(fields[col], -1.0)
+        block[:, col] = values
+        block[bad, 0] = numpy.nan
+      block[:, 9] = hasWind
+      block[:, 10] = [len(val) == 0 for val in fields[6]]
+      lineNdx.extend(otherNdx)
+      blocks.append(block)
+
+    if(len(blocks)):
+      data = numpy.concatenate(blocks)
+    else:
+      data = numpy.empty((0, 11), dtype=numpy.float64)
+    #Put the rows back in file order.
+    order = numpy.argsort(numpy.array(lineNdx, dtype=numpy.int64), kind='mergesort')
+    data = data[order]
+    lineNos = numpy.array(lineNdx, dtype=numpy.int64)[order] + 1
+
+    good = ~numpy.isnan(data[:, 0:4]).any(axis=1)
+    for ndx in numpy.flatnonzero(~good):
+      self.logger.error("Row on line: %d has a value that isn't a number, moving to next row" % (lineNos[ndx]))
+    for ndx in numpy.flatnonzero(good & (data[:, 10] != 0)):
+      self.logger.error("Rainfall field empty on line: %d" % (lineNos[ndx]))
+    ids = numpy.where(good, data[:, 0], 0).astype(numpy.int64)
+    years = numpy.where(good, data[:, 1], 0).astype(numpy.int64)
+    julianDays = numpy.where(good, data[:, 2], 0).astype(numpy.int64)
+    militaryTimes = numpy.where(good, data[:, 3], 0).astype(numpy.int64)
+
+    #Array entries 1-3 are: Year, Julien day, time in military minutes. There are 2400 time entries, one of them is
+    #the days summary, the other is another 10minute interval, these are for the previous day, so they become 23:59.
+    hours = militaryTimes // 100
+    minutes = militaryTimes - (hours * 100)
+    endOfDay = (hours == 24)
+    hours[endOfDay] = 23
+    minutes[endOfDay] = 59
+    leapYears = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    validDate = (julianDays >= 1) & (julianDays <= numpy.where(leapYears, 366, 365)) &\
+                (hours >= 0) & (hours < 24) & (minutes >= 0) & (minutes < 60) & (years >= 1970)
+    for ndx in numpy.flatnonzero(good & ~validDate):
+      self.logger.error("Invalid date on line: %d, moving to next row" % (lineNos[ndx]))
+    good &= validDate
+    for ndx in numpy.flatnonzero(good & (ids <= 0)):
+      self.logger.error('No record processed from line: %d' % (lineNos[ndx]))
+    good &= (ids > 0)
+    linesSkipped += len(good) - int(good.sum())
+
+    #Seconds since the epoch of January 1st of each year, then add the day and time.
+    yearStarts = numpy.clip(years - 1970, 0, None).astype('datetime64[Y]').astype('datetime64[D]').astype(numpy.int64)
+    epochs = ((yearStarts + julianDays - 1) * 86400) + (hours * 3600) + (minutes * 60) + utcOffset
+    dateTimes = numpy.datetime_as_string(epochs[good].astype('datetime64[s]'))
+
+    data = data[good]
+    windSpeeds = data[:, 7].tolist()
+    windDirs = data[:, 8].tolist()
+    for ndx in numpy.flatnonzero(data[:, 9] == 0):
+      windSpeeds[ndx] = None
+      windDirs[ndx] = None
+    return({'ID' : ids[good].tolist(),
+            'dateTime' : dateTimes.tolist(),
+            'batteryVoltage' : data[:, 4].tolist(),
+            'programCode' : data[:, 5].tolist(),
+            'rainfall' : data[:, 6].tolist(),
+            'windSpeed' : windSpeeds,
+            'windDir' : windDirs,
+            'lineNo' : lineNos[good].tolist(),
+            'linesSkipped' : linesSkipped,
+            'lineCnt' : len(lines)})
 ################################################################################################################  
 ################################################################################################################  
 class dhecConfigSettings(xmlConfigFile):
@@ -309,6 +532,9 @@ class processDHECRainGauges:
         sys.exit(- 1)                      
       self.logger.debug('Database path: %s' % (self.configSettings.dbSettings['dbName']))
       self.db = dhecDB(self.configSettings.dbSettings['dbName'],"dhec_logger")
+      #The rolled over rows are partitioned by year in the backup directory, the summaries query them as well.
+      if(self.configSettings.dbBackupFile != None):
+        self.db.usePartitions(self.configSettings.dbBackupFile)
             
       #Get a file list for the directory.
       if(self.configSettings.rainGaugeFileDir == None):
@@ -482,72 +708,55 @@ class processDHECRainGauges:
           startTime = time.clock()
         else:
           startTime = time.time()
-        try:
-          fullPath = self.configSettings.rainGaugeFileDir + file
+        fullPath = self.configSettings.rainGaugeFileDir + file
+        
+        #self.logger.info("^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^")
+        #Make sure we are trying to process a file and not a directory.
+        if(os.path.isfile(fullPath) != True):
+          self.logger.debug("%s is not a file, skipping" % (fullPath))
+          continue
           
-          #self.logger.info("^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^")
-          #Make sure we are trying to process a file and not a directory.
-          if(os.path.isfile(fullPath) != True):
-            self.logger.debug("%s is not a file, skipping" % (fullPath))
-            continue
-            
-          self.logger.info("Begin processing file: %s" % fullPath)
-          rainGaugeFile = readRainGaugeData()
-          rainGaugeFile.openFile(fullPath)
-          dataRow = rainGaugeFile.processLine()
-          #Get the row id and the summary id.
-          rainGaugeId = file.split('.')
-          self.writeSummaryTable = False
-          while(dataRow != None):
-            if(dataRow.ID > 0):
-              #DHEC doesn't reset the time on the rain gauges to deal with daylight savings.
-              #Since we want to store the data using GMT times, we need to correct when we aren't in 
-              #DST.
-              dataTime = time.strptime(dataRow.dateTime, '%Y-%m-%dT%H:%M:%S')
-              dataTime = time.mktime(time.strptime(dataRow.dateTime, '%Y-%m-%dT%H:%M:%S'))              
-              #If it is DST, we need to add an hour to get the correct time when we convert to GMT, otherwise
-              #we'll be an hour off.             
-              if(time.localtime(dataTime)[-1]):
-                #3600 = number of seconds in 1 hour.
-                dataTime += 3600 
-              dataRow.dateTime = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(dataTime))      
-                
-              #The idea behind this is that there are 2 ID types in the data. One with a signature of xx1 is a normal
-              #10 minute interval sample, one with an xx2 signature is the 24 hour summary. So if the first bit is
-              #set, my assumption is that it's a 10 minute sample.
-              updateType = dataRow.ID & 1
-              if(updateType == 1):
-                if(self.db.writePrecip(dataRow.dateTime, rainGaugeId[0].lower(), dataRow.batteryVoltage, dataRow.programCode, dataRow.rainfall, dataRow.windSpeed, dataRow.windDir) == False):
-                  self.logger.error('Failed to write the precipitation data into the database. File Line: %d' % rainGaugeFile.file.line_num)
-                  self.dbRowsNotInserted += 1                           
-              elif(updateType == 0):
-                if(self.db.write24HourSummary(dataRow.dateTime, rainGaugeId[0].lower(), dataRow.rainfall) == False):
-                  self.logger.error('Failed to write the summary precipitation data into the database. File Line: %d' % rainGaugeFile.file.line_num)
-                  self.dbRowsNotInserted += 1                           
-              else:
-                  self.logger.error('File Line: %d ID: %d is not valid' % (rainGaugeFile.file.line_num, dataRow.ID))
-                  self.linesSkipped += 1                           
-            else:
-              self.logger.error('No record processed from line: %d' % rainGaugeFile.file.line_num)
-              self.linesSkipped += 1                           
-                                      
-            dataRow = rainGaugeFile.processLine()
-         
-        except StopIteration, e:
-          if(self.linesSkipped):
-            self.logger.error('Unable to process: %d lines out of %d lines' % (self.linesSkipped, rainGaugeFile.file.line_num))
-            self.totalLinesUnprocd += self.linesSkipped
+        self.logger.info("Begin processing file: %s" % fullPath)
+        rainGaugeFile = readRainGaugeData()
+        #The files are only appended to, so we pick up where we left off last time.
+        rainGaugeFile.openFile(fullPath, self.db.getFileCheckpoint(file), True)
+        if(rainGaugeFile.startOffset):
+          self.logger.info("Skipping the first %d bytes of the file, already processed." % (rainGaugeFile.startOffset))
+        #Get the row id and the summary id.
+        rainGaugeId = file.split('.')
+        self.writeSummaryTable = False
+        #DHEC doesn't reset the time on the rain gauges to deal with daylight savings, they stay on standard time.
+        #Since we want to store the data using GMT times, the standard time offset is added to every row.
+        gaugeData = rainGaugeFile.readColumns(time.timezone)
+        self.linesSkipped = gaugeData['linesSkipped']
+        #The whole file is written as one batch.
+        writeFailed = False
+        if(len(gaugeData['ID'])):
+          self.dbRowsNotInserted = self.db.writeRainGaugeData(rainGaugeId[0].lower(), gaugeData)
+          if(self.dbRowsNotInserted == -1):
+            self.logger.error('Failed to write the precipitation data into the database.')
+            self.dbRowsNotInserted = len(gaugeData['ID'])
+            writeFailed = True
           else:
-            self.logger.info('Total lines processed: %d' % rainGaugeFile.file.line_num)
-          self.logger.info('EOF file: %s.' % file)
-          self.totalLinesProcd += rainGaugeFile.file.line_num
-          
+            self.logger.debug('Wrote %d rows at %.1f rows/sec.' % (self.db.lastBatchStats['written'], self.db.lastBatchStats['rowsPerSec']))
+
+        if(self.linesSkipped):
+          self.logger.error('Unable to process: %d lines out of %d lines' % (self.linesSkipped, gaugeData['lineCnt']))
+          self.totalLinesUnprocd += self.linesSkipped
+        else:
+          self.logger.info('Total lines processed: %d' % gaugeData['lineCnt'])
+        self.logger.info('EOF file: %s.' % file)
+        self.totalLinesProcd += gaugeData['lineCnt']
+        
         fileProcdCnt += 1
         try:
           #self.db.writeJunkTest( '00-00-00T00:00:00', 'TEST',-1,-1,-1)
           #Commit all the entries into the database for this file.
           self.logger.debug('Committing SQL inserts')
           self.db.commit()
+          #If the batch failed, leave the checkpoint alone so the lines are read again next run.
+          if(writeFailed == False):
+            self.db.saveFileCheckpoint(file, rainGaugeFile.endOffset, rainGaugeFile.prefixChecksum)
           if(self.dbRowsNotInserted):
             self.logger.error('Unable to insert: %d rows into the database.' % self.dbRowsNotInserted)
           endTime = 0.0
@@ -580,6 +789,8 @@ class processDHECRainGauges:
       self.logger.debug("Inserted %d rows into the database" % (self.db.totalRowsProcd))
       
     self.logger.debug("Total Processing Time: %f msecs" % (self.totalTime))
+    cacheStats = self.db.getMetadataCacheStats()
+    self.logger.debug("Metadata cache hits: %d misses: %d" % (cacheStats['hits'], cacheStats['misses']))
     
   """
   Function: vacuumDB
@@ -725,39 +936,6 @@ class processDHECRainGauges:
   """    
   def backupData(self):
     self.logger.info("Beginning data backup/rollover.")
-    
-    curYear = time.strftime('%Y', time.localtime())
-    backupDB = None
-    filePath = "%s%s/" % (self.configSettings.dbBackupFile, curYear)
-    backupFilename = "%s%s-dhec.db" % (filePath, curYear)
-    ################################################################################
-    #Test to see if the database exists.
-    if(not os.path.isfile(backupFilename)):    
-      #Check to see if the directory exists
-      if(not os.path.exists(filePath)):
-        os.mkdir(filePath)
-        self.logger.info("Directory: %s does not exist, creating." % (filePath))
-      
-      if(self.configSettings.dbBackupSQLSchemaFile == None):  
-        self.logger.info("File: %s does not exist, cannot continue." % (backupFilename))
-        return;
-      #We've got a SQL file to create the schema with.
-      else:
-        backupDB = dhecDB(backupFilename, "dhec_logger")
-        backupDB.DB.close()
-        shellCmd = "sqlite3 \"%s\" < \"%s\""%(backupFilename,self.configSettings.dbBackupSQLSchemaFile)
-        ret = os.system(shellCmd)
-        self.logger.debug("Created database: %s with schema file: %s" %(backupFilename,self.configSettings.dbBackupSQLSchemaFile))
-    else:
-      backupDB = dhecDB(backupFilename, "dhec_logger")
-      self.logger.info("Connecting to database: %s" % (backupFilename))
-
-    sys.exit(-1)
-
-    ################################################################################
-      
-    ################################################################################
-    #On a platform by platform basis, get all data that is not in the current month.    
     dbCursor = self.db.getRainGauges()
     gaugeList = []
     for row in dbCursor:    
@@ -765,88 +943,15 @@ class processDHECRainGauges:
     dbCursor.close()
     #Cutoff date, we want to keep last 30 days.      
     cutoffDate = time.strftime("%Y-%m-%dT00:00:00", time.localtime(time.time() - (30 * 24 * 60 * 60)))
-    for platformHandle in gaugeList:
-      #Get the m_types for the sensors we will roll over into the backup database.
-      #(self, obsName, uom, platform, sOrder=1 ):
-      mTypeList = '('
-      precipMType = self.db.getMTypeFromObsName( "precipitation", "in", platformHandle, 1)
-      mTypeList += "m_type_id=%d "%(precipMType)
-      precipDailySum = self.db.getMTypeFromObsName( "precipitation_accumulated_daily", "in", platformHandle, 1)
-      if(precipDailySum != None):
-        mTypeList += "OR m_type_id=%d "%(precipDailySum)       
-      windSpd = self.db.getMTypeFromObsName( "wind_speed", "mph", platformHandle, 1)
-      if(windSpd != None):
-        mTypeList += "OR m_type_id=%d "%(windSpd)
-      windDir = self.db.getMTypeFromObsName( "wind_from_direction", "degrees_true", platformHandle, 1)
-      if(windDir != None):
-        mTypeList += "OR m_type_id=%d"%(windDir)
-      
-      if( len(mTypeList) <= 0 ):
-        self.logger.error("No m_type_ids found for platform: %s" % (platformHandle))
-        return
-      else:
-        mTypeList += ") AND "
-      self.logger.info("Processing multi_obs table data for platform: %s" % (platformHandle))
-      sql = "SELECT * FROM multi_obs\
-             WHERE\
-             m_date < '%s' AND\
-             %s\
-             platform_handle='%s' ORDER BY m_date ASC"\
-             %(cutoffDate, mTypeList, platformHandle) 
-      resultsCursor = self.db.executeQuery(sql)
-      rowCnt = 0
-      if(resultsCursor != None):
-        for item in resultsCursor:
-          obsName = ''
-          uom = ''
-          mVals = []
-          mVals.append(float(item['m_value']))
-          if( int(item['m_type_id']) == precipMType ):
-            obsName = 'precipitation'
-            uom = 'in'
-            mVals.append(float(item['m_value_2']))
-            mVals.append(float(item['m_value_3']))
-          elif( int(item['m_type_id']) == precipDailySum ):
-            obsName = 'precipitation_accumulated_daily'
-            uom = 'in'
-          elif( int(item['m_type_id']) == windSpd ):
-            obsName = 'wind_speed'
-            uom = 'mph'
-          elif( int(item['m_type_id']) == windDir ): 
-            obsName = 'wind_from_direction'
-            uom = 'degrees_true'
-          if(backupDB.addMeasurement(obsName, uom,
-                                     platformHandle,
-                                     item['m_date'],
-                                     item['m_lat'], item['m_lon'],
-                                     0,
-                                     mVals,
-                                     1,
-                                     False) != True):
-            self.logger.critical( "%s Function: %s Line: %s File: %s"\
-                               %(backupDB.lastErrorMsg,backupDB.lastErrorFunc, backupDB.lastErrorLineNo, backupDB.lastErrorFile) )
-            return
-          
-          rowCnt += 1               
-        if(not backupDB.commit()):
-          self.logger.error(backupDB.lastErrorMsg)
-          sys.exit(- 1)
-        self.logger.info("Successfully processed and committed: %d rows into backup." % (rowCnt))
-        resultsCursor.close()
-        
-        #Now we delete the records from the source DB.
-        self.logger.info("Deleting backed up records from source database.")
-        sql = "DELETE FROM multi_obs WHERE m_date < '%s' and platform_handle='%s'" % (cutoffDate, platformHandle)
-        resultsCursor = self.db.executeQuery(sql)
-        if(resultsCursor != None):
-          if(not self.db.commit()):
-            self.logger.error(self.db.lastErrorMsg)
-            sys.exit(- 1)
-        else:
-          self.logger.error(self.db.lastErrorMsg)
-          sys.exit(- 1)
-        resultsCursor.close()
-        
+    #Only the rain gauge observations are rolled over.
+    observations = [('precipitation', 'in'),
+                    ('precipitation_accumulated_daily', 'in'),
+                    ('wind_speed', 'mph'),
+                    ('wind_from_direction', 'degrees_true')]
+    if(self.db.archiveRollover(self.configSettings.dbBackupFile, self.configSettings.dbBackupSQLSchemaFile,
+                               cutoffDate, gaugeList, observations) == -1):
+      self.logger.error("Rain gauge data backup/rollover failed.")
+      return
     self.logger.info("Finished data backup/rollover.")
 
   def checkForPlatformAndSensor(self, orgInfo, platformInfo, sensorList, addUOMandSensor=False):
@@ -906,6 +1011,9 @@ class processDHECRainGauges:
       stationList = []
       for platform in dbCursor:
         stationList.append(platform['short_name'])
+      #The stations and dates imported, used to build the station summaries once the file is loaded.
+      summaryStations = {}
+      summaryDates = []
       
       self.logger.debug("Beginning import of file: %s" %(bacteriaFilename))      
       line = inDataFile.readline()
@@ -965,13 +1073,14 @@ class processDHECRainGauges:
             else:
               self.logger.critical("%s" %(self.db.getErrorInfo()))          
             if(addStationSummary):
-              self.db.writeSummaryForStation(date, mtime, station, False)
+              summaryStations[station] = True
+              summaryDates.append(date)
         row += 1
         line = inDataFile.readline()
         
       self.logger.debug("Processed: %d lines from the file: %s" %(row,bacteriaFilename))
-      if(addStationSummary):
-        self.db.commit()
+      if(addStationSummary and len(summaryDates)):
+        self.db.rebuildStationSummaries(min(summaryDates), max(summaryDates), summaryStations.keys())
     except Exception, e:
       self.logger.critical("Error: ", exc_info=1)
       return(False)
@@ -992,6 +1101,10 @@ if __name__ == '__main__':
                       help="Import a csv bacteria file from the given filepath." )
     parser.add_option("-s", "--AddStationSummaryEntry", dest="addStationSummaryEntry", action= 'store_true',
                       help="While importing a bacteria file, this flag specifies to create a station summary entry also." )
+    parser.add_option("-r", "--RebuildStationSummary", dest="rebuildStationSummary",
+                      help="Rebuild the station summaries for the date range given as YYYY-MM-DD,YYYY-MM-DD." )
+    parser.add_option("-l", "--StationList", dest="stationList",
+                      help="Comma separated list of the stations to rebuild the summaries for. If not given, all the stations are rebuilt." )
     (options, args) = parser.parse_args()
     if( options.xmlConfigFile == None ):
       parser.print_usage()
@@ -1008,6 +1121,13 @@ if __name__ == '__main__':
       if(options.addStationSummaryEntry != None and options.addStationSummaryEntry):
         addSummary = True
       dhecData.importBacteriaData(options.bacteriaDataFile, addSummary)
+
+    elif(options.rebuildStationSummary != None and len(options.rebuildStationSummary)):
+      startDate,endDate = options.rebuildStationSummary.split(',')
+      stations = None
+      if(options.stationList != None and len(options.stationList)):
+        stations = options.stationList.split(',')
+      dhecData.db.rebuildStationSummaries(startDate, endDate, stations)
       
       
   except Exception, E:
@@ -34,7 +34,7 @@ import re
 if(sys.platform == "win32"):
   sys.path.insert(0, "C:\Documents and Settings\dramage\workspace\BeachAdvisory")
 #from xmrgFile import xmrgFile,processXMRGData,hrapCoord,LatLong
-from xmrgFile import xmrgFile,hrapCoord,LatLong
+from xmrgFile import xmrgFile,hrapCoord,LatLong,hrapMeshCache,precipRadarLoader,radarCellWeights,radarHourManifest,decodeXMRGFile,xmrgImportPipeline
 from processXMRGFile import processXMRGData
 from dhecDB import dhecDB
 #from dhecRainGaugeProcessing import processDHECRainGauges
@@ -119,6 +119,28 @@ class dhecXMRGProcessing(processXMRGData):
       else:
         self.deleteSourceFile = 0
 
+      #Flag to specify if compressed XMRG files are read directly from the gzip stream instead of being
+      #uncompressed to a file first.
+      self.streamCompressedFiles = self.configSettings.getEntry('//xmrgData/processingSettings/streamCompressedFiles')
+      if(self.streamCompressedFiles != None):
+        self.streamCompressedFiles = int(self.streamCompressedFiles)
+      else:
+        self.streamCompressedFiles = 0
+
+      #Directory to save the HRAP cell corner meshes in. If not provided, the meshes are only cached
+      #for the life of this object.
+      meshCacheDir = self.configSettings.getEntry('//xmrgData/processingSettings/meshCacheDir')
+      if(meshCacheDir != None and len(meshCacheDir) == 0):
+        meshCacheDir = None
+      self.meshCache = hrapMeshCache(meshCacheDir, self.logger)
+
+      #Number of worker processes to decode the files with when importing a directory.
+      self.importWorkerCount = self.configSettings.getEntry('//xmrgData/processingSettings/importWorkerCount')
+      if(self.importWorkerCount != None and len(self.importWorkerCount)):
+        self.importWorkerCount = int(self.importWorkerCount)
+      else:
+        self.importWorkerCount = 1
+
       #Directory to import XMRG files from 
       self.importDirectory = self.configSettings.getEntry('//xmrgData/processingSettings/importDirectory')
       if(self.importDirectory != None):
@@ -158,13 +180,15 @@ class dhecXMRGProcessing(processXMRGData):
       
       startMonth = 'Apr'
       endMonth   = 'Oct'
-      #Get a list of the files in the import dir.
+      #Get a list of the files in the import dir. We sort them so the files are always written in the same order.
       fileList = os.listdir(importDirectory)
+      fileList.sort()
       #If we want to skip certain months, let's pull those files out of the list.
       monthList = {'Jan': 1, 'Feb': 2, 'Mar': 3, "Apr": 4, "May": 5, "Jun": 6, "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12 }
       startMonth = monthList[startMonth]
       endMonth = monthList[endMonth]
               
+      paramsList = []
       for fileName in fileList:    
         fileTime = self.getCollectionDateFromFilename(fileName)
         #Get the month from the time.
@@ -178,10 +202,22 @@ class dhecXMRGProcessing(processXMRGData):
         if(os.path.isfile(fullPath) != True):
           self.logger.debug("%s is not a file, skipping" % (fullPath))
           continue          
-        if( self.processXMRGFile(fullPath, db)):
+        paramsList.append(self.getDecodeParams(fullPath, self.minLL, self.maxLL))
+        
+      #The workers decode the files, we do the database writes here as the results come back in order.
+      def writeResult(result):
+        fileName = os.path.basename(result['fileName'])
+        if(self.processDecodedFile(result, db)):
           self.logger.debug("Successfully processed: %s" %(fileName))
-        else:
-          self.logger.error("Unable to process: %s" %(fileName))
+          return(True)
+        self.logger.error("Unable to process: %s" %(fileName))
+        return(False)
+      if( self.minLL != None and 
+          self.maxLL != None ):
+        self.logger.debug( "Using BBOX. LL-Latitude %f LL-Longitude: %f UR-Latitude: %f UR-Longitude: %f"\
+                            %(self.minLL.latitude,self.minLL.longitude,self.maxLL.latitude,self.maxLL.longitude))
+      pipeline = xmrgImportPipeline(self.importWorkerCount, self.logger)
+      pipeline.run(paramsList, writeResult)
       db.DB.close()                
     except Exception, E:
       self.lastErrorMsg = str(E) 
@@ -249,18 +285,10 @@ class dhecXMRGProcessing(processXMRGData):
           #This is incorrect, was building the list with local time where data in the database is in UTC.
           #datetime = time.strftime("%Y-%m-%dT%H:00:00", time.localtime(baseTime - ((x+1) * 3600)))          
           #dateList.append(datetime)
-        sql = "SELECT DISTINCT(collection_date) as date FROM precipitation_radar ORDER BY collection_date DESC;"
-        dbCursor = db.executeQuery(sql)
-        if(dbCursor != None):
-          #Now we'll loop through and pull any date from the database that matches a date in our list
-          #from the list. This gives us our gaps.
-          for row in dbCursor:
-            dbDate = row['date'] 
-            for x in range(len(dateList)):
-              if(dbDate == dateList[x]):
-                dateList.pop(x)
-                break          
-          dbCursor.close()
+        #The manifest has a row for every hour we've loaded, so the gaps are the hours in our list it doesn't have.
+        missingHours = radarHourManifest(db.DB, self.logger).getMissingHours(dateList)
+        if(missingHours != None):
+          dateList = missingHours
                     
       if(self.logger != None):
         self.logger.debug( "Date/times missing in XMRG database: %s" % (dateList))
@@ -300,6 +328,46 @@ class dhecXMRGProcessing(processXMRGData):
       if(self.writeShapefile( fileName, self.minLL, self.maxLL ) == False):
         return(False)
     return(True)
+
+  """
+  Function: processDecodedFile
+  Purpose: Same as processXMRGFile for a file that has already been decoded by decodeXMRGFile.
+  Parameters:
+    result is the dictionary returned from decodeXMRGFile.
+    db is the dhecDB object to write to.
+  Return: True if successful, otherwise False.
+  """
+  def processDecodedFile(self, result, db):
+    if(self.writePrecipToDB):
+      if(self.writeDecodedFile( result, db, self.minLL, self.maxLL ) == False):
+        return(False)
+    if(self.writePrecipToShapefile):
+      if(self.writeShapefile( result['fileName'], self.minLL, self.maxLL ) == False):
+        return(False)
+    return(True)
+
+  """
+  Function: getDecodeParams
+  Purpose: Builds the decodeXMRGFile parameters for a file from our settings.
+  Parameters:
+    fileName is the full path to the XMRG file.
+    minLatLong, maxLatLong are the LatLong objects for the bounding box.
+  Return: The parameter dictionary.
+  """
+  def getDecodeParams(self, fileName, minLatLong=None, maxLatLong=None):
+    #In the binary file, the data is stored as hundreths of mm, if we want to write the data as 
+    #inches , need to divide by 2540.
+    return({'fileName' : fileName,
+            'streamCompressed' : self.streamCompressedFiles,
+            'minLatLong' : minLatLong,
+            'maxLatLong' : maxLatLong,
+            #This is the database insert datetime.           
+            'insertDate' : time.strftime( "%Y-%m-%dT%H:%M:%S", time.localtime() ),
+            'dataConvert' : 25.4 * 100.0,
+            'saveAllPrecipVals' : self.saveAllPrecipVals,
+            'meshCacheDir' : self.meshCache.cacheDir,
+            'deleteSourceFile' : self.deleteSourceFile,
+            'deleteCompressedSourceFile' : self.deleteCompressedSourceFile})
   
   """
   def cleanUp(self, fileName):
@@ -344,11 +412,13 @@ class dhecXMRGProcessing(processXMRGData):
     #DWR 2012-10-29  
     retVal = True
     xmrg = xmrgFile( self.configSettings.loggerName )
-    xmrg.openFile( fileName )
+    xmrg.openFile( fileName, self.streamCompressedFiles )
     if( xmrg.readFileHeader() ):     
       self.logger.debug( "File Origin: X %d Y: %d Columns: %d Rows: %d" %(xmrg.XOR,xmrg.YOR,xmrg.MAXX,xmrg.MAXY))
       try:        
-        if( xmrg.readAllRows() ):
+        #Only decode the part of the grid covering the bbox.
+        if( xmrg.readWindow(minLatLong, maxLatLong) ):
+          self.logger.debug( "File: %s Bytes read: %d Decode time: %f seconds" %(fileName,xmrg.bytesRead,xmrg.decodeTime))
           
           spatialReference = osgeo.osr.SpatialReference()
           spatialReference.ImportFromProj4('+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs')
@@ -424,21 +494,15 @@ class dhecXMRGProcessing(processXMRGData):
           dataConvert = 100.0 
           dataConvert = 25.4 * dataConvert 
 
-          #If we are using a bounding box, let's get the row/col in hrap coords.
-          llHrap = None
-          urHrap = None
-          startCol = 0
-          startRow = 0
-          if( minLatLong != None and maxLatLong != None ):
-            llHrap = xmrg.latLongToHRAP(minLatLong,True,True)
-            urHrap = xmrg.latLongToHRAP(maxLatLong,True,True)
-            startCol = llHrap.column
-            startRow = llHrap.row
+          #The grid only holds the window covering the bbox, so row and col are offset by the
+          #start of the window to get the position in the file grid.
+          endRow = xmrg.gridStartRow + xmrg.grid.shape[0]
+          endCol = xmrg.gridStartCol + xmrg.grid.shape[1]
           recsAdded = 0
           featureId = 0
-          for row in range(startRow,xmrg.MAXY):
-            for col in range(startCol,xmrg.MAXX):
-              val = xmrg.grid[row][col]
+          for row in range(xmrg.gridStartRow,endRow):
+            for col in range(xmrg.gridStartCol,endCol):
+              val = xmrg.grid[row - xmrg.gridStartRow][col - xmrg.gridStartCol]
               #If there is no precipitation value, or the value is erroneous 
               if( val <= 0 ):
                 if(self.saveAllPrecipVals):
@@ -526,117 +590,64 @@ class dhecXMRGProcessing(processXMRGData):
         if(self.logger != None):
           self.logger.debug("Error loading: %s Error: %s" %(self.configSettings.spatiaLiteLib,db.lastErrorMsg))
 
-    xmrg = xmrgFile( self.configSettings.loggerName )
-    xmrg.openFile( fileName )
-    
-    if( xmrg.readFileHeader() ):     
-      self.logger.debug( "File Origin: X %d Y: %d Columns: %d Rows: %d" %(xmrg.XOR,xmrg.YOR,xmrg.MAXX,xmrg.MAXY))
-      try:
-        if( xmrg.readAllRows() ):
-          
-          #This is the database insert datetime.           
-          datetime = time.strftime( "%Y-%m-%dT%H:%M:%S", time.localtime() )
-          #Parse the filename to get the data time.
-          (directory,filetime) = os.path.split( xmrg.fileName )
-          (filetime,ext) = os.path.splitext( filetime )
-          filetime = self.getCollectionDateFromFilename(filetime)
-          #In the binary file, the data is stored as hundreths of mm, if we want to write the data as 
-          #inches , need to divide by 2540.
-          dataConvert = 100.0 
-          dataConvert = 25.4 * dataConvert 
+    result = decodeXMRGFile(self.getDecodeParams(fileName, minLatLong, maxLatLong), self.meshCache)
+    return(self.writeDecodedFile(result, db, minLatLong, maxLatLong))
 
-          #Flag to specifiy if any non 0 values were found. No need processing the weighted averages 
-          #below if nothing found.
-          rainDataFound=False 
-          #If we are using a bounding box, let's get the row/col in hrap coords.
-          llHrap = None
-          urHrap = None
-          startCol = 0
-          startRow = 0
-          if( minLatLong != None and maxLatLong != None ):
-            llHrap = xmrg.latLongToHRAP(minLatLong,True,True)
-            urHrap = xmrg.latLongToHRAP(maxLatLong,True,True)
-            startCol = llHrap.column
-            startRow = llHrap.row
-          recsAdded = 0
-          for row in range(startRow,xmrg.MAXY):
-            for col in range(startCol,xmrg.MAXX):
-              val = xmrg.grid[row][col]
-              #If there is no precipitation value, or the value is erroneous 
-              if( val <= 0 ):
-                if(self.saveAllPrecipVals):
-                  val = 0
-                else:
-                  continue
-              else:
-                val /= dataConvert
-                
-              hrap = hrapCoord( xmrg.XOR + col, xmrg.YOR + row )
-              latlon = xmrg.hrapCoordToLatLong( hrap )                                
-              latlon.longitude *= -1
-              insertSQL = False
-              if( minLatLong != None and maxLatLong != None ):
-                if( xmrg.inBBOX( latlon, minLatLong, maxLatLong ) ):
-                  insertSQL = True
-              else:
-                insertSQL = True
-              if( insertSQL ):
-                rainDataFound = True
-                #Build polygon points. Each grid point represents a 4km square, so we want to create a polygon
-                #that has each point in the grid for a given point.                  
-                hrapNewPt = hrapCoord( xmrg.XOR + col, xmrg.YOR + row + 1)
-                latlonUL = xmrg.hrapCoordToLatLong( hrapNewPt )
-                latlonUL.longitude *= -1
-                hrapNewPt = hrapCoord( xmrg.XOR + col + 1, xmrg.YOR + row)
-                latlonBR = xmrg.hrapCoordToLatLong( hrapNewPt )
-                latlonBR.longitude *= -1
-                hrapNewPt = hrapCoord( xmrg.XOR + col + 1, xmrg.YOR + row + 1)
-                latlonUR = xmrg.hrapCoordToLatLong( hrapNewPt )
-                latlonUR.longitude *= -1
-                wkt = "POLYGON((%f %f,%f %f,%f %f,%f %f,%f %f))"\
-                      %(latlon.longitude, latlon.latitude,
-                        latlonUL.longitude, latlonUL.latitude, 
-                        latlonUR.longitude, latlonUR.latitude, 
-                        latlonBR.longitude, latlonBR.latitude, 
-                        latlon.longitude, latlon.latitude, 
-                        )
-                #wkt = "POINT(%f %f)" %(latlon.longitude, latlon.latitude)
-                sql = "INSERT INTO precipitation_radar \
-                      (insert_date,collection_date,latitude,longitude,precipitation,geom) \
-                      VALUES('%s','%s',%f,%f,%f,GeomFromText('%s',4326));" \
-                      %( datetime,filetime,latlon.latitude,latlon.longitude,val,wkt)
-                cursor = db.executeQuery( sql )
-                #Problem with the query, since we are working with transactions, we have to rollback.
-                if( cursor == None ):
-                  self.logger.error( db.lastErrorMsg )
-                  db.lastErrorMsg = None
-                  db.DB.rollback()
-                recsAdded += 1
-          #Commit the inserts.    
-          db.commit()
-          if( self.logger != None ):
-            self.logger.info( "Processed: %d rows. Added: %d records to database." %((row + 1),recsAdded))
-          else:
-            print( 'Processed %d rows. Added: %d records to database.' % (row + 1),recsAdded )
-          #NOw calc the weighted averages for the watersheds and add the measurements to the multi-obs table
-          if(rainDataFound and self.calcWeightedAvg):
-            self.calculateWeightedAverages(filetime,filetime,db,True)
-          else:
-            i = 0
-      except Exception, E:
-        self.lastErrorMsg = str(E)
-        if(self.logger != None):
-          self.logger.exception(E)
-        else:
-          print(traceback.print_exc())
-        #DWR 2012-10-29  
+  """
+  Function: writeDecodedFile
+  Purpose: Writes the radar cells for a file decoded by decodeXMRGFile into the precipitation_radar table, then
+    calculates the watershed weighted averages if we are set to.
+  Parameters:
+    result is the dictionary returned from decodeXMRGFile.
+    db is the dhecDB object to write to.
+    minLatLong, maxLatLong are the LatLong objects for the bounding box the file was decoded with.
+  Return: True if successful, otherwise False.
+  """
+  def writeDecodedFile(self, result, db, minLatLong=None, maxLatLong=None):
+    retVal = True
+    if(result['errorMsg'] != None):
+      self.logger.error("File: %s %s" %(result['fileName'], result['errorMsg']))
+      return(False)
+    xmrg = result['xmrg']
+    self.logger.debug( "File Origin: X %d Y: %d Columns: %d Rows: %d" %(xmrg.XOR,xmrg.YOR,xmrg.MAXX,xmrg.MAXY))
+    self.logger.debug( "File: %s Bytes read: %d Decode time: %f seconds" %(result['fileName'],xmrg.bytesRead,xmrg.decodeTime))
+    try:
+      filetime = result['collectionDate']
+      #Flag to specifiy if any non 0 values were found. No need processing the weighted averages 
+      #below if nothing found.
+      rainDataFound=False 
+      #Write all the cells for the file in one transaction.
+      loader = precipRadarLoader(db.DB, self.logger)
+      recsAdded = loader.loadCells(result['cells'], filetime)
+      if(recsAdded == -1):
         retVal = False
-      
-      #DWR 2012-10-29
-      #Move the deletion of the file to a member function so child classes can control.
-      xmrg.xmrgFile.close()
-      xmrg.cleanUp(self.deleteSourceFile,self.deleteCompressedSourceFile)
-      return(retVal)
+        recsAdded = 0
+      else:
+        rainDataFound = (recsAdded > 0)
+      if( self.logger != None ):
+        self.logger.info( "Processed: %d rows. Added: %d records to database. %f rows/sec."\
+                          %(xmrg.grid.shape[0],recsAdded,loader.rowsPerSec))
+      else:
+        print( 'Processed %d rows. Added: %d records to database. %f rows/sec.' % (xmrg.grid.shape[0],recsAdded,loader.rowsPerSec) )
+      #Make sure the watershed cell weights are current. They are only rebuilt if a watershed boundary
+      #or the grid changed.
+      if(self.calcWeightedAvg):
+        #Get the cell corners for the grid, these are the same for every file so they come from the cache.
+        mesh = self.meshCache.getMesh(xmrg, minLatLong, maxLatLong)
+        if(radarCellWeights(db.DB, self.logger).buildFromTable(mesh, 'boundaries', 'AOI', 'Geometry') == -1):
+          self.logger.error("Unable to build the watershed cell weights, falling back to spatial queries.")
+      #NOw calc the weighted averages for the watersheds and add the measurements to the multi-obs table
+      if(rainDataFound and self.calcWeightedAvg):
+        self.calculateWeightedAverages(filetime,filetime,db,True)
+    except Exception, E:
+      self.lastErrorMsg = str(E)
+      if(self.logger != None):
+        self.logger.exception(E)
+      else:
+        print(traceback.print_exc())
+      #DWR 2012-10-29  
+      retVal = False
+    return(retVal)
         
   def calculateWeightedAverages(self,startDate,endDate,dbConnection,addSensor=False, rainGaugeList=None):
     try:
@@ -194,6 +194,12 @@ def backupData(configFile):
   backupDb = configSettings.getEntry('//environment/database/db/backup/filePath')
   dbSchema = configSettings.getEntry('//environment/database/db/backup/sqlSchemaFile')
   db.backupData(backupDb, dbSchema)
+
+def expireBackupData(configFile, olderThanDate):
+  dbFile = configSettings.getEntry('//environment/database/db/name')
+  db = dhecDB(dbFile, "dhec_testing_logger")
+  backupDb = configSettings.getEntry('//environment/database/db/backup/filePath')
+  db.dropPartitionsBefore(backupDb, olderThanDate)
   
 def archiveXMRGFiles(configFile):
   dhecData = dhecXMRGProcessing(configFile)
@@ -216,6 +222,8 @@ if __name__ == '__main__':
                     action= 'store_true', help="Use to vacuum the database to free unused space and shrink filesize." )
   parser.add_option("-b", "--BackupPrecipitation", dest="backupPrecip", action= 'store_true', 
                     help="Used to roll precipitation data out of the working database and into a backup database." )
+  parser.add_option("-e", "--ExpireBackupsBefore", dest="expireBefore", 
+                    help="Deletes the yearly backup databases for the years that end before this date, YYYY-MM-DDTHH:MM:SS." )
   parser.add_option("-f", "--CreateXMRGSummaryFiles", dest="createXMRGSummaryFiles", action= 'store_true', 
                     help="Specifies creation of the XMRG summary files for DHEC excel sheets." )
   parser.add_option("-a", "--ArchiveXMRGFiles", dest="archiveXMRG", action= 'store_true', 
@@ -242,6 +250,8 @@ if __name__ == '__main__':
       getModelData(options.modelIniFile)
     if( options.backupPrecip ):
       backupData( options.xmlConfigFile )
+    if( options.expireBefore ):
+      expireBackupData( options.xmlConfigFile, options.expireBefore )
     if(options.createXMRGSummaryFiles):
       createXMRGSummaryFiles(options.xmlConfigFile)
     if(options.archiveXMRG):
@@ -0,0 +1,125 @@
+"""
+Module: moonIllumination
+Purpose: Computes the fraction of the moon illuminated for any range of days so the moon_phase table can be filled
+ locally instead of converting the USNO tables with moonphase.py. Uses the lower accuracy phase angle from Meeus,
+ Astronomical Algorithms chapter 48. The values are for noon EST, which matches the existing moon_phase rows to
+ the 2 decimal places they are stored with, give or take 0.01.
+ Days are handled as day numbers, the proleptic Gregorian ordinal datetime.date.toordinal() returns.
+"""
+import sys
+import datetime
+import optparse
+import logging
+import numpy
+from pysqlite2 import dbapi2 as sqlite3
+
+#Noon EST in UTC hours.
+utcHour = 17.0
+#The day number of 2000-01-01 and the julian day of 2000-01-01 00:00 UTC.
+j2000DayNumber = 730120
+j2000JulianDay = 2451544.5
+
+"""
+Function: dayNumber
+Purpose: Converts a date string into its day number.
+Parameters:
+  date is the date, YYYY-MM-DD. Anything after the day, such as a time, is ignored.
+Return: The day number as an int.
+"""
+def dayNumber(date):
+  return(datetime.date(int(date[0:4]), int(date[5:7]), int(date[8:10])).toordinal())
+
+"""
+Function: illuminatedFraction
+Purpose: Calculates the fraction of the moon illuminated for each day.
+Parameters:
+  dayNumbers is a list or array of the day numbers.
+  hour is the UTC hour of the day to calculate the fraction for.
+Return: A numpy array of the fractions, 0 for a new moon to 1 for a full moon.
+"""
+def illuminatedFraction(dayNumbers, hour=utcHour):
+  julianDays = numpy.asarray(dayNumbers, dtype=numpy.float64) - j2000DayNumber + j2000JulianDay + (hour / 24.0)
+  T = (julianDays - 2451545.0) / 36525.0
+  #Mean elongation of the moon, mean anomaly of the sun and mean anomaly of the moon, in degrees.
+  D = 297.8501921 + 445267.1114034 * T - 0.0018819 * T**2 + T**3 / 545868.0 - T**4 / 113065000.0
+  M = 357.5291092 + 35999.0502909 * T - 0.0001536 * T**2 + T**3 / 24490000.0
+  Mp = 134.9633964 + 477198.8675055 * T + 0.0087414 * T**2 + T**3 / 69699.0 - T**4 / 14712000.0
+  D = numpy.radians(D)
+  M = numpy.radians(M)
+  Mp = numpy.radians(Mp)
+  #Phase angle.
+  i = 180.0 - numpy.degrees(D) - 6.289 * numpy.sin(Mp) + 2.100 * numpy.sin(M) - 1.274 * numpy.sin(2 * D - Mp)\
+      - 0.658 * numpy.sin(2 * D) - 0.214 * numpy.sin(2 * Mp) - 0.110 * numpy.sin(D)
+  return((1.0 + numpy.cos(numpy.radians(i))) / 2.0)
+
+"""
+Function: moonPhasesForRange
+Purpose: Calculates the moon_phase table values for each day from the start to the end date.
+Parameters:
+  startDate is the first day, YYYY-MM-DD.
+  endDate is the last day, YYYY-MM-DD.
+Return: A tuple of the numpy array of day numbers and the numpy array of the fractions rounded to 2 places.
+"""
+def moonPhasesForRange(startDate, endDate):
+  days = numpy.arange(dayNumber(startDate), dayNumber(endDate) + 1)
+  return(days, numpy.round(illuminatedFraction(days), 2))
+
+"""
+Function: fillMoonPhaseTable
+Purpose: Adds the days from the start to the end date that are missing from the moon_phase table. Days already in
+ the table are left alone. The rows are written in a single transaction.
+Parameters:
+  dbConnection is the sqlite connection to the database with the moon_phase table.
+  startDate is the first day, YYYY-MM-DD.
+  endDate is the last day, YYYY-MM-DD.
+  logger is the logging object.
+Return: The number of days added, -1 if there was an error.
+"""
+def fillMoonPhaseTable(dbConnection, startDate, endDate, logger=None):
+  sql = "SELECT date FROM moon_phase WHERE date >= ? AND date <= ?"
+  try:
+    dbCursor = dbConnection.cursor()
+    dbCursor.execute(sql, (startDate, endDate))
+    existingDays = set([dayNumber(row[0]) for row in dbCursor])
+    dbCursor.close()
+
+    days, phases = moonPhasesForRange(startDate, endDate)
+    moonRows = []
+    for i in range(len(days)):
+      if(int(days[i]) not in existingDays):
+        moonRows.append((datetime.date.fromordinal(int(days[i])).strftime('%Y-%m-%d'), float(phases[i])))
+    sql = "INSERT INTO moon_phase (date,phase) VALUES(?,?)"
+    dbCursor = dbConnection.cursor()
+    dbCursor.executemany(sql, moonRows)
+    dbCursor.close()
+    dbConnection.commit()
+  except sqlite3.Error, e:
+    dbConnection.rollback()
+    if(logger != None):
+      logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+    else:
+      print("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+    return(-1)
+  if(logger != None):
+    logger.info("Added %d days to the moon_phase table from: %s to: %s" % (len(moonRows), startDate, endDate))
+  return(len(moonRows))
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser()
+  parser.add_option("-d", "--DatabaseFile", dest="databaseFile",
+                    help="Database with the moon_phase table to fill." )
+  parser.add_option("-b", "--BeginDate", dest="beginDate",
+                    help="First day to fill, YYYY-MM-DD." )
+  parser.add_option("-e", "--EndDate", dest="endDate",
+                    help="Last day to fill, YYYY-MM-DD." )
+  (options, args) = parser.parse_args()
+  if(options.databaseFile == None or options.beginDate == None or options.endDate == None):
+    parser.print_usage()
+    parser.print_help()
+    sys.exit(-1)
+
+  logging.basicConfig(level=logging.INFO)
+  db = sqlite3.connect(options.databaseFile)
+  if(fillMoonPhaseTable(db, options.beginDate, options.endDate, logging.getLogger()) == -1):
+    sys.exit(-1)
+  db.close()
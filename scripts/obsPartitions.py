@@ -0,0 +1,210 @@
+"""
+Module: obsPartitions
+Purpose: The multi_obs rows older than the rollover cutoff live in yearly partition databases,
+ <archiveDir><year>/<year>-dhec.db, which dhecDB.archiveRollover moves them into. This module finds the partitions
+ a date window overlaps so windowed queries only open the years they need, and expires old years by dropping
+ their files instead of DELETEing rows and VACUUMing.
+ Each partition has its own copy of the xenia metadata tables, so the sensor and m_type ids are looked up per
+ partition by observation, uom, platform and s_order.
+"""
+import os
+import glob
+from pysqlite2 import dbapi2 as sqlite3
+
+#Sensor ids with the names they are matched on. %(db)s is the database name, main or an attached database.
+sensorMetadataSQL = "SELECT sensor.row_id AS sensor_id,sensor.m_type_id AS m_type_id,sensor.s_order AS s_order,\
+                     m_type.num_types AS num_types,platform.platform_handle AS platform_handle,\
+                     obs_type.standard_name AS obs_name,uom_type.standard_name AS uom\
+                     FROM %(db)s.sensor sensor\
+                     JOIN %(db)s.platform platform ON platform.row_id = sensor.platform_id\
+                     JOIN %(db)s.m_type m_type ON m_type.row_id = sensor.m_type_id\
+                     JOIN %(db)s.m_scalar_type m_scalar_type ON m_scalar_type.row_id = m_type.m_scalar_type_id\
+                     JOIN %(db)s.obs_type obs_type ON obs_type.row_id = m_scalar_type.obs_type_id\
+                     JOIN %(db)s.uom_type uom_type ON uom_type.row_id = m_scalar_type.uom_type_id"
+
+"""
+Function: partitionFileName
+Purpose: Returns the partition database file for a year.
+Parameters:
+  archiveDir is the directory the yearly partition directories are in.
+  year is the year as an int.
+Return: The file name.
+"""
+def partitionFileName(archiveDir, year):
+  return("%s%d/%d-dhec.db" % (archiveDir, year, year))
+
+"""
+Class: yearPartitions
+Purpose: The yearly multi_obs partitions in an archive directory. The partition connections are opened the first
+ time a partition is queried and kept open, so an object should only be used by one thread.
+"""
+class yearPartitions(object):
+  def __init__(self, archiveDir, logger=None):
+    self.archiveDir = archiveDir
+    self.logger = logger
+    self.years = None             #The partition years, read from the directory on first use.
+    self.connections = {}         #Partition connections keyed on the year.
+    self.sensorIDs = {}           #(sensor_id, m_type_id) keyed on (year, obsName, uom, platformHandle, sOrder, numTypes).
+
+  """
+  Function: getYears
+  Purpose: Returns the years that have a partition. The directory is only read the first time.
+  Return: A sorted list of the years.
+  """
+  def getYears(self):
+    if(self.years == None):
+      self.years = []
+      for fileName in glob.glob("%s*/*-dhec.db" % (self.archiveDir)):
+        year = os.path.basename(fileName).split('-')[0]
+        if(year.isdigit() and fileName == partitionFileName(self.archiveDir, int(year))):
+          self.years.append(int(year))
+      self.years.sort()
+    return(self.years)
+
+  """
+  Function: refresh
+  Purpose: Forgets the partition years and ids looked up so far, call when partitions have been added.
+  """
+  def refresh(self):
+    self.years = None
+    self.sensorIDs = {}
+
+  """
+  Function: getYearsForWindow
+  Purpose: Returns the years with a partition that overlap a date window.
+  Parameters:
+    startDate is the start of the window, YYYY-MM-DDTHH:MM:SS.
+    endDate is the end of the window, the window includes dates up to but not including it.
+  Return: A sorted list of the years.
+  """
+  def getYearsForWindow(self, startDate, endDate):
+    lastYear = int(endDate[0:4])
+    #A window ending at the very start of a year doesn't reach into it.
+    if(endDate[4:] <= '-01-01T00:00:00'):
+      lastYear -= 1
+    return([year for year in self.getYears() if(year >= int(startDate[0:4]) and year <= lastYear)])
+
+  """
+  Function: connect
+  Purpose: Returns the connection to a year's partition, opening it if need be.
+  Parameters:
+    year is the partition year.
+  Return: The sqlite connection, None if there was an error.
+  """
+  def connect(self, year):
+    if(year not in self.connections):
+      try:
+        db = sqlite3.connect(partitionFileName(self.archiveDir, year))
+        db.row_factory = sqlite3.Row
+        self.connections[year] = db
+      except sqlite3.Error, e:
+        if(self.logger != None):
+          self.logger.error("Unable to open partition: %s ErrMsg: %s" % (partitionFileName(self.archiveDir, year), e.args[0]))
+        return(None)
+    return(self.connections[year])
+
+  """
+  Function: getSensorIDs
+  Purpose: Looks up the sensor and m_type ids for an observation in a year's partition.
+  Parameters:
+    year is the partition year.
+    obsName is the observation standard name.
+    uom is the unit of measure.
+    platformHandle is the platform.
+    sOrder is the sensor order.
+    numTypes is the number of values in the sensor's m_type, if None any m_type for the observation will do.
+  Return: A tuple of the sensor id and m_type id, None if the partition doesn't have the sensor.
+  """
+  def getSensorIDs(self, year, obsName, uom, platformHandle, sOrder=1, numTypes=None):
+    key = (year, obsName, uom, platformHandle, sOrder, numTypes)
+    if(key not in self.sensorIDs):
+      db = self.connect(year)
+      if(db == None):
+        return(None)
+      sql = "SELECT sensor_id,m_type_id FROM (%s) WHERE obs_name = ? AND uom = ? AND platform_handle = ? AND s_order = ?\
+             AND (? IS NULL OR num_types = ?) ORDER BY sensor_id ASC LIMIT 1" % (sensorMetadataSQL % {'db' : 'main'})
+      try:
+        dbCursor = db.cursor()
+        dbCursor.execute(sql, (obsName, uom, platformHandle, sOrder, numTypes, numTypes))
+        row = dbCursor.fetchone()
+        dbCursor.close()
+      except sqlite3.Error, e:
+        if(self.logger != None):
+          self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+        return(None)
+      self.sensorIDs[key] = None
+      if(row != None):
+        self.sensorIDs[key] = (row[0], row[1])
+    return(self.sensorIDs[key])
+
+  """
+  Function: queryWindow
+  Purpose: Runs a query against each partition that overlaps the window and has the observation's sensor.
+  Parameters:
+    sql is the query. It is run with the named parameters :startDate, :endDate, :sensorID, :mTypeID and
+      :platformHandle, with the ids for the partition it is run against.
+    obsName is the observation standard name.
+    uom is the unit of measure.
+    platformHandle is the platform.
+    startDate is the start of the window, YYYY-MM-DDTHH:MM:SS.
+    endDate is the end of the window, not included.
+    sOrder is the sensor order.
+    numTypes is the number of values in the sensor's m_type, see getSensorIDs.
+  Return: A list of the rows from all the partitions, None if there was an error.
+  """
+  def queryWindow(self, sql, obsName, uom, platformHandle, startDate, endDate, sOrder=1, numTypes=None):
+    rows = []
+    for year in self.getYearsForWindow(startDate, endDate):
+      ids = self.getSensorIDs(year, obsName, uom, platformHandle, sOrder, numTypes)
+      if(ids == None):
+        continue
+      params = {'startDate' : startDate, 'endDate' : endDate, 'sensorID' : ids[0], 'mTypeID' : ids[1],
+                'platformHandle' : platformHandle}
+      try:
+        dbCursor = self.connections[year].cursor()
+        dbCursor.execute(sql, params)
+        rows.extend(dbCursor.fetchall())
+        dbCursor.close()
+      except sqlite3.Error, e:
+        if(self.logger != None):
+          self.logger.error("Partition: %d ErrMsg: %s SQL: '%s'" % (year, e.args[0], sql))
+        return(None)
+    return(rows)
+
+  """
+  Function: dropBefore
+  Purpose: Expires the partitions for the years that end on or before a date by deleting their files.
+  Parameters:
+    olderThanDate is the date, YYYY-MM-DDTHH:MM:SS. A year's partition is dropped if all of the year is before it.
+  Return: A list of the years dropped.
+  """
+  def dropBefore(self, olderThanDate):
+    dropped = []
+    for year in list(self.getYears()):
+      if("%04d-01-01T00:00:00" % (year + 1) > olderThanDate):
+        continue
+      if(year in self.connections):
+        self.connections.pop(year).close()
+      fileName = partitionFileName(self.archiveDir, year)
+      try:
+        os.remove(fileName)
+        #Remove the year's directory too if that was all that was in it.
+        if(len(os.listdir(os.path.dirname(fileName))) == 0):
+          os.rmdir(os.path.dirname(fileName))
+      except OSError, e:
+        if(self.logger != None):
+          self.logger.error("Unable to drop partition: %s Error: %s" % (fileName, str(e)))
+        continue
+      for key in self.sensorIDs.keys():
+        if(key[0] == year):
+          del self.sensorIDs[key]
+      self.years.remove(year)
+      dropped.append(year)
+      if(self.logger != None):
+        self.logger.info("Dropped partition: %s" % (fileName))
+    return(dropped)
+
+  def close(self):
+    for db in self.connections.values():
+      db.close()
+    self.connections = {}
@@ -0,0 +1,276 @@
+"""
+Module: precipStats
+Purpose: Single pass rolling window precipitation statistics. A precipitation series is loaded from multi_obs
+ once and the trailing window sums, rainfall intensity and preceding dry day counts are computed for any number
+ of dates from it, instead of issuing a separate query per window per date.
+"""
+import time
+import calendar
+import numpy
+from pysqlite2 import dbapi2 as sqlite3
+
+"""
+Function: dateToEpoch
+Purpose: Converts a multi_obs style date string into seconds since the epoch. The dates are treated as
+ UTC so there are no daylight savings jumps between consecutive samples.
+Parameters:
+  dateTime is the date string, either YYYY-MM-DDTHH:MM:SS or YYYY-MM-DDTHH:MM.
+Return: The epoch seconds as an int.
+"""
+def dateToEpoch(dateTime):
+  dateTime = dateTime.replace(' ', 'T')
+  if(len(dateTime) == 16):
+    dateTime += ':00'
+  return(calendar.timegm(time.strptime(dateTime[0:19], '%Y-%m-%dT%H:%M:%S')))
+
+"""
+Class: precipSeries
+Purpose: Holds a single precipitation series(one platform, one observation) in memory as sorted numpy arrays
+ of epoch times and values. All of the statistics are computed with searchsorted lookups against a running
+ cumulative sum, so the cost of adding more windows or more dates is a few array operations rather than
+ another trip to the database.
+ The windows follow the same rules as the original queries: a N hour window for a date covers
+ [date - N hours, date).
+"""
+class precipSeries:
+  """
+  Function: __init__
+  Purpose: Initializes the series.
+  Parameters:
+    dates is a list of the epoch times for each sample, in ascending order.
+    values is a list of the sample values.
+  """
+  def __init__(self, dates=None, values=None, logger=None):
+    self.logger = logger
+    if(dates is None):
+      dates = []
+    if(values is None):
+      values = []
+    self.setData(dates, values)
+
+  """
+  Function: setData
+  Purpose: Stores the samples and builds the lookup arrays used by the statistics functions.
+  Parameters:
+    dates is a list of the epoch times for each sample, in ascending order.
+    values is a list of the sample values.
+  Return: None
+  """
+  def setData(self, dates, values):
+    self.dates = numpy.array(dates, dtype=numpy.int64)
+    self.values = numpy.array(values, dtype=numpy.float64)
+    #Running totals with a leading 0 so the sum of samples [i,j) is cumSum[j] - cumSum[i].
+    self.cumSum = numpy.concatenate(([0.0], numpy.cumsum(self.values)))
+    positive = self.values > 0.0
+    self.cumPosSum = numpy.concatenate(([0.0], numpy.cumsum(numpy.where(positive, self.values, 0.0))))
+    self.cumPosCnt = numpy.concatenate(([0], numpy.cumsum(positive)))
+    self.positiveDates = self.dates[positive]
+    self.dryRun = None
+
+  """
+  Function: loadFromDB
+  Purpose: Loads the series from the multi_obs table with a single query.
+  Parameters:
+    dbConnection is the sqlite connection to query.
+    platformHandle is the platform the observation belongs to.
+    mTypeID is the m_type_id of the observation. Used if sensorID is None.
+    sensorID is the sensor id of the observation.
+    startDate, if provided, is the earliest m_date to load.
+    endDate, if provided, is the m_date to load up to, but not including.
+    positiveOnly if True only loads the values greater than 0.
+  Return: True if the data was loaded, otherwise False.
+  """
+  def loadFromDB(self, dbConnection, platformHandle, mTypeID=None, sensorID=None, startDate=None, endDate=None, positiveOnly=False):
+    params = []
+    if(sensorID != None):
+      where = ["sensor_id = ?"]
+      params.append(sensorID)
+    else:
+      where = ["m_type_id = ?", "platform_handle = ?"]
+      params.extend([mTypeID, platformHandle])
+    if(startDate != None):
+      where.append("m_date >= ?")
+      params.append(startDate)
+    if(endDate != None):
+      where.append("m_date < ?")
+      params.append(endDate)
+    if(positiveOnly):
+      where.append("m_value > 0.0")
+    sql = "SELECT m_date,m_value FROM multi_obs WHERE %s ORDER BY m_date ASC;" % (" AND ".join(where))
+    try:
+      dbCursor = dbConnection.cursor()
+      dbCursor.execute(sql, params)
+      dates = []
+      values = []
+      for row in dbCursor:
+        if(row[1] != None):
+          dates.append(dateToEpoch(row[0]))
+          values.append(float(row[1]))
+      dbCursor.close()
+      self.setData(dates, values)
+      return(True)
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      else:
+        print("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+    return(False)
+
+  """
+  Function: windowBounds
+  Purpose: For each date and window, finds the index range of the samples in [date - window hours, date).
+  Parameters:
+    anchors is a numpy array of epoch times.
+    windows is a list of the window lengths in hours.
+  Return: A tuple of (startNdx, endNdx) arrays shaped (len(anchors), len(windows)).
+  """
+  def windowBounds(self, anchors, windows):
+    anchors = numpy.asarray(anchors, dtype=numpy.int64)
+    windowSecs = numpy.asarray(windows, dtype=numpy.int64) * 3600
+    endNdx = numpy.searchsorted(self.dates, anchors, side='left')
+    startNdx = numpy.searchsorted(self.dates, (anchors[:, numpy.newaxis] - windowSecs).ravel(), side='left')
+    startNdx = startNdx.reshape(len(anchors), len(windowSecs))
+    endNdx = numpy.repeat(endNdx[:, numpy.newaxis], len(windowSecs), axis=1)
+    return(startNdx, endNdx)
+
+  """
+  Function: windowSums
+  Purpose: Calculates the trailing window sums for every date and window in one pass.
+  Parameters:
+    anchors is a list of the epoch times to calculate the sums for.
+    windows is a list of the window lengths in hours, for example [24,48,72].
+    positiveOnly if True only values greater than 0 are summed.
+    missingValue is what is returned for a window with no samples.
+  Return: A list, one entry per anchor, of lists with the sum for each window.
+  """
+  def windowSums(self, anchors, windows, positiveOnly=False, missingValue=None):
+    startNdx, endNdx = self.windowBounds(anchors, windows)
+    if(positiveOnly):
+      sums = self.cumPosSum[endNdx] - self.cumPosSum[startNdx]
+    else:
+      sums = self.cumSum[endNdx] - self.cumSum[startNdx]
+    counts = endNdx - startNdx
+    results = []
+    for row in range(sums.shape[0]):
+      rowVals = []
+      for col in range(sums.shape[1]):
+        if(counts[row, col] > 0):
+          rowVals.append(float(sums[row, col]))
+        else:
+          rowVals.append(missingValue)
+      results.append(rowVals)
+    return(results)
+
+  """
+  Function: rangeAverages
+  Purpose: Calculates the average of the samples in [startTime, endTime) for each pair of times.
+  Parameters:
+    startTimes is a list of the epoch times each range starts at.
+    endTimes is a list of the epoch times each range ends at, not included.
+    missingValue is what is returned for a range with no samples.
+  Return: A list of the averages.
+  """
+  def rangeAverages(self, startTimes, endTimes, missingValue=None):
+    startNdx = numpy.searchsorted(self.dates, numpy.asarray(startTimes, dtype=numpy.int64), side='left')
+    endNdx = numpy.searchsorted(self.dates, numpy.asarray(endTimes, dtype=numpy.int64), side='left')
+    sums = self.cumSum[endNdx] - self.cumSum[startNdx]
+    counts = endNdx - startNdx
+    results = []
+    for i in range(len(counts)):
+      if(counts[i] > 0):
+        results.append(float(sums[i]) / counts[i])
+      else:
+        results.append(missingValue)
+    return(results)
+
+  """
+  Function: intensity
+  Purpose: Calculates the rainfall intensity for each date. The intensity is the total rain in the window
+   divided by the number of samples with rain multiplied by the sample interval.
+  Parameters:
+    anchors is a list of the epoch times to calculate the intensity for.
+    intervalInMinutes is the number of minutes each sample represents.
+    windowHours is the window to look back over, defaults to a day.
+  Return: A list of the intensities. If a window has no samples at all, -9999.0 is used.
+  """
+  def intensity(self, anchors, intervalInMinutes, windowHours=24):
+    startNdx, endNdx = self.windowBounds(anchors, [windowHours])
+    startNdx = startNdx[:, 0]
+    endNdx = endNdx[:, 0]
+    totals = self.cumPosSum[endNdx] - self.cumPosSum[startNdx]
+    rainCnts = self.cumPosCnt[endNdx] - self.cumPosCnt[startNdx]
+    results = []
+    for i in range(len(totals)):
+      rainfallIntensity = -9999.0
+      if(endNdx[i] > startNdx[i]):
+        rainfallIntensity = 0.0
+      if(rainCnts[i]):
+        rainfallIntensity = float(totals[i]) / (rainCnts[i] * intervalInMinutes)
+      results.append(rainfallIntensity)
+    return(results)
+
+  """
+  Function: buildDryRunIndex
+  Purpose: For each sample, calculates how many consecutive 0 rainfall samples end on it, where each
+   sample is at most a day after the previous one. A run that contains a gap of more than a day is
+   marked -9999 since we can't say how many dry days there were.
+  Return: None
+  """
+  def buildDryRunIndex(self):
+    secondsInDay = 24 * 60 * 60
+    self.dryRun = numpy.zeros(len(self.values), dtype=numpy.int64)
+    for i in range(len(self.values)):
+      if(self.values[i] == 0.0):
+        if(i > 0 and self.values[i-1] == 0.0):
+          if(self.dryRun[i-1] != -9999 and (self.dates[i] - self.dates[i-1]) <= secondsInDay):
+            self.dryRun[i] = self.dryRun[i-1] + 1
+          else:
+            self.dryRun[i] = -9999
+        else:
+          self.dryRun[i] = 1
+
+  """
+  Function: precedingDryDays
+  Purpose: For daily summary data, calculates how many days before each date had no rainfall. The search starts
+   with the summary for 2 days prior to the date, since the daily summaries are stamped at 23:59.
+  Parameters:
+    anchors is a list of the epoch times to calculate the dry days for.
+  Return: A list of the dry day counts. -9999 is used if there was a missing day in the dry period.
+  """
+  def precedingDryDays(self, anchors):
+    secondsInDay = 24 * 60 * 60
+    if(self.dryRun is None):
+      self.buildDryRunIndex()
+    results = []
+    for anchor in anchors:
+      #Last summary at or before 23:59 two days prior.
+      cutoff = ((anchor - 2 * secondsInDay) // secondsInDay) * secondsInDay + (23 * 3600) + (59 * 60)
+      ndx = numpy.searchsorted(self.dates, cutoff, side='right') - 1
+      dryCnt = 0
+      if(ndx >= 0 and self.values[ndx] == 0.0):
+        if(((anchor - secondsInDay) - self.dates[ndx]) <= secondsInDay):
+          dryCnt = int(self.dryRun[ndx])
+        else:
+          dryCnt = -9999
+      results.append(dryCnt)
+    return(results)
+
+  """
+  Function: daysSinceRain
+  Purpose: For data where the dry periods are not recorded, such as the radar data, calculates the number of
+   whole days between each date and the last sample before it with rainfall.
+  Parameters:
+    anchors is a list of the epoch times to calculate the dry days for.
+  Return: A list of the day counts. -9999 is used if there is no rainfall before the date.
+  """
+  def daysSinceRain(self, anchors):
+    secondsInDay = 24 * 60 * 60
+    anchors = numpy.asarray(anchors, dtype=numpy.int64)
+    ndx = numpy.searchsorted(self.positiveDates, anchors, side='left') - 1
+    results = []
+    for i in range(len(anchors)):
+      if(ndx[i] >= 0):
+        results.append(int((anchors[i] - self.positiveDates[ndx[i]]) // secondsInDay))
+      else:
+        results.append(-9999)
+    return(results)
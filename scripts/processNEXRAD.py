@@ -10,15 +10,17 @@ import datetime
 from datetime import tzinfo
 from pytz import timezone
 
-from xmrgFile import xmrgFile,xmrgDB,hrapCoord,LatLong
+from xmrgFile import xmrgFile,xmrgDB,hrapCoord,LatLong,hrapMeshCache,precipRadarLoader,radarCellWeights,xmrgImportPipeline
 
 class nexradProcess(object):
-  def __init__(self, bbox, polygons, dbObj, logger, outputFilename, outputInches=True):
+  def __init__(self, bbox, polygons, dbObj, logger, outputFilename, outputInches=True, meshCacheDir=None, workerCount=1):
     self.bbox = None
+    self.minLatLong = None
+    self.maxLatLong = None
     if(bbox != None):
       self.bbox = bbox
       #Each long/lat pair is seperated by a comma, so let's braek up the input into the pairs.
-      bboxParts = options.bbox.split(',')    
+      bboxParts = bbox.split(',')    
       self.minLatLong = LatLong()
       self.maxLatLong = LatLong()
       #Each long/lat pair is seperated by a space.
@@ -35,6 +37,10 @@ class nexradProcess(object):
     self.outputFilename = outputFilename
     self.shapefilePath = None
     self.dataInInches = outputInches
+    #Cell corner meshes for the grids, every file has the same geometry so we only project it once.
+    self.meshCache = hrapMeshCache(meshCacheDir, logger)
+    #Number of worker processes used to decode the files.
+    self.workerCount = workerCount
     
   
   def writeShapefiles(self, shapefilePath):
@@ -65,36 +71,44 @@ class nexradProcess(object):
         if(self.logger != None):
           self.logger.debug("Output file: %s opened" % (filename))
         outputFile.write("Start Time, End Time, Weighted Average\n")
+      paramsList = []
       for fileName in fileList:    
         fullPath = "%s/%s" %(xmrgDir,fileName)  
         #Make sure we are trying to import a file and not a directory.
         if(os.path.isfile(fullPath) != True):
           self.logger.debug("%s is not a file, skipping" % (fullPath))
           continue       
-
-        xmrg = xmrgFile("nexrad_proc_logger")
-        xmrg.openFile(fullPath)
-        if( xmrg.readFileHeader() ):     
+        #We don't keep the uncompressed files around, so read the compressed files directly.
+        paramsList.append({'fileName' : fullPath,
+                           'streamCompressed' : True,
+                           'minLatLong' : self.minLatLong,
+                           'maxLatLong' : self.maxLatLong,
+                           'meshCacheDir' : self.meshCache.cacheDir,
+                           'deleteSourceFile' : True,
+                           'deleteCompressedSourceFile' : deleteDataFiles})
+        
+      #The workers decode the files, the database writes and output file are done here in file order.
+      def writeResult(result):
+        fileName = os.path.basename(result['fileName'])
+        if(result['errorMsg'] != None):
           if(self.logger != None):
-            self.logger.debug( "File Origin: X %d Y: %d Columns: %d Rows: %d" %(xmrg.XOR,xmrg.YOR,xmrg.MAXX,xmrg.MAXY))
-          if(xmrg.readAllRows()):          
-            if(self.outputFilename):           
-              self.processData(xmrg, outputFile)
-            if(self.shapefilePath):
-              self.writeShapefile(xmrg)
-          else:
-            if(self.logger != None):
-              self.logger.error("Unable to read rows all rows in from file.")
-              
-          if(deleteDataFiles):
-            xmrg.cleanUp(True,True)
-          else:
-            xmrg.cleanUp(True,False)
-          xmrg.xmrgFile.close()
-                  
-        else:
-          self.logger.error("Unable to process: %s" %(fileName))
-      outputFile.close()
+            self.logger.error("Unable to process: %s %s" %(fileName, result['errorMsg']))
+          return(False)
+        xmrg = result['xmrg']
+        if(self.logger != None):
+          self.logger.debug( "File Origin: X %d Y: %d Columns: %d Rows: %d" %(xmrg.XOR,xmrg.YOR,xmrg.MAXX,xmrg.MAXY))
+          self.logger.debug( "File: %s Bytes read: %d Decode time: %f seconds" %(fileName,xmrg.bytesRead,xmrg.decodeTime))
+        retVal = True
+        if(self.outputFilename):           
+          retVal = self.processData(result, outputFile)
+        if(self.shapefilePath):
+          self.writeShapefile(xmrg)
+        return(retVal)
+      
+      pipeline = xmrgImportPipeline(self.workerCount, self.logger)
+      pipeline.run(paramsList, writeResult)
+      if(outputFile != None):
+        outputFile.close()
     except Exception, E:
       if(self.logger != None):
         self.logger.exception(E)
@@ -115,7 +129,7 @@ class nexradProcess(object):
           if(len(data)):
             data += ","
           data += "Longitude: %s Latitude: %s PrecipValue: %s" % (row['longitude'],row['latitude'],row['precipitation'])
-      weightedAvg = self.dbObj.calculateWeightedAvg(polygonPtList, startTime, endTime)
+      weightedAvg = self.dbObj.calculateWeightedAvg(polygonPtList, startTime, endTime, polygonKey)
       if(self.dataInInches):
         #In the binary file, the data is stored as hundreths of mm, if we want to write the data as 
         #inches , need to divide by 2540.
@@ -128,7 +142,8 @@ class nexradProcess(object):
       if(self.logger != None):
         self.logger.debug("Polygon: %s Weighted Avg: %f StartTime: %s EndTime: %s, %s" % (polygonKey,weightedAvg,startTime,endTime,data))
     
-  def processData(self, xmrg, outputFile):
+  def processData(self, result, outputFile):
+    xmrg = result['xmrg']
     if(self.logger != None):
       self.logger.debug("File: %s BBOX: %f,%f %f,%f"\
                         %(xmrg.fileName,self.minLatLong.latitude,self.minLatLong.longitude,self.maxLatLong.latitude,self.maxLatLong.longitude))
@@ -136,84 +151,26 @@ class nexradProcess(object):
     self.logger.debug( "File Origin: X %d Y: %d Columns: %d Rows: %d" %(xmrg.XOR,xmrg.YOR,xmrg.MAXX,xmrg.MAXY))
     try:      
       #This is the database insert datetime.           
-      #datetime = time.strftime( "%Y-%m-%dT%H:%M:%S", time.localtime() )
       nowTime = (datetime.datetime.now()).strftime("%Y-%m-%dT%H:%M:%S")
-      #Parse the filename to get the data time.
-      (directory,filetime) = os.path.split(xmrg.fileName)
-      (filetime,ext) = os.path.splitext( filetime )
-      filetime = xmrg.getCollectionDateFromFilename(filetime)
-  
-      #Flag to specifiy if any non 0 values were found. No need processing the weighted averages 
-      #below if nothing found.
-      rainDataFound=False 
-      #If we are using a bounding box, let's get the row/col in hrap coords.
-      llHrap = None
-      urHrap = None
-      startCol = 0
-      startRow = 0
-      if( self.minLatLong != None and self.maxLatLong != None ):
-        llHrap = xmrg.latLongToHRAP(self.minLatLong,True,True)
-        urHrap = xmrg.latLongToHRAP(self.maxLatLong,True,True)
-        startCol = llHrap.column
-        startRow = llHrap.row
-      recsAdded = 0
-      for row in range(startRow,xmrg.MAXY):
-        for col in range(startCol,xmrg.MAXX):
-          val = xmrg.grid[row][col]
-          #If there is no precipitation value, or the value is erroneous 
-          #if( val <= 0 ):
-          #  if(self.saveAllPrecipVals):
-          #    val = 0
-          #  else:
-          #    continue
-          #else:
-            
-          hrap = hrapCoord( xmrg.XOR + col, xmrg.YOR + row )
-          latlon = xmrg.hrapCoordToLatLong( hrap )                                
-          latlon.longitude *= -1
-          insertSQL = False
-          if( self.minLatLong != None and self.maxLatLong != None ):
-            if( xmrg.inBBOX( latlon, self.minLatLong, self.maxLatLong ) ):
-              insertSQL = True
-          else:
-            insertSQL = True
-          if( insertSQL ):
-            rainDataFound = True
-            #Build polygon points. Each grid point represents a 4km square, so we want to create a polygon
-            #that has each point in the grid for a given point.                  
-            hrapNewPt = hrapCoord( xmrg.XOR + col, xmrg.YOR + row + 1)
-            latlonUL = xmrg.hrapCoordToLatLong( hrapNewPt )
-            latlonUL.longitude *= -1
-            hrapNewPt = hrapCoord( xmrg.XOR + col + 1, xmrg.YOR + row)
-            latlonBR = xmrg.hrapCoordToLatLong( hrapNewPt )
-            latlonBR.longitude *= -1
-            hrapNewPt = hrapCoord( xmrg.XOR + col + 1, xmrg.YOR + row + 1)
-            latlonUR = xmrg.hrapCoordToLatLong( hrapNewPt )
-            latlonUR.longitude *= -1
-            wkt = "POLYGON((%f %f,%f %f,%f %f,%f %f,%f %f))"\
-                  %(latlon.longitude, latlon.latitude,
-                    latlonUL.longitude, latlonUL.latitude, 
-                    latlonUR.longitude, latlonUR.latitude, 
-                    latlonBR.longitude, latlonBR.latitude, 
-                    latlon.longitude, latlon.latitude, 
-                    )
-            #wkt = "POINT(%f %f)" %(latlon.longitude, latlon.latitude)
-            sql = "INSERT INTO precipitation_radar \
-                  (insert_date,collection_date,latitude,longitude,precipitation,geom) \
-                  VALUES('%s','%s',%f,%f,%f,GeomFromText('%s',4326));" \
-                  %( nowTime,filetime,latlon.latitude,latlon.longitude,val,wkt)
-            cursor = self.dbObj.executeQuery( sql )
-            #Problem with the query, since we are working with transactions, we have to rollback.
-            if( cursor == None ):
-              self.logger.error( self.dbObj.lastErrorMsg )
-              self.dbObj.lastErrorMsg = None
-              self.dbObj.db.rollback()
-            else:
-              recsAdded += 1
-      #Commit the inserts.    
-      self.dbObj.db.commit()
+      filetime = result['collectionDate']
+      #Get the cell corners for the grid, these are the same for every file so they come from the cache.
+      mesh = self.meshCache.getMesh(xmrg, self.minLatLong, self.maxLatLong)
+      #The worker built the cells, each grid point represents a 4km square with the polygon built from the cell corners.
+      cells = [(nowTime,) + cell[1:] for cell in result['cells']]
+      #Write all the cells for the file in one transaction.
+      loader = precipRadarLoader(self.dbObj.db, self.logger)
+      recsAdded = loader.loadCells(cells, filetime)
+      if(recsAdded == -1):
+        return(False)
       if( self.logger != None ):
-        self.logger.info( "Processed: %d rows. Added: %d records to database." %((row + 1),recsAdded))
+        self.logger.info( "Processed: %d rows. Added: %d records to database. %f rows/sec."\
+                          %(xmrg.grid.shape[0],recsAdded,loader.rowsPerSec))
+      #Make sure the cell weights for the polygons are current, they are only rebuilt if a polygon or the grid changed.
+      weights = radarCellWeights(self.dbObj.db, self.logger)
+      for polygonKey in self.polygonDict:
+        polyString = self.dbObj.buildPolygonString(self.polygonDict[polygonKey].split(','))
+        if(weights.buildFromPolygon(mesh, 'polygon', polygonKey, polyString) == None):
+          self.logger.error("Unable to build the cell weights for polygon: %s" % (polygonKey))
         
       self.doCalcs(outputFile, filetime,filetime)
                   
@@ -273,21 +230,15 @@ class nexradProcess(object):
       layerDefinition = layer.GetLayerDefn()
       filetime = xmrg.getCollectionDateFromFilename(filetime)
 
-      #If we are using a bounding box, let's get the row/col in hrap coords.
-      llHrap = None
-      urHrap = None
-      startCol = 0
-      startRow = 0
-      if( self.minLatLong != None and self.maxLatLong != None ):
-        llHrap = xmrg.latLongToHRAP(self.minLatLong,True,True)
-        urHrap = xmrg.latLongToHRAP(self.maxLatLong,True,True)
-        startCol = llHrap.column
-        startRow = llHrap.row
+      #The grid only holds the window covering the bbox, so row and col are offset by the
+      #start of the window to get the position in the file grid.
+      endRow = xmrg.gridStartRow + xmrg.grid.shape[0]
+      endCol = xmrg.gridStartCol + xmrg.grid.shape[1]
       recsAdded = 0
       featureId = 0
-      for row in range(startRow,xmrg.MAXY):
-        for col in range(startCol,xmrg.MAXX):
-          val = xmrg.grid[row][col]
+      for row in range(xmrg.gridStartRow,endRow):
+        for col in range(xmrg.gridStartCol,endCol):
+          val = xmrg.grid[row - xmrg.gridStartRow][col - xmrg.gridStartCol]
           #If there is no precipitation value, or the value is erroneous 
           if( val > 0 ):
             #In the binary file, the data is stored as hundreths of mm, if we want to write the data as 
@@ -388,6 +339,10 @@ if __name__ == '__main__':
                     help="If set, deletes the NEXRAD data files after processing." )
   parser.add_option("-i", "--OutputInches", dest="outInches", action="store_true",
                     help="If set, the output is converted into inches, native is millimeters." )
+  parser.add_option("-m", "--MeshCacheDir", dest="meshCacheDir",
+                    help="Directory to save the HRAP cell corner meshes in so they are reused between runs." )
+  parser.add_option("-w", "--WorkerCount", dest="workerCount", type="int", default=1,
+                    help="Number of worker processes to decode the NEXRAD files with. Default is 1." )
   
 
   (options, args) = parser.parse_args()
@@ -413,7 +368,7 @@ if __name__ == '__main__':
     #Create our polygon dictionary
     polygons = dict(arg.split('=') for arg in (options.polygons.split(';')))
     
-    nexradProc = nexradProcess(options.bbox, polygons, db, logger, options.outputFile, options.outInches)
+    nexradProc = nexradProcess(options.bbox, polygons, db, logger, options.outputFile, options.outInches, options.meshCacheDir, options.workerCount)
     if(options.shapefileDir):
       nexradProc.writeShapefiles(options.shapefileDir)
     if(options.nexradDir):
@@ -0,0 +1,117 @@
+"""
+Tests that the vectorized XMRG decoder, xmrgFile.readAllRowsVectorized(), produces the same grid as the row by row
+decoder, xmrgFile.readAllRows(). The XMRG files are small synthetic files written by the tests.
+Run with: python testXmrgFile.py
+"""
+import os
+import os.path
+import struct
+import gzip
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from xmrgFile import xmrgFile
+
+"""
+Function: writeXmrgFile
+Purpose: Writes a post 1999 format XMRG file: the grid header, the 66 byte info header and a FORTRAN record for each
+  row of the grid.
+Parameters:
+  filePath is the full path of the file to write. If it ends in .gz the file is gzip compressed.
+  byteOrder is the struct byte order the file is written in, '>' for big endian or '<' for little endian.
+  grid is a numpy array, MAXY rows by MAXX columns, of the values to write.
+  badTagRow if given, the leading tag of this row is written with the wrong byte count.
+Return: None
+"""
+def writeXmrgFile(filePath, byteOrder, grid, badTagRow=None):
+  (maxy, maxx) = grid.shape
+  if(filePath.endswith('.gz')):
+    xmrg = gzip.GzipFile(filePath, 'wb')
+  else:
+    xmrg = open(filePath, 'wb')
+  xmrg.write(struct.pack(byteOrder + '6I', 16, 367, 263, maxx, maxy, 16))
+  infoHeader = struct.pack(byteOrder + '2s8s10s10s8s10s10sif', 'LX', 'xmrgtest', '2009-01-01', '12:00:00',
+                           'QPE-SBN', '2009-01-01', '12:00:00', int(grid.max()), 1.0)
+  xmrg.write(struct.pack(byteOrder + 'I', len(infoHeader)))
+  xmrg.write(infoHeader)
+  xmrg.write(struct.pack(byteOrder + 'I', len(infoHeader)))
+  for row in range(maxy):
+    tag = maxx * 2
+    if(row == badTagRow):
+      tag += 2
+    xmrg.write(struct.pack(byteOrder + 'I', tag))
+    xmrg.write(grid[row].astype(byteOrder + 'i2').tostring())
+    xmrg.write(struct.pack(byteOrder + 'I', maxx * 2))
+  xmrg.close()
+
+class xmrgDecoderTest(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    #Include the missing data value and negative values alongside the precipitation values.
+    self.grid = numpy.random.RandomState(1).randint(-999, 3000, size=(13, 17))
+    self.grid[0][0] = -9999
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+  """
+  Function: decode
+  Purpose: Opens the file and decodes it with both readers, rewinding to the start of the data in between.
+  Parameters:
+    filePath is the file to decode.
+    streamCompressed is passed to xmrgFile.openFile().
+  Return: A tuple of the (result, grid) from readAllRows() and the (result, grid) from readAllRowsVectorized().
+  """
+  def decode(self, filePath, streamCompressed=False):
+    results = []
+    for reader in ('readAllRows', 'readAllRowsVectorized'):
+      dataFile = xmrgFile()
+      self.assertTrue(dataFile.openFile(filePath, streamCompressed))
+      self.assertTrue(dataFile.readFileHeader())
+      try:
+        if(getattr(dataFile, reader)()):
+          results.append((True, dataFile.grid))
+        else:
+          results.append((False, dataFile.lastErrorMsg))
+      finally:
+        dataFile.xmrgFile.close()
+    return(results)
+
+  def assertDecodersMatch(self, filePath, streamCompressed=False):
+    ((rowResult, rowGrid), (vectResult, vectGrid)) = self.decode(filePath, streamCompressed)
+    self.assertTrue(rowResult, rowGrid)
+    self.assertTrue(vectResult, vectGrid)
+    self.assertEqual(rowGrid.shape, self.grid.shape)
+    self.assertTrue(numpy.array_equal(rowGrid, self.grid))
+    self.assertTrue(numpy.array_equal(vectGrid, rowGrid))
+
+  def testBigEndian(self):
+    filePath = os.path.join(self.tempDir, 'xmrg0101200912z')
+    writeXmrgFile(filePath, '>', self.grid)
+    self.assertDecodersMatch(filePath)
+
+  def testLittleEndian(self):
+    filePath = os.path.join(self.tempDir, 'xmrg0101200912z')
+    writeXmrgFile(filePath, '<', self.grid)
+    self.assertDecodersMatch(filePath)
+
+  def testGzipStream(self):
+    for byteOrder in ('>', '<'):
+      filePath = os.path.join(self.tempDir, 'xmrg0101200912z.gz')
+      writeXmrgFile(filePath, byteOrder, self.grid)
+      self.assertDecodersMatch(filePath, True)
+
+  def testCorruptRecordTag(self):
+    for badTagRow in (0, 6, 12):
+      filePath = os.path.join(self.tempDir, 'xmrg0101200912z')
+      writeXmrgFile(filePath, '>', self.grid, badTagRow)
+      ((rowResult, rowMsg), (vectResult, vectMsg)) = self.decode(filePath)
+      self.assertFalse(rowResult)
+      self.assertFalse(vectResult)
+      self.assertTrue('does not match header' in rowMsg, rowMsg)
+      self.assertTrue('row: %d' % (badTagRow) in vectMsg, vectMsg)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,217 @@
+"""
+Module: tideRangeCache
+Purpose: Caches the daily tide ranges the prediction regions use. Several regions ask for the same station and
+ day, and a daily run asks for the same days over and over when re-running, so the ranges are kept in memory for
+ the run and saved to a sqlite file so later runs don't have to go back to the tide service.
+ Where the ranges come from is a backend object: noaaTideBackend queries the NOAA service, localTideBackend reads
+ the daily_tide_range table so the tests can be run without a network connection.
+"""
+import time
+import datetime
+import threading
+try:
+  import json
+except ImportError:
+  import simplejson as json
+from pysqlite2 import dbapi2 as sqlite3
+
+"""
+Class: noaaTideBackend
+Purpose: Gets the tide range from the NOAA tides and currents service.
+"""
+class noaaTideBackend(object):
+  def __init__(self, logger=None):
+    self.logger = logger
+    self.requestCount = 0
+
+  """
+  Function: calcTideRange
+  Purpose: Requests the tide range for the station and dates.
+  Parameters:
+    station - The NOAA station id.
+    beginDate - The first day, YYYYMMDD local time.
+    endDate - The last day, YYYYMMDD local time.
+    datum - The tide datum, for example MLLW.
+    units - feet or meters.
+  Return:
+    The dictionary noaaTideData.calcTideRange returns, keyed on the tide code(HH, LL, etc).
+  """
+  def calcTideRange(self, station, beginDate, endDate, datum, units):
+    from xeniatools.NOAATideData import noaaTideData
+    self.requestCount += 1
+    tide = noaaTideData(logger=self.logger)
+    return(tide.calcTideRange(beginDate = beginDate,
+                       endDate = endDate,
+                       station=station,
+                       datum=datum,
+                       units=units,
+                       timezone='Local Time',
+                       smoothData=False))
+
+"""
+Class: localTideBackend
+Purpose: Gets the tide range from the daily_tide_range table, which is loaded from the NOAA historic tide files
+  with dhecDB.importTideFile. The table is local time, MLLW feet.
+"""
+class localTideBackend(object):
+  def __init__(self, dbFile, logger=None):
+    self.dbFile = dbFile
+    self.logger = logger
+    self.requestCount = 0
+
+  def calcTideRange(self, station, beginDate, endDate, datum, units):
+    self.requestCount += 1
+    startDate = datetime.datetime.strptime(beginDate, '%Y%m%d').strftime('%Y-%m-%dT00:00:00')
+    #Up to the start of the day after the end date.
+    stopDate = (datetime.datetime.strptime(endDate, '%Y%m%d') + datetime.timedelta(days=1)).strftime('%Y-%m-%dT00:00:00')
+    sql = "SELECT date,level,level_code FROM daily_tide_range\
+           WHERE station_id = ? AND date >= ? AND date < ?\
+           ORDER BY date ASC"
+    tideData = {}
+    try:
+      db = sqlite3.connect(self.dbFile)
+      dbCursor = db.cursor()
+      dbCursor.execute(sql, (int(station), startDate, stopDate))
+      for row in dbCursor:
+        date,level,levelCode = row
+        levelCode = levelCode.strip()
+        #The range is the highest high to the lowest low.
+        if(levelCode in ('H', 'HH')):
+          key = 'HH'
+          if(key not in tideData or level > tideData[key]['value']):
+            tideData[key] = {'value' : level, 'date' : date}
+        elif(levelCode in ('L', 'LL')):
+          key = 'LL'
+          if(key not in tideData or level < tideData[key]['value']):
+            tideData[key] = {'value' : level, 'date' : date}
+      dbCursor.close()
+      db.close()
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      return(None)
+    if('HH' not in tideData or 'LL' not in tideData):
+      return(None)
+    return(tideData)
+
+"""
+Class: tideRangeCache
+Purpose: Memory and disk cache in front of a tide backend. Each station, date range, datum and units is requested
+  from the backend at most once per run, even when it fails, and the successful results are saved to the cache file
+  for later runs. Safe to share between the region worker threads.
+"""
+class tideRangeCache(object):
+  """
+  Function: __init__
+  Parameters:
+    backend - The noaaTideBackend or localTideBackend object used on a cache miss.
+    cacheFile - The sqlite file to save the ranges in. If None, the ranges are only cached for the run.
+    logger - The logging object.
+  """
+  def __init__(self, backend, cacheFile=None, logger=None):
+    self.backend = backend
+    self.cacheFile = cacheFile
+    self.logger = logger
+    self.ranges = {}              #Tide ranges keyed on (station, beginDate, endDate, datum, units). None if the request failed.
+    self.lock = threading.Lock()
+    self.hitCount = 0
+    self.missCount = 0
+    self.db = None
+    if(self.cacheFile != None):
+      try:
+        self.db = sqlite3.connect(self.cacheFile, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS tide_range_cache(\
+                         station TEXT,\
+                         begin_date TEXT,\
+                         end_date TEXT,\
+                         datum TEXT,\
+                         units TEXT,\
+                         tide_data TEXT,\
+                         request_date TEXT,\
+                         PRIMARY KEY(station,begin_date,end_date,datum,units));")
+        self.db.commit()
+      except sqlite3.Error, e:
+        if(self.logger != None):
+          self.logger.error("Unable to open tide cache file: %s ErrMsg: %s" % (self.cacheFile, e.args[0]))
+        self.db = None
+
+  """
+  Function: loadFromFile
+  Purpose: Looks up the range in the cache file.
+  Return:
+    The tide range dictionary, None if it isn't in the file.
+  """
+  def loadFromFile(self, key):
+    if(self.db == None):
+      return(None)
+    try:
+      dbCursor = self.db.cursor()
+      dbCursor.execute("SELECT tide_data FROM tide_range_cache\
+                        WHERE station = ? AND begin_date = ? AND end_date = ? AND datum = ? AND units = ?", key)
+      row = dbCursor.fetchone()
+      dbCursor.close()
+      if(row != None):
+        return(json.loads(row[0]))
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("Tide cache lookup failed ErrMsg: %s" % (e.args[0]))
+    return(None)
+
+  def saveToFile(self, key, tideData):
+    if(self.db == None):
+      return
+    try:
+      self.db.execute("INSERT OR REPLACE INTO tide_range_cache\
+                       (station,begin_date,end_date,datum,units,tide_data,request_date)\
+                       VALUES(?,?,?,?,?,?,?)",
+                       key + (json.dumps(tideData, default=str), time.strftime('%Y-%m-%dT%H:%M:%S')))
+      self.db.commit()
+    except (sqlite3.Error, TypeError), e:
+      if(self.logger != None):
+        self.logger.error("Unable to save tide range to cache ErrMsg: %s" % (str(e)))
+
+  """
+  Function: getTideRange
+  Purpose: Returns the tide range for the station and dates, from the cache if we have it, otherwise from the
+    backend.
+  Parameters:
+    station - The NOAA station id.
+    beginDate - The first day, YYYYMMDD local time.
+    endDate - The last day, YYYYMMDD local time.
+    datum - The tide datum.
+    units - feet or meters.
+  Return:
+    The tide range dictionary keyed on the tide code, None if it is not available.
+  """
+  def getTideRange(self, station, beginDate, endDate, datum='MLLW', units='feet'):
+    key = (str(station), beginDate, endDate, datum, units)
+    self.lock.acquire()
+    try:
+      if(key in self.ranges):
+        self.hitCount += 1
+        return(self.ranges[key])
+      tideData = self.loadFromFile(key)
+      if(tideData != None):
+        self.hitCount += 1
+      else:
+        self.missCount += 1
+        try:
+          tideData = self.backend.calcTideRange(str(station), beginDate, endDate, datum, units)
+        except Exception, e:
+          if(self.logger != None):
+            self.logger.error("Error retrieving tide data. Error: %s" %(e))
+          tideData = None
+        if(tideData):
+          self.saveToFile(key, tideData)
+        else:
+          tideData = None
+      #Failed requests are remembered for the run too, so we don't keep retrying the service.
+      self.ranges[key] = tideData
+      return(tideData)
+    finally:
+      self.lock.release()
+
+  def close(self):
+    if(self.db != None):
+      self.db.close()
+      self.db = None
@@ -0,0 +1,746 @@
+"""
+Hindcast the beach advisory prediction models against historical data. Instead of running the testSuite one date
+at a time against the live databases, the historical inputs are loaded into numpy arrays, one array per variable,
+and every MLR and CART model in the config file is scored against all the rows at once. The predictions are
+compared to the measured etcoc values and confusion matrices are output for each region and test.
+"""
+import sys
+import optparse
+import logging
+import logging.config
+import csv
+import ast
+import math
+import time
+import numpy
+from pysqlite2 import dbapi2 as sqlite3
+from xeniatools.xmlConfigFile import xmlConfigFile
+import beachAdvisoryTests
+from beachAdvisoryTests import predictionLevels, compiledFormula, mlrPredictionTest, cartPredictionTest
+from dhecDB import tideLevelIndex
+
+#Column layout of data/validationdataset.csv, the file does not have a header row. range is the day's tide range in
+#feet at 8661070 and the rain columns are from the rain gauges. The file has no radar rainfall(radar_rain_summary_*,
+#radar_preceeding_dry_day_cnt, radar_rainfall_intensity_24), SUN2 salinity or water temperature, 8661070 water
+#temperature, or the day's high and low tide(highFt, lowFt), so the tests that use them can't be scored from it.
+#highFt and lowFt can be added from a daily_tide_range table with hindcastData.addTideColumns.
+validationColumns = ['ndx', 'station', 'region', 'date', 'etcoc', 'salinity', 'tide', 'moon_phase', 'weather',
+                     'range', 'nos8661070_water_level', 'preceding_dry_day_count',
+                     'rain_summary_24', 'rain_summary_48', 'rain_summary_72', 'rain_summary_96',
+                     'rain_summary_120', 'rain_summary_144', 'rain_summary_168',
+                     'rain_total_one_day_delay', 'rain_total_two_day_delay', 'rain_total_three_day_delay',
+                     'rainfall_intensity_24', 'sun2_wind_speed', 'sun2_wind_dir', 'nos8661070_wind_spd',
+                     'nos8661070_wind_dir']
+
+#Variable names used in the formulas that are spelled differently in the station_summary table.
+columnAliases = {'radar_preceeding_dry_day_cnt' : 'radar_preceding_dry_day_cnt'}
+
+#The categories used in the confusion matrices, in row/column order.
+categoryLevels = [predictionLevels.LOW, predictionLevels.MEDIUM, predictionLevels.HIGH, predictionLevels.NO_TEST]
+
+"""
+Class: hindcastData
+Purpose: Holds the historical inputs as a dictionary of numpy arrays keyed on the variable name. Numeric columns
+  are float arrays with NaN for missing values, text columns are object arrays with None for missing values.
+"""
+class hindcastData(object):
+  def __init__(self, logger=None):
+    self.logger = logger
+    self.columns = {}
+    self.rowCount = 0
+    self.validMasks = {}
+    self.textColumns = textColumnView(self)
+
+  """
+  Function: setRows
+  Purpose: Builds the column arrays from a list of rows.
+  Parameters:
+    columnNames - list of the column names, in the order of the values in each row.
+    rows - list of rows, each a list of values.
+  Return:
+    None
+  """
+  def setRows(self, columnNames, rows):
+    self.columns = {}
+    self.validMasks = {}
+    self.textColumns = textColumnView(self)
+    self.rowCount = len(rows)
+    for ndx in range(len(columnNames)):
+      values = []
+      for row in rows:
+        val = row[ndx]
+        if(val == None or (isinstance(val, basestring) and len(val.strip()) == 0)):
+          val = None
+        elif(isinstance(val, basestring)):
+          val = val.strip()
+        values.append(val)
+      #Try to store the column as numbers, if it has text in it, keep it as an object array.
+      try:
+        column = numpy.array([numpy.nan if val == None else float(val) for val in values], dtype=numpy.float64)
+      except ValueError:
+        column = numpy.array(values, dtype=object)
+      self.columns[columnNames[ndx]] = column
+    for alias in columnAliases:
+      if(alias not in self.columns and columnAliases[alias] in self.columns):
+        self.columns[alias] = self.columns[columnAliases[alias]]
+
+  """
+  Function: loadStationSummary
+  Purpose: Loads the rows from the station_summary table.
+  Parameters:
+    dbFile - The sqlite database file with the station_summary table.
+    startDate - If provided, the first date to load, YYYY-MM-DD.
+    endDate - If provided, the date to load up to, but not including.
+  Return:
+    True if the data was loaded, otherwise False.
+  """
+  def loadStationSummary(self, dbFile, startDate=None, endDate=None):
+    where = []
+    params = []
+    if(startDate != None):
+      where.append("date >= ?")
+      params.append(startDate)
+    if(endDate != None):
+      where.append("date < ?")
+      params.append(endDate)
+    sql = "SELECT * FROM station_summary"
+    if(len(where)):
+      sql += " WHERE %s" % (" AND ".join(where))
+    sql += " ORDER BY date,station;"
+    try:
+      db = sqlite3.connect(dbFile)
+      dbCursor = db.cursor()
+      dbCursor.execute(sql, params)
+      columnNames = [desc[0] for desc in dbCursor.description]
+      rows = dbCursor.fetchall()
+      dbCursor.close()
+      db.close()
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("ErrMsg: %s SQL: '%s'" % (e.args[0], sql))
+      return(False)
+    self.setRows(columnNames, rows)
+    if(self.logger != None):
+      self.logger.info("Loaded %d rows from station_summary in %s" % (self.rowCount, dbFile))
+    #station_summary doesn't keep the tide range, it comes from the daily_tide_range table in the same database.
+    self.addTideColumns(dbFile)
+    return(True)
+
+  """
+  Function: loadCSV
+  Purpose: Loads the rows from a csv file.
+  Parameters:
+    csvFile - The full path to the file.
+    columnNames - The names of the columns in the file. If None, the first row of the file is used as the header.
+  Return:
+    True if the data was loaded, otherwise False.
+  """
+  def loadCSV(self, csvFile, columnNames=validationColumns):
+    try:
+      srcFile = open(csvFile, 'rb')
+      rows = [row for row in csv.reader(srcFile) if len(row)]
+      srcFile.close()
+    except IOError, e:
+      if(self.logger != None):
+        self.logger.exception(e)
+      return(False)
+    if(columnNames == None):
+      columnNames = rows.pop(0)
+    self.setRows(columnNames, [row[0:len(columnNames)] for row in rows])
+    if(self.logger != None):
+      self.logger.info("Loaded %d rows from %s" % (self.rowCount, csvFile))
+    return(True)
+
+  """
+  Function: addTideColumns
+  Purpose: Adds the highFt, lowFt and range columns from a tide station's daily_tide_range rows. They are the highest
+    high and lowest low on the day of each row and the difference between them, the same as the tests take from the
+    day's tide range. Columns the data already has are left as they are.
+  Parameters:
+    dbFile - The sqlite database file with the daily_tide_range table.
+    tideStationID - The tide station, the tests use 8661070.
+  Return:
+    True if the tides were loaded, otherwise False.
+  """
+  def addTideColumns(self, dbFile, tideStationID=8661070):
+    if('date' not in self.columns):
+      return(False)
+    tideIndex = tideLevelIndex(tideStationID, self.logger)
+    try:
+      db = sqlite3.connect(dbFile)
+      loaded = tideIndex.loadFromDB(db)
+      db.close()
+    except sqlite3.Error, e:
+      if(self.logger != None):
+        self.logger.error("Unable to open: %s ErrMsg: %s" % (dbFile, e.args[0]))
+      return(False)
+    if(loaded == False):
+      return(False)
+    dates = []
+    for date in self.columns['date']:
+      if(date == None):
+        dates.append('1900-01-01')
+      #The validation dataset has M/D/YYYY dates.
+      elif('/' in date):
+        dates.append(time.strftime('%Y-%m-%d', time.strptime(date, '%m/%d/%Y')))
+      else:
+        dates.append(date)
+    highs,lows = tideIndex.getDailyHighLows(dates)
+    highs = numpy.array(highs, dtype=numpy.float64)
+    lows = numpy.array(lows, dtype=numpy.float64)
+    highs[highs == -9999] = numpy.nan
+    lows[lows == -9999] = numpy.nan
+    for name,column in [('highFt', highs), ('lowFt', lows), ('range', highs - lows)]:
+      if(name not in self.columns):
+        self.columns[name] = column
+        self.validMasks.pop(name, None)
+    if(self.logger != None):
+      self.logger.info("Tide station: %d has the high and low tide for %d of %d rows." % (tideStationID, numpy.count_nonzero(~numpy.isnan(highs)), self.rowCount))
+    return(True)
+
+  """
+  Function: isValid
+  Purpose: Returns a boolean array flagging the rows that have a value for the variable. -9999 is treated as missing
+    the same as the live tests do.
+  Parameters:
+    name - The variable name.
+  Return:
+    The boolean array, all False if we don't have the variable.
+  """
+  def isValid(self, name):
+    if(name not in self.validMasks):
+      if(name not in self.columns):
+        mask = numpy.zeros(self.rowCount, dtype=bool)
+      else:
+        column = self.columns[name]
+        if(column.dtype == object):
+          mask = numpy.array([val != None and val != '-9999' for val in column], dtype=bool)
+        else:
+          mask = ~numpy.isnan(column) & (column != -9999)
+      self.validMasks[name] = mask
+    return(self.validMasks[name])
+
+"""
+Class: textColumnView
+Purpose: Dictionary style access to the columns of a hindcastData object converted to text, the same as a
+  '%(name)s' placeholder converts the value for a single row. The conversions are done on first use.
+"""
+class textColumnView(object):
+  def __init__(self, data):
+    self.data = data
+    self.cache = {}
+
+  def __getitem__(self, name):
+    if(name not in self.cache):
+      column = self.data.columns[name]
+      if(column.dtype == object):
+        self.cache[name] = numpy.array([str(val) for val in column], dtype=object)
+      else:
+        self.cache[name] = numpy.array([str(float(val)) for val in column], dtype=object)
+    return(self.cache[name])
+
+"""
+Class: vectorTransformer
+Purpose: Rewrites a formula's syntax tree so it can be evaluated against numpy arrays. The python boolean
+  operators and chained comparisons don't work on arrays, so they become numpy logical function calls.
+"""
+class vectorTransformer(ast.NodeTransformer):
+  def callFunc(self, name, args):
+    return(ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[], starargs=None, kwargs=None))
+
+  def visit_BoolOp(self, node):
+    self.generic_visit(node)
+    funcName = 'logical_and'
+    if(isinstance(node.op, ast.Or)):
+      funcName = 'logical_or'
+    result = node.values[0]
+    for value in node.values[1:]:
+      result = self.callFunc(funcName, [result, value])
+    return(result)
+
+  def visit_UnaryOp(self, node):
+    self.generic_visit(node)
+    if(isinstance(node.op, ast.Not)):
+      return(self.callFunc('logical_not', [node.operand]))
+    return(node)
+
+  def visit_Compare(self, node):
+    self.generic_visit(node)
+    if(len(node.ops) == 1):
+      return(node)
+    result = None
+    left = node.left
+    for ndx in range(len(node.ops)):
+      compare = ast.Compare(left=left, ops=[node.ops[ndx]], comparators=[node.comparators[ndx]])
+      if(result == None):
+        result = compare
+      else:
+        result = self.callFunc('logical_and', [result, compare])
+      left = node.comparators[ndx]
+    return(result)
+
+  def visit_IfExp(self, node):
+    self.generic_visit(node)
+    return(self.callFunc('where', [node.test, node.body, node.orelse]))
+
+"""
+Class: vectorizedFormula
+Purpose: A prediction test formula prepared to be evaluated against every row of a hindcastData object at once.
+  MLR formulas are an expression evaluated on the arrays. CART decision trees are broken into their if/else
+  tests and cartPrediction assignments, each test is evaluated on the arrays and the rows are split with masks
+  down the branches.
+  If a formula uses something that can't be vectorized, it falls back to running the compiled formula row by row.
+"""
+class vectorizedFormula(object):
+  """
+  Function: __init__
+  Purpose: Parses the formula. Raises a SyntaxError if the formula is not valid python.
+  Parameters:
+    formula - the formula string from the config file.
+    isExpression - True for an MLR expression, False for a CART decision tree.
+  """
+  def __init__(self, formula, isExpression):
+    self.isExpression = isExpression
+    self.variables = set()
+    #Used if the formula can't be vectorized.
+    self.rowFormula = compiledFormula(formula, isExpression)
+    source = compiledFormula.placeholderRe.sub(self.replacePlaceholder, formula).strip()
+    self.steps = None
+    self.exprCode = None
+    try:
+      if(isExpression):
+        tree = vectorTransformer().visit(ast.parse(source, mode='eval'))
+        self.exprCode = compile(ast.fix_missing_locations(tree), '<formula>', 'eval')
+      else:
+        self.steps = self.buildSteps(ast.parse(source).body)
+    except ValueError:
+      self.steps = None
+      self.exprCode = None
+
+  """
+  Function: replacePlaceholder
+  Purpose: re.sub callback that turns a placeholder, including any quotes around it, into a lookup of the array.
+    Quoted string placeholders are compared as text, so they look up the text version of the column.
+  """
+  def replacePlaceholder(self, match):
+    quote,name,flags,conversion = match.groups()
+    self.variables.add(name)
+    if(conversion in 'sr' and len(quote)):
+      return("text['%s']" % (name))
+    return("data['%s']" % (name))
+
+  """
+  Function: expressionVariables
+  Purpose: Finds the data variables used in a piece of the syntax tree.
+  """
+  def expressionVariables(self, node):
+    names = set()
+    for child in ast.walk(node):
+      if(isinstance(child, ast.Subscript) and isinstance(child.value, ast.Name) and child.value.id == 'data'\
+         and isinstance(child.slice, ast.Index) and isinstance(child.slice.value, ast.Str)):
+        names.add(child.slice.value.s)
+    return(names)
+
+  def compileExpression(self, node):
+    tree = ast.Expression(body=vectorTransformer().visit(node))
+    return(compile(ast.fix_missing_locations(tree), '<formula>', 'eval'))
+
+  """
+  Function: buildSteps
+  Purpose: Turns the decision tree statements into a list of steps: ('if', code, variables, bodySteps, elseSteps)
+    and ('assign', code, variables). Raises a ValueError for any statement we can't vectorize.
+  """
+  def buildSteps(self, statements):
+    steps = []
+    for stmt in statements:
+      if(isinstance(stmt, ast.If)):
+        steps.append(('if', self.compileExpression(stmt.test), self.expressionVariables(stmt.test),
+                      self.buildSteps(stmt.body), self.buildSteps(stmt.orelse)))
+      elif(isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and\
+           isinstance(stmt.targets[0], ast.Name) and stmt.targets[0].id == 'cartPrediction'):
+        steps.append(('assign', self.compileExpression(stmt.value), self.expressionVariables(stmt.value)))
+      elif(isinstance(stmt, ast.Pass)):
+        continue
+      else:
+        raise ValueError("Unsupported statement on line %d" % (stmt.lineno))
+    return(steps)
+
+  def evalEnvironment(self, data):
+    env = dict(vars(beachAdvisoryTests))
+    env.update({'data' : data.columns,
+                'text' : data.textColumns,
+                'logical_and' : numpy.logical_and,
+                'logical_or' : numpy.logical_or,
+                'logical_not' : numpy.logical_not,
+                'where' : numpy.where})
+    return(env)
+
+  def validRows(self, data, variables):
+    mask = numpy.ones(data.rowCount, dtype=bool)
+    for name in variables:
+      mask &= data.isValid(name)
+    return(mask)
+
+  def toArray(self, value, rowCount, dtype):
+    return(numpy.array(numpy.broadcast_to(value, (rowCount,)), dtype=dtype))
+
+  """
+  Function: runSteps
+  Purpose: Runs the decision tree steps for the rows flagged in mask, storing the cartPrediction for each row in levels.
+  """
+  def runSteps(self, steps, mask, data, env, levels):
+    for step in steps:
+      if(not mask.any()):
+        return(mask)
+      #If a value used in the test is missing the row can't be scored.
+      valid = self.validRows(data, step[2])
+      mask = mask & valid
+      if(step[0] == 'if'):
+        with numpy.errstate(invalid='ignore'):
+          cond = self.toArray(eval(step[1], env), data.rowCount, bool)
+        self.runSteps(step[3], mask & cond, data, env, levels)
+        self.runSteps(step[4], mask & ~cond, data, env, levels)
+      else:
+        value = self.toArray(eval(step[1], env), data.rowCount, numpy.float64)
+        levels[mask] = value[mask]
+    return(mask)
+
+  """
+  Function: run
+  Purpose: Evaluates the formula for every row.
+  Parameters:
+    data - The hindcastData object. Any extra per row variables, such as station_coefficient, must already be columns.
+    rowMask - Boolean array of the rows to score.
+  Return:
+    For an expression, a float array with the results, NaN where a row couldn't be scored. For a decision tree, an
+    array of the predictionLevels, NO_TEST where a row couldn't be scored.
+  """
+  def run(self, data, rowMask):
+    env = self.evalEnvironment(data)
+    if(self.isExpression):
+      results = numpy.empty(data.rowCount)
+      results.fill(numpy.nan)
+      mask = rowMask & self.validRows(data, self.variables)
+      if(self.exprCode != None):
+        try:
+          with numpy.errstate(all='ignore'):
+            values = self.toArray(eval(self.exprCode, env), data.rowCount, numpy.float64)
+          results[mask] = values[mask]
+          return(results)
+        except Exception:
+          pass
+      for ndx in numpy.nonzero(mask)[0]:
+        results[ndx] = self.rowFormula.run(self.rowData(data, ndx))
+      return(results)
+
+    levels = numpy.empty(data.rowCount)
+    levels.fill(predictionLevels.NO_TEST)
+    if(self.steps != None):
+      try:
+        self.runSteps(self.steps, rowMask.copy(), data, env, levels)
+        return(levels.astype(int))
+      except Exception:
+        levels.fill(predictionLevels.NO_TEST)
+    for ndx in numpy.nonzero(rowMask & self.validRows(data, self.variables))[0]:
+      try:
+        levels[ndx] = self.rowFormula.run(self.rowData(data, ndx))
+      except Exception:
+        levels[ndx] = predictionLevels.NO_TEST
+    return(levels.astype(int))
+
+  def rowData(self, data, ndx):
+    return(dict((name, data.columns[name][ndx]) for name in self.variables))
+
+"""
+Class: wqHindcast
+Purpose: Scores the regions' prediction tests from the config file against a hindcastData set and tabulates the
+  results against the measured etcoc values.
+"""
+class wqHindcast(object):
+  def __init__(self, configFile, logger=None, lowLimit=104.0, highLimit=500.0):
+    self.configFile = configFile    #A reference to an xmlConfigFile object.
+    self.logger = logger
+    self.lowLimit = lowLimit        #etcoc below this is LOW.
+    self.highLimit = highLimit      #etcoc at or above this is HIGH.
+    self.regions = []
+    self.predictions = {}           #Dictionary keyed on the test name, each an array of the predictionLevels per row.
+    self.observed = None
+
+  """
+  Function: loadModels
+  Purpose: Reads the regions, their intercepts, station coefficients and prediction tests from the config file,
+    using the same layout wqDataAccess.processData does.
+  Return:
+    True if the models were loaded, otherwise False.
+  """
+  def loadModels(self):
+    self.regions = []
+    tag = "//environment/stationTesting/watersheds"
+    regionList = self.configFile.getListHead(tag)
+    for watershed in self.configFile.getNextInList(regionList):
+      regionName = watershed.get('id')
+      region = {'name' : regionName, 'intercept' : None, 'tests' : [], 'stations' : {}}
+      intercept = self.configFile.getEntry("//environment/stationTesting/watersheds/watershed[@id=\"%s\"]/intercept" % (regionName))
+      if(intercept == None):
+        if(self.logger != None):
+          self.logger.error("Intercept value not available for %s, skipping region." % (regionName))
+        continue
+      region['intercept'] = float(intercept)
+      tag = "//environment/stationTesting/watersheds/watershed[@id=\"%s\"]/tests" % (regionName)
+      predictionTestList = self.configFile.getListHead(tag)
+      for predictionTest in self.configFile.getNextInList(predictionTestList):
+        testId = predictionTest.get('id')
+        testString = self.configFile.getEntry('predictionTest', predictionTest)
+        testObjName = self.configFile.getEntry('predictionTestObj', predictionTest)
+        if(testString == None or testObjName == None or not hasattr(beachAdvisoryTests, testObjName)):
+          if(self.logger != None):
+            self.logger.error("Region: %s test: %s is missing its formula or test object, skipping." % (regionName, testId))
+          continue
+        testObj = getattr(beachAdvisoryTests, testObjName)
+        if(issubclass(testObj, mlrPredictionTest)):
+          isExpression = True
+        elif(issubclass(testObj, cartPredictionTest)):
+          isExpression = False
+        else:
+          if(self.logger != None):
+            self.logger.error("Region: %s test: %s object: %s can't be hindcast, skipping." % (regionName, testId, testObjName))
+          continue
+        try:
+          formula = vectorizedFormula(testString.strip(), isExpression)
+        except SyntaxError, e:
+          if(self.logger != None):
+            self.logger.error("Region: %s test: %s formula does not compile: %s" % (regionName, testId, str(e)))
+          continue
+        region['tests'].append({'id' : testId, 'formula' : formula})
+      tag = "//environment/stationTesting/watersheds/watershed[@id=\"%s\"]/stations" % (regionName)
+      stationList = self.configFile.getListHead(tag)
+      for station in self.configFile.getNextInList(stationList):
+        coefficient = self.configFile.getEntry('coefficient', station)
+        if(station.get('id') != None and coefficient != None):
+          region['stations'][station.get('id')] = float(coefficient)
+      self.regions.append(region)
+    return(len(self.regions) > 0)
+
+  """
+  Function: categorize
+  Purpose: Categorizes an array of bacteria counts using the low and high limits.
+  Parameters:
+    values - float array, NaN for missing.
+  Return:
+    An int array of the predictionLevels, NO_TEST for missing values.
+  """
+  def categorize(self, values):
+    levels = numpy.empty(len(values), dtype=int)
+    levels.fill(predictionLevels.NO_TEST)
+    with numpy.errstate(invalid='ignore'):
+      levels[values < self.lowLimit] = predictionLevels.LOW
+      levels[(values >= self.lowLimit) & (values < self.highLimit)] = predictionLevels.MEDIUM
+      levels[values >= self.highLimit] = predictionLevels.HIGH
+    return(levels)
+
+  """
+  Function: score
+  Purpose: Scores every test for every region against the data. Each row is scored with the tests of the region
+    its station belongs to. The ensemble prediction is the rounded average of the tests that could be run, the same
+    as wqEquations.overallPrediction.
+  Parameters:
+    data - The hindcastData object.
+  Return:
+    True if at least one test scored a row, otherwise False. The predictions are stored in the predictions member
+    keyed on the test name, 'ensemble' is the overall prediction, and the observed member holds the categorized etcoc
+    values. The testCounts member has the number of rows each test scored out of the region's rows.
+  """
+  def score(self, data):
+    self.predictions = {}
+    self.testCounts = {}
+    self.regionOfRow = numpy.array([None] * data.rowCount, dtype=object)
+    levelSum = numpy.zeros(data.rowCount)
+    levelCnt = numpy.zeros(data.rowCount)
+    stations = data.columns['station']
+    for region in self.regions:
+      rowMask = numpy.array([station in region['stations'] for station in stations], dtype=bool)
+      if(not rowMask.any()):
+        continue
+      self.regionOfRow[rowMask] = region['name']
+      data.columns['intercept'] = numpy.empty(data.rowCount)
+      data.columns['intercept'].fill(region['intercept'])
+      data.columns['station_coefficient'] = numpy.array([region['stations'].get(station, numpy.nan) for station in stations])
+      data.validMasks.pop('intercept', None)
+      data.validMasks.pop('station_coefficient', None)
+      for test in region['tests']:
+        formula = test['formula']
+        missing = [name for name in formula.variables if name not in data.columns]
+        if(len(missing) and self.logger != None):
+          self.logger.warning("Region: %s test: %s no data for variables: %s" % (region['name'], test['id'], ", ".join(sorted(missing))))
+        if(formula.isExpression):
+          #MLR results are log10.
+          log10Results = formula.run(data, rowMask)
+          with numpy.errstate(all='ignore'):
+            levels = self.categorize(numpy.power(10.0, log10Results))
+        else:
+          levels = formula.run(data, rowMask)
+        if(test['id'] not in self.predictions):
+          self.predictions[test['id']] = numpy.empty(data.rowCount, dtype=int)
+          self.predictions[test['id']].fill(predictionLevels.NO_TEST)
+        self.predictions[test['id']][rowMask] = levels[rowMask]
+        executed = rowMask & (levels != predictionLevels.NO_TEST)
+        scoredCnt = numpy.count_nonzero(executed)
+        self.testCounts[(region['name'], test['id'])] = (scoredCnt, numpy.count_nonzero(rowMask))
+        if(scoredCnt == 0 and self.logger != None):
+          self.logger.error("Region: %s test: %s could not score any of its %d rows." % (region['name'], test['id'], numpy.count_nonzero(rowMask)))
+        levelSum[executed] += levels[executed]
+        levelCnt[executed] += 1
+    ensemble = numpy.empty(data.rowCount, dtype=int)
+    ensemble.fill(predictionLevels.NO_TEST)
+    executed = levelCnt > 0
+    #Round half up, the same as round() does for our positive levels.
+    ensemble[executed] = numpy.floor((levelSum[executed] / levelCnt[executed]) + 0.5).astype(int)
+    self.predictions['ensemble'] = ensemble
+    for region in self.regions:
+      regionMask = (self.regionOfRow == region['name'])
+      if(regionMask.any()):
+        self.testCounts[(region['name'], 'ensemble')] = (numpy.count_nonzero(regionMask & executed), numpy.count_nonzero(regionMask))
+    etcoc = data.columns.get('etcoc')
+    if(etcoc is None or etcoc.dtype == object):
+      etcoc = numpy.empty(data.rowCount)
+      etcoc.fill(numpy.nan)
+    self.observed = self.categorize(etcoc)
+    return(numpy.count_nonzero(executed) > 0)
+
+  """
+  Function: confusionMatrix
+  Purpose: Tabulates the predictions against the observed categories.
+  Parameters:
+    testName - The test to build the matrix for.
+    regionName - If provided, only the rows for the region are used.
+  Return:
+    A 4x4 int array, the rows are the observed LOW, MEDIUM, HIGH, NO_TEST(no etcoc) and the columns are the
+    predicted LOW, MEDIUM, HIGH, NO_TEST.
+  """
+  def confusionMatrix(self, testName, regionName=None):
+    predicted = self.predictions[testName]
+    mask = numpy.ones(len(predicted), dtype=bool)
+    if(regionName != None):
+      mask = (self.regionOfRow == regionName)
+    matrix = numpy.zeros((len(categoryLevels), len(categoryLevels)), dtype=int)
+    for obsNdx in range(len(categoryLevels)):
+      obsMask = mask & (self.observed == categoryLevels[obsNdx])
+      for predNdx in range(len(categoryLevels)):
+        matrix[obsNdx][predNdx] = numpy.count_nonzero(obsMask & (predicted == categoryLevels[predNdx]))
+    return(matrix)
+
+  """
+  Function: formatMatrix
+  Purpose: Builds a text table of a confusion matrix.
+  """
+  def formatMatrix(self, title, matrix):
+    names = [str(predictionLevels(level)) for level in categoryLevels]
+    lines = [title, "%-16s%s" % ("Observed\\Pred", "".join(["%10s" % (name) for name in names]))]
+    for ndx in range(len(names)):
+      lines.append("%-16s%s" % (names[ndx], "".join(["%10d" % (val) for val in matrix[ndx]])))
+    scored = matrix[0:3, 0:3]
+    if(scored.sum()):
+      lines.append("Accuracy: %.3f of %d scored samples" % (float(numpy.trace(scored)) / scored.sum(), scored.sum()))
+    return("\n".join(lines))
+
+  """
+  Function: report
+  Purpose: Returns the confusion matrices for each region and test, and each test across all the regions.
+  """
+  def report(self):
+    output = []
+    testNames = sorted(self.predictions.keys())
+    for region in self.regions:
+      for testName in testNames:
+        scoredCnt,rowCnt = self.testCounts.get((region['name'], testName), (0, 0))
+        if(rowCnt == 0):
+          continue
+        title = "Region: %s Test: %s" % (region['name'], testName)
+        if(scoredCnt == 0):
+          output.append("%s\nNot scored, none of the %d rows have all of the test's inputs." % (title, rowCnt))
+        else:
+          output.append(self.formatMatrix("%s Scored %d of %d rows." % (title, scoredCnt, rowCnt), self.confusionMatrix(testName, region['name'])))
+    for testName in testNames:
+      if(numpy.count_nonzero(self.predictions[testName] != predictionLevels.NO_TEST) == 0):
+        output.append("All regions Test: %s\nNot scored for any rows." % (testName))
+      else:
+        output.append(self.formatMatrix("All regions Test: %s" % (testName), self.confusionMatrix(testName)))
+    return("\n\n".join(output))
+
+  """
+  Function: writePredictions
+  Purpose: Writes the per row predictions to a csv file.
+  """
+  def writePredictions(self, data, outputFile):
+    testNames = sorted(self.predictions.keys())
+    outFile = open(outputFile, 'wb')
+    writer = csv.writer(outFile)
+    writer.writerow(['date', 'station', 'region', 'etcoc', 'observed'] + testNames)
+    dates = data.columns.get('date', numpy.array([None] * data.rowCount, dtype=object))
+    etcoc = data.columns.get('etcoc', numpy.array([None] * data.rowCount, dtype=object))
+    for ndx in range(data.rowCount):
+      row = [dates[ndx], data.columns['station'][ndx], self.regionOfRow[ndx], etcoc[ndx],
+             str(predictionLevels(self.observed[ndx]))]
+      row.extend([str(predictionLevels(self.predictions[name][ndx])) for name in testNames])
+      writer.writerow(row)
+    outFile.close()
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser()
+  parser.add_option("-c", "--XMLConfigFile", dest="xmlConfigFile",
+                    help="Configuration file with the models to hindcast." )
+  parser.add_option("-d", "--DatabaseFile", dest="databaseFile",
+                    help="Database with the station_summary table to use for the historical inputs." )
+  parser.add_option("-f", "--CSVFile", dest="csvFile",
+                    help="CSV file to use for the historical inputs, for example data/validationdataset.csv." )
+  parser.add_option("-H", "--CSVHasHeader", dest="csvHeader", action="store_true",
+                    help="If set, the first row of the CSV file has the column names, otherwise the validation dataset layout is used." )
+  parser.add_option("-t", "--TideDatabase", dest="tideDatabase",
+                    help="Database with the daily_tide_range table to add the high and low tide columns to the CSV data from." )
+  parser.add_option("-b", "--BeginDate", dest="beginDate",
+                    help="Only use station_summary rows on or after this date, YYYY-MM-DD." )
+  parser.add_option("-e", "--EndDate", dest="endDate",
+                    help="Only use station_summary rows before this date, YYYY-MM-DD." )
+  parser.add_option("-o", "--OutputFile", dest="outputFile",
+                    help="If provided, the per sample predictions are written to this csv file." )
+  (options, args) = parser.parse_args()
+  if(options.xmlConfigFile == None or (options.databaseFile == None and options.csvFile == None)):
+    parser.print_usage()
+    parser.print_help()
+    sys.exit(-1)
+
+  configFile = xmlConfigFile(options.xmlConfigFile)
+  logger = None
+  logFile = configFile.getEntry('//environment/stationTesting/logConfigFile')
+  if(logFile != None):
+    logging.config.fileConfig(logFile)
+    logger = logging.getLogger("dhec_testing_logger")
+    logger.info("Hindcast session started")
+
+  data = hindcastData(logger)
+  if(options.databaseFile != None):
+    loaded = data.loadStationSummary(options.databaseFile, options.beginDate, options.endDate)
+  else:
+    columnNames = validationColumns
+    if(options.csvHeader):
+      columnNames = None
+    loaded = data.loadCSV(options.csvFile, columnNames)
+    if(loaded and options.tideDatabase != None):
+      loaded = data.addTideColumns(options.tideDatabase)
+  if(loaded == False):
+    print("Unable to load the historical data.")
+    sys.exit(-1)
+
+  hindcast = wqHindcast(configFile, logger)
+  if(hindcast.loadModels() == False):
+    print("No models loaded from the config file.")
+    sys.exit(-1)
+  startTime = time.time()
+  scored = hindcast.score(data)
+  print(hindcast.report())
+  if(scored == False):
+    print("None of the tests could score any of the %d samples." % (data.rowCount))
+    sys.exit(-1)
+  print("Scored %d samples in %f seconds." % (data.rowCount, time.time() - startTime))
+  if(options.outputFile != None):
+    hindcast.writePredictions(data, options.outputFile)
@@ -20,7 +20,10 @@ import logging.handlers
 import optparse
 import math
 import gzip
+import multiprocessing
+from collections import deque
 from numpy import zeros
+import numpy
 from pysqlite2 import dbapi2 as sqlite3      
 import datetime
 
@@ -52,8 +55,18 @@ class xmrgFile:
       self.logger.debug("creating an instance of xmrgFile")
     
     self.fileName = ''
+    self.compressedFilepath = ''
     self.lastErrorMsg = ''
     self.headerRead = False
+    #Flag that specifies if we are reading the compressed file directly instead of from an uncompressed copy.
+    self.streamCompressed = False
+    #Number of bytes read out of the file and the time in seconds spent decoding the grid.
+    self.bytesRead = 0
+    self.decodeTime = 0.0
+    #Row and column in the file grid of self.grid[0][0]. These are non zero when only a window of the
+    #grid was read.
+    self.gridStartRow = 0
+    self.gridStartCol = 0
     
     self.earthRadius = 6371.2;
     self.startLong   = 105.0;
@@ -78,22 +91,30 @@ class xmrgFile:
     the file as well.
   Parameters:
     filePath is a string with the full path to the file to open.
+    streamCompressed if True and the file is compressed, the gzip stream is read directly and no uncompressed copy
+      is written to disk.
   Return:
     True if successful, otherwise False.
   """
-  def openFile(self, filePath):
+  def openFile(self, filePath, streamCompressed=False):
     self.fileName = filePath
     self.compressedFilepath = ''
+    self.streamCompressed = False
+    self.bytesRead = 0
+    self.decodeTime = 0.0
     retVal = False
     try:
-      #Is the file compressed? If so, we want to uncompress it to a file for use.
-      #The reason for not working with the GzipFile object directly is it is not compatible
-      #with the array.fromfile() functionality.
+      #Is the file compressed? If so, we either read it directly through the GzipFile object or
+      #uncompress it to a file for use.
       if( self.fileName.rfind('gz') != -1):
         self.compressedFilepath = self.fileName
         #SPlit the filename from the extension.
         parts = self.fileName.split('.')
         self.fileName = parts[0] 
+        if(streamCompressed):
+          self.streamCompressed = True
+          self.xmrgFile = gzip.GzipFile( filePath, 'rb' )
+          return(True)
         self.xmrgFile = open( self.fileName, mode = 'wb' )
         zipFile = gzip.GzipFile( filePath, 'rb' )
         contents = zipFile.read()
@@ -117,17 +138,32 @@ class xmrgFile:
  Purpose: Called to delete the XMRG file that was just worked with. Can delete the uncompressed file and/or 
   the source compressed file. 
  Parameters:
-   deleteFile if True, will delete the unzipped binary file.
+   deleteFile if True, will delete the unzipped binary file. If the compressed file was streamed there is no unzipped file.
    deleteCompressedFile if True, will delete the compressed file the working file was extracted from.
   """
   def cleanUp(self,deleteFile,deleteCompressedFile):
     self.xmrgFile.close()
-    if(deleteFile):
+    if(deleteFile and self.streamCompressed == False):
       os.remove(self.fileName)
     if(deleteCompressedFile and len(self.compressedFilepath)):
       os.remove(self.compressedFilepath)
     return
     
+  """
+  Function: readBytes
+  Purpose: Reads byteCnt bytes from the open file and keeps a running count of the bytes read. We read through this
+    function instead of array.fromfile() since the GzipFile object does not support fromfile().
+  Parameters:
+    byteCnt is the number of bytes to read.
+  Return: A string with the bytes read. Raises EOFError if fewer than byteCnt bytes were available.
+  """
+  def readBytes(self, byteCnt):
+    buf = self.xmrgFile.read(byteCnt)
+    self.bytesRead += len(buf)
+    if(len(buf) != byteCnt):
+      raise EOFError('Read %d bytes, expected %d bytes.' % (len(buf), byteCnt))
+    return(buf)
+
   """
   Function: readFileHeader
   Purpose: For the open file, reads the header. Call this function first before attempting to use readRow or readAllRows.
@@ -153,7 +189,7 @@ class xmrgFile:
       #int representing HRAP grid boxes in Y direction (MAXY)
       header = array.array('I')
       #read 6 bytes since first int is the header, next 4 ints are the grid data, last int is the tail. 
-      header.fromfile( self.xmrgFile, 6)
+      header.fromstring(self.readBytes(header.itemsize * 6))
       self.swapBytes= 0
       #Determine if byte swapping is needed
       if( header[0] != 16 ):
@@ -168,7 +204,7 @@ class xmrgFile:
       #reset the array
       header = array.array('I')
       #Read the fotran header for the next block of data. Need to determine which header type we'll be reading
-      header.fromfile( self.xmrgFile, 1 )
+      header.fromstring(self.readBytes(header.itemsize))
       if( self.swapBytes ):
         header.byteswap()
         
@@ -195,7 +231,7 @@ class xmrgFile:
         #if( self.swapBytes ):
         #  buf.byteswap()
           
-        buf = self.xmrgFile.read(66)
+        buf = self.readBytes(66)
         
         self.fileNfoHdrData = struct.unpack(unpackFmt, buf)
         srcFileOpen = True
@@ -204,7 +240,7 @@ class xmrgFile:
         if( self.swapBytes ):
           unpackFmt += '>'
         unpackFmt += '=10s10s10s8s'
-        buf = self.xmrgFile.read(38)
+        buf = self.readBytes(38)
         self.fileNfoHdrData = struct.unpack(unpackFmt, buf)
         srcFileOpen = True
         
@@ -214,7 +250,7 @@ class xmrgFile:
         if( self.swapBytes ):
           unpackFmt += '>'
         unpackFmt += '=10s10s10s8s'
-        buf = self.xmrgFile.read(37)
+        buf = self.readBytes(37)
         self.fileNfoHdrData = struct.unpack(unpackFmt, buf)
         srcFileOpen = True
         
@@ -241,7 +277,7 @@ class xmrgFile:
       #should be equal to byteCnt
       if( hasDataNfoHeader ): 
         header = array.array('I')
-        header.fromfile( self.xmrgFile, 1 )
+        header.fromstring(self.readBytes(header.itemsize))
         if( self.swapBytes ):
           header.byteswap()        
         if( header[0] != byteCnt ):
@@ -271,13 +307,13 @@ class xmrgFile:
   """
   def readRecordTag(self):
     dataArray= array.array('I')
-    dataArray.fromfile( self.xmrgFile, 1 )
+    dataArray.fromstring(self.readBytes(dataArray.itemsize))
     if( self.swapBytes ):
       dataArray.byteswap();
     #Verify the header for this row of data matches what the header specified.
     #We do MAXX * 2 since each value is a short.
     if( dataArray[0] != (self.MAXX*2) ):
-      self.lastErrorMsg = 'Trailing tag Byte count: %d for row: %d does not match header: %d.' %( dataArray[0], row, self.MAXX )
+      self.lastErrorMsg = 'Tag Byte count: %d does not match header: %d.' %( dataArray[0], self.MAXX*2 )
       return( None )
     return(dataArray)
   
@@ -295,7 +331,7 @@ class xmrgFile:
     
     #Read a columns worth of data out
     dataArray= array.array('h')
-    dataArray.fromfile( self.xmrgFile, self.MAXX )
+    dataArray.fromstring(self.readBytes(dataArray.itemsize * self.MAXX))
     #Need to byte swap?
     if( self.swapBytes ):
       dataArray.byteswap();    
@@ -315,6 +351,9 @@ class xmrgFile:
   
   """
   def readAllRows(self):
+    startTime = time.time()
+    self.gridStartRow = 0
+    self.gridStartCol = 0
     #Create a integer numeric array(from numpy). Dimensions are MAXY and MAXX.
     self.grid = zeros([self.MAXY,self.MAXX],int)
     for row in range( self.MAXY ):    
@@ -325,9 +364,119 @@ class xmrgFile:
       for val in dataArray:            
         self.grid[row][col] = val
         col+=1
+    self.decodeTime = time.time() - startTime
               
     return(True)
   
+  """
+  Function: readAllRowsVectorized
+  Purpose: Reads all the rows in the file in one block and decodes them directly into a numpy array. Each row
+    is a FORTRAN record: a 4 byte tag, MAXX shorts, then a 4 byte tag, so the whole block can be described with
+    a structured dtype instead of copying the values one at a time. Data is stored in self.grid and is the same
+    grid readAllRows() produces.
+  Parameters: None
+  Returns: True if succesful otherwise False.
+  """
+  def readAllRowsVectorized(self):
+    startTime = time.time()
+    self.gridStartRow = 0
+    self.gridStartCol = 0
+    records = self.readRecordBlock(self.MAXY)
+    if(records is None):
+      return(False)
+    self.grid = records['data'].astype(int)
+    self.decodeTime = time.time() - startTime
+    return(True)
+
+  """
+  Function: getBBOXWindow
+  Purpose: Computes the rows and columns of the file grid that cover the given bounding box. Since the HRAP grid
+    is a polar stereographic projection, the lat/long box is not a rectangle in the grid, so we sample points
+    along each edge of the box and take the extents. The window is padded by a cell on each side and clipped
+    to the grid.
+  Parameters:
+    minLatLong is a LatLong object for the lower left corner of the bounding box.
+    maxLatLong is a LatLong object for the upper right corner of the bounding box.
+  Returns: A tuple of (startRow, startCol, rowCnt, colCnt). rowCnt and colCnt are 0 if the box is outside the grid.
+  """
+  def getBBOXWindow(self, minLatLong, maxLatLong):
+    lats = numpy.linspace(minLatLong.latitude, maxLatLong.latitude, 11)
+    lons = numpy.linspace(minLatLong.longitude, maxLatLong.longitude, 11)
+    edgeLats = numpy.concatenate((lats, lats, numpy.repeat(minLatLong.latitude, 11), numpy.repeat(maxLatLong.latitude, 11)))
+    edgeLons = numpy.concatenate((numpy.repeat(minLatLong.longitude, 11), numpy.repeat(maxLatLong.longitude, 11), lons, lons))
+    (columns, rows) = self.latLongToHRAPArray(edgeLats, edgeLons)
+    startCol = max(int(math.floor(columns.min())) - self.XOR - 1, 0)
+    endCol = min(int(math.ceil(columns.max())) - self.XOR + 1, self.MAXX)
+    startRow = max(int(math.floor(rows.min())) - self.YOR - 1, 0)
+    endRow = min(int(math.ceil(rows.max())) - self.YOR + 1, self.MAXY)
+    return(startRow, startCol, max(endRow - startRow, 0), max(endCol - startCol, 0))
+
+  """
+  Function: readWindow
+  Purpose: Reads only the part of the grid that covers the bounding box. The records before the window are skipped
+    with a seek, only the rows in the window are decoded, and the columns are clipped to the window. Data is
+    stored in self.grid, with self.gridStartRow and self.gridStartCol set to the file grid position of self.grid[0][0].
+    Call after readFileHeader().
+  Parameters:
+    minLatLong is a LatLong object for the lower left corner of the bounding box. If None, the whole grid is read.
+    maxLatLong is a LatLong object for the upper right corner of the bounding box. If None, the whole grid is read.
+  Returns: True if succesful otherwise False.
+  """
+  def readWindow(self, minLatLong, maxLatLong):
+    if(minLatLong == None or maxLatLong == None):
+      return(self.readAllRowsVectorized())
+    startTime = time.time()
+    (startRow, startCol, rowCnt, colCnt) = self.getBBOXWindow(minLatLong, maxLatLong)
+    self.gridStartRow = startRow
+    self.gridStartCol = startCol
+    if(rowCnt == 0 or colCnt == 0):
+      self.grid = zeros([rowCnt, colCnt], int)
+      self.decodeTime = time.time() - startTime
+      return(True)
+    #Each record is the MAXX shorts plus the 4 byte head and tail tags.
+    recordSize = (self.MAXX * 2) + 8
+    self.xmrgFile.seek(startRow * recordSize, os.SEEK_CUR)
+    records = self.readRecordBlock(rowCnt)
+    if(records is None):
+      return(False)
+    self.grid = records['data'][:, startCol:startCol + colCnt].astype(int)
+    self.decodeTime = time.time() - startTime
+    return(True)
+
+  """
+  Function: readRecordBlock
+  Purpose: Reads rowCnt records from the current file position and returns them as a numpy record array with the
+    fields 'head', 'data' and 'tail'. The byte order is handled by the dtype, and the head and tail tags are
+    verified against the expected byte count.
+  Parameters:
+    rowCnt is the number of rows(records) to read.
+  Returns: The record array if successful, otherwise None.
+  """
+  def readRecordBlock(self, rowCnt):
+    #Byte order of the file. If we had to swap the header, the file is in the opposite order of this machine.
+    byteOrder = '='
+    if(self.swapBytes):
+      if(sys.byteorder == 'little'):
+        byteOrder = '>'
+      else:
+        byteOrder = '<'
+    recordType = numpy.dtype([('head', byteOrder + 'u4'),
+                              ('data', byteOrder + 'i2', (self.MAXX,)),
+                              ('tail', byteOrder + 'u4')])
+    try:
+      buf = self.readBytes(recordType.itemsize * rowCnt)
+    except EOFError, e:
+      self.lastErrorMsg = '%s Row count: %d' % (str(e), rowCnt)
+      return(None)
+    records = numpy.frombuffer(buf, dtype=recordType, count=rowCnt)
+    #Verify the tags for each row match what the header specified.
+    #We do MAXX * 2 since each value is a short.
+    badRows = numpy.nonzero((records['head'] != (self.MAXX*2)) | (records['tail'] != (self.MAXX*2)))[0]
+    if(len(badRows)):
+      self.lastErrorMsg = 'Tag Byte count for row: %d does not match header: %d.' % (badRows[0], self.MAXX*2)
+      return(None)
+    return(records)
+
   """
   Function: inBBOX
   Purpose: Tests to see if the testLatLong is in the bounding box given by minLatLong and maxLatLong.
@@ -381,6 +530,48 @@ class xmrgFile:
     
     return( latLong )
 
+  """
+  Function: hrapCoordToLatLongArray
+  Purpose: Vectorized version of hrapCoordToLatLong. Converts arrays of HRAP grid points into latitudes and longitudes.
+  Parameters:  
+    columns is a numpy array(or anything numpy.asarray accepts) of the HRAP columns.
+    rows is a numpy array of the HRAP rows, same shape as columns.
+  Returns:
+    A tuple of numpy arrays (latitudes, longitudes). As with hrapCoordToLatLong, the longitudes are positive degrees west.
+  """
+  def hrapCoordToLatLongArray(self, columns, rows):
+    x = numpy.asarray(columns, dtype=float) - 401.0
+    y = numpy.asarray(rows, dtype=float) - 1601.0
+    rr = x * x + y * y
+    gi = self.meshdegs * self.meshdegs
+    latitudes = numpy.degrees(numpy.arcsin((gi - rr) / (gi + rr)))
+
+    ang = numpy.degrees(numpy.arctan2(y,x))
+    ang = numpy.where(ang < 0.0, ang + 360.0, ang)
+    longitudes = 270.0 + self.startLong - ang
+    longitudes = numpy.where(longitudes < 0.0, longitudes + 360.0, longitudes)
+    longitudes = numpy.where(longitudes > 360.0, longitudes - 360.0, longitudes)
+
+    return(latitudes, longitudes)
+
+  """
+  Function: latLongToHRAPArray
+  Purpose: Vectorized version of latLongToHRAP. Converts arrays of latitudes and longitudes into HRAP grid points.
+    No rounding, origin adjustment or bounds checking is done.
+  Parameters:  
+    latitudes is a numpy array(or anything numpy.asarray accepts) of the latitudes.
+    longitudes is a numpy array of the longitudes, same shape as latitudes.
+  Returns:
+    A tuple of numpy arrays (columns, rows).
+  """
+  def latLongToHRAPArray(self, latitudes, longitudes):
+    flat = numpy.radians(numpy.asarray(latitudes, dtype=float))
+    flon = numpy.radians(numpy.abs(numpy.asarray(longitudes, dtype=float)) + 180.0 - self.startLong)
+    r = self.meshdegs * numpy.cos(flat)/(1.0 + numpy.sin(flat))
+    columns = r * numpy.sin(flon) + 401.0
+    rows = r * numpy.cos(flon) + 1601.0
+    return(columns, rows)
+
   """
   Function: latLongToHRAP
   Purpose: Converts a latitude and longitude into an HRAP grid point.
@@ -472,7 +663,679 @@ class xmrgFile:
     filetime = time.strftime( "%Y-%m-%dT%H:00:00", time.localtime(secs) )
     
     return(filetime)
+
+"""
+Purpose: Holds the cell corner geometry for a grid read by an xmrgFile object. latitudes and longitudes are
+(rows + 1, cols + 1) arrays of the cell corners, longitudes are negative west. Cell [row][col] has its lower left
+corner at [row][col] and its upper right corner at [row+1][col+1]. inBBOX is a (rows, cols) boolean array flagging
+the cells whose lower left corner is in the bounding box the mesh was built for. key uniquely identifies the grid
+geometry, it is set by hrapMeshCache.
+"""
+class hrapMesh(object):
+  def __init__(self, latitudes, longitudes, inBBOX, key=None):
+    self.latitudes = latitudes
+    self.longitudes = longitudes
+    self.inBBOX = inBBOX
+    self.key = key
+
+  """
+  Function: cellWKT
+  Purpose: Builds the WKT polygon for a grid cell. The points are in the same order as the polygons built cell by cell:
+    lower left, upper left, upper right, lower right.
+  Parameters:
+    row, col are the cell in the grid.
+  Returns: The WKT string.
+  """
+  def cellWKT(self, row, col):
+    lats = self.latitudes
+    lons = self.longitudes
+    return("POLYGON((%f %f,%f %f,%f %f,%f %f,%f %f))"\
+          %(lons[row][col], lats[row][col],
+            lons[row+1][col], lats[row+1][col],
+            lons[row+1][col+1], lats[row+1][col+1],
+            lons[row][col+1], lats[row][col+1],
+            lons[row][col], lats[row][col]))
+
+"""
+Purpose: Builds and caches the cell corner mesh for XMRG grids. Every hourly file for a region has the same origin, size
+and bounding box, so the projection math only needs to be done once. Meshes are kept in memory and, if a cache
+directory is given, saved to disk so later runs can load them instead of recomputing them.
+"""
+class hrapMeshCache(object):
+  """
+  Function: __init__
+  Purpose: Initializes the object
+  Parameters:
+    cacheDir is the directory to store the mesh files in. If None, meshes are only cached in memory.
+    logger is the logging object to use, None if no logging.
+  """
+  def __init__(self, cacheDir=None, logger=None):
+    self.cacheDir = cacheDir
+    self.logger = logger
+    self.meshes = {}
+
+  """
+  Function: getMesh
+  Purpose: Returns the mesh for the grid currently read into the xmrgFile object.
+  Parameters:
+    xmrg is the xmrgFile object, the header and grid must have been read.
+    minLatLong, maxLatLong are the LatLong objects for the bounding box. If None, every cell is flagged in the bbox.
+  Returns: An hrapMesh object.
+  """
+  def getMesh(self, xmrg, minLatLong=None, maxLatLong=None):
+    rowCnt = xmrg.grid.shape[0]
+    colCnt = xmrg.grid.shape[1]
+    bboxKey = 'all'
+    if(minLatLong != None and maxLatLong != None):
+      bboxKey = '%f_%f_%f_%f' % (minLatLong.latitude, minLatLong.longitude, maxLatLong.latitude, maxLatLong.longitude)
+    key = 'hrap_mesh_%d_%d_%d_%d_%d_%d_%d_%d_%s' %\
+      (xmrg.XOR, xmrg.YOR, xmrg.MAXX, xmrg.MAXY, xmrg.gridStartRow, xmrg.gridStartCol, rowCnt, colCnt, bboxKey)
+    if(key in self.meshes):
+      return(self.meshes[key])
+
+    mesh = None
+    meshFile = None
+    if(self.cacheDir != None):
+      meshFile = os.path.join(self.cacheDir, '%s.npz' % (key))
+      if(os.path.exists(meshFile)):
+        try:
+          data = numpy.load(meshFile)
+          mesh = hrapMesh(data['latitudes'], data['longitudes'], data['inBBOX'])
+          data.close()
+          if(self.logger != None):
+            self.logger.debug("Loaded HRAP mesh: %s" % (meshFile))
+        except Exception, e:
+          if(self.logger != None):
+            self.logger.exception(e)
+          mesh = None
+
+    if(mesh == None):
+      mesh = self.buildMesh(xmrg, minLatLong, maxLatLong)
+      if(meshFile != None):
+        try:
+          numpy.savez(meshFile, latitudes=mesh.latitudes, longitudes=mesh.longitudes, inBBOX=mesh.inBBOX)
+          if(self.logger != None):
+            self.logger.debug("Saved HRAP mesh: %s" % (meshFile))
+        except Exception, e:
+          if(self.logger != None):
+            self.logger.exception(e)
+
+    mesh.key = key
+    self.meshes[key] = mesh
+    return(mesh)
+
+  """
+  Function: buildMesh
+  Purpose: Projects the cell corners of the grid currently read into the xmrgFile object.
+  Parameters:
+    xmrg is the xmrgFile object, the header and grid must have been read.
+    minLatLong, maxLatLong are the LatLong objects for the bounding box. If None, every cell is flagged in the bbox.
+  Returns: An hrapMesh object.
+  """
+  def buildMesh(self, xmrg, minLatLong=None, maxLatLong=None):
+    rowCnt = xmrg.grid.shape[0]
+    colCnt = xmrg.grid.shape[1]
+    (columns, rows) = numpy.meshgrid(numpy.arange(colCnt + 1) + xmrg.XOR + xmrg.gridStartCol,
+                                     numpy.arange(rowCnt + 1) + xmrg.YOR + xmrg.gridStartRow)
+    (latitudes, longitudes) = xmrg.hrapCoordToLatLongArray(columns, rows)
+    longitudes *= -1
+    #Same test as xmrgFile.inBBOX() using the lower left corner of the cell.
+    cellLats = latitudes[:rowCnt, :colCnt]
+    cellLons = longitudes[:rowCnt, :colCnt]
+    if(minLatLong != None and maxLatLong != None):
+      inBBOX = (cellLats >= minLatLong.latitude) & (cellLons >= minLatLong.longitude) &\
+               (cellLats < maxLatLong.latitude) & (cellLons < maxLatLong.longitude)
+    else:
+      inBBOX = numpy.ones((rowCnt, colCnt), dtype=bool)
+    return(hrapMesh(latitudes, longitudes, inBBOX))
+
+"""
+Purpose: Loads the radar cells for an XMRG file into the precipitation_radar table. All the cells for a file are written
+with one parameterized executemany in a single transaction, so a bad cell rolls back the file instead of silently
+dropping part of it. Rows are upserted against the (collection_date, latitude, longitude) unique index, so reprocessing
+a file replaces its cells.
+"""
+class precipRadarLoader(object):
+  """
+  Function: __init__
+  Purpose: Initializes the object
+  Parameters:
+    dbConnection is the sqlite connection object to load the data into. The SpatiaLite extension must be loaded.
+    logger is the logging object to use, None if no logging.
+  """
+  def __init__(self, dbConnection, logger=None):
+    self.dbConnection = dbConnection
+    self.logger = logger
+    self.lastErrorMsg = ''
+    self.rowsPerSec = 0.0
+
+  """
+  Function: loadCells
+  Purpose: Upserts the radar cells into the precipitation_radar table and commits them as one transaction. The hours
+    loaded are recorded in the radarHourManifest in the same transaction.
+  Parameters:
+    cells is a list of tuples: (insert_date, collection_date, latitude, longitude, precipitation, wkt polygon).
+    collectionDate, if provided, is the hour of the file the cells came from. It is recorded in the manifest even if
+      there are no cells, so an hour without rain is not treated as missing.
+  Returns: The number of rows written if successful, otherwise -1 and the transaction is rolled back.
+  """
+  def loadCells(self, cells, collectionDate=None):
+    sql = "INSERT OR REPLACE INTO precipitation_radar \
+          (insert_date,collection_date,latitude,longitude,precipitation,geom) \
+          VALUES(?,?,?,?,?,GeomFromText(?,4326));"
+    startTime = time.time()
+    manifest = radarHourManifest(self.dbConnection, self.logger)
+    #Make sure the manifest exists before we start the transaction.
+    if(manifest.createTable() == False):
+      self.lastErrorMsg = manifest.lastErrorMsg
+      return(-1)
+    hourCounts = {}
+    if(collectionDate != None):
+      hourCounts[collectionDate] = 0
+    for cell in cells:
+      hourCounts[cell[1]] = hourCounts.get(cell[1], 0) + 1
+    insertDate = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
+    if(len(cells)):
+      insertDate = cells[0][0]
+    try:
+      dbCursor = self.dbConnection.cursor()
+      dbCursor.executemany(sql, cells)
+      manifest.addHours(dbCursor, hourCounts, insertDate)
+      dbCursor.close()
+      self.dbConnection.commit()
+    except Exception, E:
+      import traceback
+      self.lastErrorMsg = traceback.format_exc()
+      if(self.logger != None):
+        self.logger.error(self.lastErrorMsg)
+      self.dbConnection.rollback()
+      return(-1)
+    elapsed = time.time() - startTime
+    if(elapsed > 0):
+      self.rowsPerSec = len(cells) / elapsed
+    else:
+      self.rowsPerSec = 0.0
+    if(self.logger != None):
+      self.logger.debug("Loaded %d radar cells in %f seconds, %f rows/sec." % (len(cells), elapsed, self.rowsPerSec))
+    return(len(cells))
   
+"""
+Purpose: Maintains the precipitation_radar_hours table, a manifest with one row per collection hour that has been loaded
+into precipitation_radar and the number of cells written for it. Finding the hours we are missing is then a primary key
+range lookup on the manifest instead of a DISTINCT over every cell in the radar table.
+"""
+class radarHourManifest(object):
+  """
+  Function: __init__
+  Purpose: Initializes the object
+  Parameters:
+    dbConnection is the sqlite connection object with the precipitation_radar table.
+    logger is the logging object to use, None if no logging.
+  """
+  def __init__(self, dbConnection, logger=None):
+    self.dbConnection = dbConnection
+    self.logger = logger
+    self.lastErrorMsg = ''
+
+  """
+  Function: createTable
+  Purpose: Creates the manifest table if it does not exist. When it is created, it is seeded with the hours already in
+    the precipitation_radar table.
+  Parameters: None
+  Returns: True if successful, otherwise False.
+  """
+  def createTable(self):
+    try:
+      dbCursor = self.dbConnection.cursor()
+      dbCursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'precipitation_radar_hours'")
+      if(dbCursor.fetchone() == None):
+        dbCursor.execute("CREATE TABLE precipitation_radar_hours (\
+                          collection_date TEXT PRIMARY KEY,\
+                          cell_count INTEGER,\
+                          insert_date TEXT)")
+        dbCursor.execute("INSERT INTO precipitation_radar_hours (collection_date,cell_count,insert_date)\
+                          SELECT collection_date,COUNT(*),MAX(insert_date) FROM precipitation_radar GROUP BY collection_date")
+        self.dbConnection.commit()
+        if(self.logger != None):
+          self.logger.info("Created the precipitation_radar_hours manifest.")
+      dbCursor.close()
+    except sqlite3.Error, e:
+      self.lastErrorMsg = str(e)
+      if(self.logger != None):
+        self.logger.error("Unable to create the precipitation_radar_hours manifest. %s" % (self.lastErrorMsg))
+      self.dbConnection.rollback()
+      return(False)
+    return(True)
+
+  """
+  Function: addHours
+  Purpose: Records the hours loaded. The caller is responsible for the commit so the manifest is updated in the same
+    transaction as the radar cells.
+  Parameters:
+    dbCursor is the cursor to execute with.
+    hourCounts is a dictionary keyed on the collection date with the number of cells loaded for the hour.
+    insertDate is the date the hours were loaded.
+  Returns: None
+  """
+  def addHours(self, dbCursor, hourCounts, insertDate):
+    dbCursor.executemany("INSERT OR REPLACE INTO precipitation_radar_hours (collection_date,cell_count,insert_date) VALUES(?,?,?)",
+                         [(hour, hourCounts[hour], insertDate) for hour in hourCounts])
+
+  """
+  Function: getMissingHours
+  Purpose: Determines which of the given hours have not been loaded.
+  Parameters:
+    hourList is a list of the collection dates, YYYY-MM-DDTHH:00:00, we should have.
+  Returns: A list of the hours from hourList that are not in the manifest, in the same order as hourList. None if
+    there was an error.
+  """
+  def getMissingHours(self, hourList):
+    if(len(hourList) == 0):
+      return([])
+    if(self.createTable() == False):
+      return(None)
+    try:
+      dbCursor = self.dbConnection.cursor()
+      dbCursor.execute("SELECT collection_date FROM precipitation_radar_hours WHERE collection_date >= ? AND collection_date <= ?",
+                       (min(hourList), max(hourList)))
+      loadedHours = set([row[0] for row in dbCursor])
+      dbCursor.close()
+    except sqlite3.Error, e:
+      self.lastErrorMsg = str(e)
+      if(self.logger != None):
+        self.logger.error("Unable to query the precipitation_radar_hours manifest. %s" % (self.lastErrorMsg))
+      return(None)
+    return([hour for hour in hourList if hour not in loadedHours])
+
+  """
+  Function: deleteOlderThan
+  Purpose: Removes the hours older than the given date, used when the radar data is cleaned out. The caller is
+    responsible for the commit.
+  Parameters:
+    olderThanDate is the date, YYYY-MM-DDTHH:MM:SS.
+  Returns: True if successful, otherwise False.
+  """
+  def deleteOlderThan(self, olderThanDate):
+    if(self.createTable() == False):
+      return(False)
+    try:
+      dbCursor = self.dbConnection.cursor()
+      dbCursor.execute("DELETE FROM precipitation_radar_hours WHERE collection_date < strftime('%Y-%m-%dT%H:%M:%S', ?)",
+                       (str(olderThanDate),))
+      dbCursor.close()
+    except sqlite3.Error, e:
+      self.lastErrorMsg = str(e)
+      if(self.logger != None):
+        self.logger.error("Unable to clean the precipitation_radar_hours manifest. %s" % (self.lastErrorMsg))
+      return(False)
+    return(True)
+
+"""
+Purpose: Maintains the radar_cell_weights table. For each boundary(watershed) it holds the radar cells that intersect it
+and the fraction of the boundary's area each cell covers. The boundaries and the HRAP grid don't change, so the spatial
+intersections are done once and the hourly weighted average becomes a plain weighted sum. The weights for a boundary
+are rebuilt when its geometry or the grid changes.
+"""
+class radarCellWeights(object):
+  """
+  Function: __init__
+  Purpose: Initializes the object
+  Parameters:
+    dbConnection is the sqlite connection object. The SpatiaLite extension must be loaded to build weights, it is not
+      needed to use them.
+    logger is the logging object to use, None if no logging.
+  """
+  def __init__(self, dbConnection, logger=None):
+    self.dbConnection = dbConnection
+    self.logger = logger
+    self.lastErrorMsg = ''
+
+  """
+  Function: createTables
+  Purpose: Creates the weight tables if they do not exist.
+  Parameters: None
+  Returns: None
+  """
+  def createTables(self):
+    dbCursor = self.dbConnection.cursor()
+    dbCursor.execute("CREATE TABLE IF NOT EXISTS radar_cell_weights (\
+                      boundary_table TEXT NOT NULL,\
+                      boundary_name TEXT NOT NULL,\
+                      latitude DOUBLE NOT NULL,\
+                      longitude DOUBLE NOT NULL,\
+                      weight DOUBLE NOT NULL)")
+    dbCursor.execute("CREATE INDEX IF NOT EXISTS i_radar_cell_weights ON radar_cell_weights (boundary_table, boundary_name)")
+    #The signature is built from the boundary geometry and the grid, if either changes the weights are rebuilt.
+    dbCursor.execute("CREATE TABLE IF NOT EXISTS radar_cell_weights_info (\
+                      boundary_table TEXT NOT NULL,\
+                      boundary_name TEXT NOT NULL,\
+                      signature TEXT NOT NULL,\
+                      build_date DATETIME NOT NULL,\
+                      PRIMARY KEY (boundary_table, boundary_name))")
+    dbCursor.close()
+
+  """
+  Function: buildFromTable
+  Purpose: Builds the weights for every boundary in a boundary table. Boundaries that have not changed since the
+    last build are skipped.
+  Parameters:
+    mesh is the hrapMesh object for the grid the radar data is stored from.
+    boundaryTable is the table with the boundaries, for example boundaries or watershed_boundary.
+    nameColumn is the column with the boundary name.
+    geomColumn is the column with the boundary geometry.
+  Returns: The number of boundaries rebuilt, -1 if an error occured.
+  """
+  def buildFromTable(self, mesh, boundaryTable, nameColumn, geomColumn):
+    try:
+      dbCursor = self.dbConnection.cursor()
+      dbCursor.execute("SELECT %s,%s FROM %s" % (nameColumn, geomColumn, boundaryTable))
+      boundaries = dbCursor.fetchall()
+      dbCursor.close()
+    except Exception, E:
+      import traceback
+      self.lastErrorMsg = traceback.format_exc()
+      if(self.logger != None):
+        self.logger.error(self.lastErrorMsg)
+      return(-1)
+    rebuildCnt = 0
+    for boundary in boundaries:
+      if(boundary[0] == None or boundary[1] == None):
+        continue
+      rebuilt = self.buildBoundary(mesh, boundaryTable, boundary[0], boundary[1])
+      if(rebuilt == None):
+        return(-1)
+      if(rebuilt):
+        rebuildCnt += 1
+    return(rebuildCnt)
+
+  """
+  Function: buildFromPolygon
+  Purpose: Builds the weights for a boundary given as a WKT polygon string.
+  Parameters:
+    mesh is the hrapMesh object for the grid the radar data is stored from.
+    boundaryTable is the name to group the polygon under, for example polygon.
+    boundaryName is the name of the polygon.
+    polygonWKT is the WKT polygon string.
+  Returns: True if the weights were rebuilt, False if they were current, None if an error occured.
+  """
+  def buildFromPolygon(self, mesh, boundaryTable, boundaryName, polygonWKT):
+    try:
+      dbCursor = self.dbConnection.cursor()
+      dbCursor.execute("SELECT GeomFromText(?,4326)", (polygonWKT,))
+      geom = dbCursor.fetchone()[0]
+      dbCursor.close()
+    except Exception, E:
+      import traceback
+      self.lastErrorMsg = traceback.format_exc()
+      if(self.logger != None):
+        self.logger.error(self.lastErrorMsg)
+      return(None)
+    return(self.buildBoundary(mesh, boundaryTable, boundaryName, geom))
+
+  """
+  Function: buildBoundary
+  Purpose: Builds the weights for a single boundary if its geometry or the grid changed since the last build.
+    Each cell of the mesh is intersected with the boundary and the fraction of the boundary area it covers is
+    stored. Only cells that intersect the boundary are stored.
+  Parameters:
+    mesh is the hrapMesh object for the grid the radar data is stored from.
+    boundaryTable is the table, or group name, the boundary came from.
+    boundaryName is the name of the boundary.
+    boundaryGeom is the SpatiaLite geometry blob for the boundary.
+  Returns: True if the weights were rebuilt, False if they were current, None if an error occured.
+  """
+  def buildBoundary(self, mesh, boundaryTable, boundaryName, boundaryGeom):
+    import hashlib
+    signature = "%s_%s" % (hashlib.md5(str(boundaryGeom)).hexdigest(), mesh.key)
+    try:
+      self.createTables()
+      dbCursor = self.dbConnection.cursor()
+      dbCursor.execute("SELECT signature FROM radar_cell_weights_info WHERE boundary_table = ? AND boundary_name = ?",
+                       (boundaryTable, boundaryName))
+      infoRow = dbCursor.fetchone()
+      if(infoRow != None and infoRow[0] == signature):
+        dbCursor.close()
+        return(False)
+
+      startTime = time.time()
+      dbCursor.execute("CREATE TEMP TABLE IF NOT EXISTS temp_radar_cells (latitude DOUBLE, longitude DOUBLE, geom BLOB)")
+      dbCursor.execute("DELETE FROM temp_radar_cells")
+      cells = []
+      for (row, col) in zip(*numpy.nonzero(mesh.inBBOX)):
+        cells.append((float(mesh.latitudes[row][col]), float(mesh.longitudes[row][col]), mesh.cellWKT(row, col)))
+      dbCursor.executemany("INSERT INTO temp_radar_cells (latitude,longitude,geom) VALUES(?,?,GeomFromText(?,4326))", cells)
+
+      dbCursor.execute("DELETE FROM radar_cell_weights WHERE boundary_table = ? AND boundary_name = ?",
+                       (boundaryTable, boundaryName))
+      dbCursor.execute("INSERT INTO radar_cell_weights (boundary_table,boundary_name,latitude,longitude,weight)\
+                        SELECT ?, ?, latitude, longitude, (Area(Intersection(geom, ?))/Area(?))\
+                        FROM temp_radar_cells\
+                        WHERE Intersects(geom, ?) = 1",
+                       (boundaryTable, boundaryName, boundaryGeom, boundaryGeom, boundaryGeom))
+      cellCnt = dbCursor.rowcount
+      dbCursor.execute("INSERT OR REPLACE INTO radar_cell_weights_info (boundary_table,boundary_name,signature,build_date)\
+                        VALUES(?,?,?,?)",
+                       (boundaryTable, boundaryName, signature, time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())))
+      dbCursor.execute("DELETE FROM temp_radar_cells")
+      dbCursor.close()
+      self.dbConnection.commit()
+      if(self.logger != None):
+        self.logger.debug("Built cell weights for %s %s: %d cells in %f seconds."\
+                          % (boundaryTable, boundaryName, cellCnt, time.time() - startTime))
+      return(True)
+    except Exception, E:
+      import traceback
+      self.lastErrorMsg = traceback.format_exc()
+      if(self.logger != None):
+        self.logger.error(self.lastErrorMsg)
+      self.dbConnection.rollback()
+    return(None)
+
+  """
+  Function: getWeightedAvg
+  Purpose: Calculates the weighted average of the radar precipitation for a boundary using the stored weights.
+  Parameters:
+    boundaryTable is the table, or group name, the boundary came from.
+    boundaryName is the name of the boundary.
+    startTime is the starting time in YYYY-MM-DDTHH:MM:SS format.
+    endTime is the ending time in YYYY-MM-DDTHH:MM:SS format.
+  Returns: The weighted average, -9999 if there was no radar data for the boundary. None if no weights have been
+    built for the boundary or an error occured, the caller should fall back to the spatial query.
+  """
+  def getWeightedAvg(self, boundaryTable, boundaryName, startTime, endTime):
+    try:
+      dbCursor = self.dbConnection.cursor()
+      dbCursor.execute("SELECT signature FROM radar_cell_weights_info WHERE boundary_table = ? AND boundary_name = ?",
+                       (boundaryTable, boundaryName))
+      if(dbCursor.fetchone() == None):
+        dbCursor.close()
+        return(None)
+      #The radar cells are matched on their lower left corner. Older rows were written with 6 decimal places, so
+      #we compare with a tolerance instead of an exact match.
+      dbCursor.execute("SELECT SUM(weights.weight * radar.precipitation), COUNT(*)\
+                        FROM radar_cell_weights weights, precipitation_radar radar\
+                        WHERE weights.boundary_table = ? AND weights.boundary_name = ? AND\
+                              radar.collection_date >= ? AND radar.collection_date <= ? AND\
+                              radar.latitude > weights.latitude - 0.00001 AND radar.latitude < weights.latitude + 0.00001 AND\
+                              radar.longitude > weights.longitude - 0.00001 AND radar.longitude < weights.longitude + 0.00001",
+                       (boundaryTable, boundaryName, startTime, endTime))
+      row = dbCursor.fetchone()
+      dbCursor.close()
+    except sqlite3.Error, e:
+      self.lastErrorMsg = str(e)
+      return(None)
+    if(row[1] == 0):
+      return(-9999)
+    return(row[0])
+
+  """
+  Function: deleteBoundaries
+  Purpose: Deletes the weights for all the boundaries from a table, for when the table's boundaries are deleted. The
+    changes are not committed so they can be part of the caller's transaction.
+  Parameters:
+    boundaryTable is the table, or group name, the boundaries came from.
+  Returns: True if successful, otherwise False.
+  """
+  def deleteBoundaries(self, boundaryTable):
+    try:
+      self.createTables()
+      dbCursor = self.dbConnection.cursor()
+      dbCursor.execute("DELETE FROM radar_cell_weights WHERE boundary_table = ?", (boundaryTable,))
+      dbCursor.execute("DELETE FROM radar_cell_weights_info WHERE boundary_table = ?", (boundaryTable,))
+      dbCursor.close()
+    except sqlite3.Error, e:
+      self.lastErrorMsg = str(e)
+      if(self.logger != None):
+        self.logger.error(self.lastErrorMsg)
+      return(False)
+    return(True)
+
+#Mesh caches used by decodeXMRGFile, keyed on the cache directory. Each worker process builds its own the
+#first time it decodes a file.
+workerMeshCaches = {}
+
+"""
+Function: decodeXMRGFile
+Purpose: Decodes the bounding box window of an XMRG file and builds the precipitation_radar cells for it. This is the
+  work done by the xmrgImportPipeline worker processes, so it is a module level function that only takes and returns
+  picklable objects.
+Parameters:
+  params is a dictionary with the keys:
+    fileName is the full path to the XMRG file.
+    streamCompressed if True a compressed file is read directly from the gzip stream.
+    minLatLong, maxLatLong are the LatLong objects for the bounding box, None to read the whole grid.
+    insertDate is the insert_date to use for the cells.
+    dataConvert, if not None, is the divisor used to convert the values, negative values are set to 0.
+      If None the raw values are used.
+    saveAllPrecipVals if True every cell in the bounding box is kept, otherwise only the cells with precipitation.
+    meshCacheDir is the directory for the hrapMeshCache, None for an in memory cache.
+    deleteSourceFile, deleteCompressedSourceFile are passed to xmrgFile.cleanUp when we are done with the file.
+  meshCache, if provided, is the hrapMeshCache to use instead of the per process one.
+Returns: A dictionary with the keys fileName, collectionDate, cells, the list of tuples for precipRadarLoader.loadCells(),
+  xmrg, the xmrgFile object with the header and grid and the file handle released, and errorMsg which is None if the file
+  was decoded.
+"""
+def decodeXMRGFile(params, meshCache=None):
+  result = {'fileName' : params['fileName'],
+            'collectionDate' : None,
+            'cells' : None,
+            'xmrg' : None,
+            'errorMsg' : None}
+  xmrg = xmrgFile()
+  if(xmrg.openFile(params['fileName'], params.get('streamCompressed', True)) == False):
+    result['errorMsg'] = "Unable to open file. %s" % (xmrg.lastErrorMsg)
+    return(result)
+  try:
+    minLatLong = params.get('minLatLong')
+    maxLatLong = params.get('maxLatLong')
+    if(xmrg.readFileHeader() == False):
+      result['errorMsg'] = "Unable to read the file header."
+    elif(xmrg.readWindow(minLatLong, maxLatLong) == False):
+      result['errorMsg'] = "Unable to read rows all rows in from file."
+    else:
+      if(meshCache == None):
+        meshCacheDir = params.get('meshCacheDir')
+        if(meshCacheDir not in workerMeshCaches):
+          workerMeshCaches[meshCacheDir] = hrapMeshCache(meshCacheDir)
+        meshCache = workerMeshCaches[meshCacheDir]
+      mesh = meshCache.getMesh(xmrg, minLatLong, maxLatLong)
+      (directory,filetime) = os.path.split(xmrg.fileName)
+      (filetime,ext) = os.path.splitext(filetime)
+      result['collectionDate'] = xmrg.getCollectionDateFromFilename(filetime)
+      dataConvert = params.get('dataConvert')
+      if(dataConvert != None):
+        precip = numpy.where(xmrg.grid > 0, xmrg.grid / dataConvert, 0.0)
+      else:
+        precip = xmrg.grid
+      if(params.get('saveAllPrecipVals', True)):
+        saveCells = mesh.inBBOX
+      else:
+        saveCells = mesh.inBBOX & (xmrg.grid > 0)
+      insertDate = params.get('insertDate')
+      cells = []
+      for (row, col) in zip(*numpy.nonzero(saveCells)):
+        cells.append((insertDate, result['collectionDate'],
+                      float(mesh.latitudes[row][col]), float(mesh.longitudes[row][col]),
+                      float(precip[row][col]), mesh.cellWKT(row, col)))
+      result['cells'] = cells
+  except Exception, E:
+    import traceback
+    result['errorMsg'] = traceback.format_exc()
+  try:
+    xmrg.cleanUp(params.get('deleteSourceFile', False), params.get('deleteCompressedSourceFile', False))
+  except Exception, E:
+    if(result['errorMsg'] == None):
+      result['errorMsg'] = "Unable to clean up file. %s" % (str(E))
+  #Drop the file handle so the object can be sent back from the worker process.
+  xmrg.xmrgFile = None
+  if(result['errorMsg'] == None):
+    result['xmrg'] = xmrg
+  return(result)
+
+"""
+Purpose: Imports a set of XMRG files with a pool of worker processes decoding the files and building the radar cells while
+the calling process does all the database writes, so there is only ever one SQLite writer. The results are handed to the
+writer in the order the files were given no matter which worker finishes first, so the output is the same as a
+sequential run. Only a few files per worker are in flight at a time to keep the memory use bounded.
+"""
+class xmrgImportPipeline(object):
+  """
+  Function: __init__
+  Purpose: Initializes the object
+  Parameters:
+    workerCount is the number of worker processes to decode with. 1 or less decodes the files in this process.
+    logger is the logging object to use, None if no logging.
+  """
+  def __init__(self, workerCount=1, logger=None):
+    self.workerCount = workerCount
+    self.logger = logger
+    self.filesPerSec = 0.0
+
+  """
+  Function: run
+  Purpose: Decodes the files and passes each result to the writer.
+  Parameters:
+    paramsList is a list of the decodeXMRGFile parameter dictionaries, one per file, in the order they are to be written.
+    writer is a function that takes the decodeXMRGFile result dictionary and returns True if it was written.
+  Returns: The number of files the writer reported as written.
+  """
+  def run(self, paramsList, writer):
+    startTime = time.time()
+    writtenCnt = 0
+    if(self.workerCount > 1 and len(paramsList) > 1):
+      workerCount = min(self.workerCount, len(paramsList))
+      if(self.logger != None):
+        self.logger.debug("Decoding %d files with %d worker processes." % (len(paramsList), workerCount))
+      pool = multiprocessing.Pool(workerCount)
+      try:
+        pending = deque()
+        nextNdx = 0
+        maxPending = workerCount * 2
+        while(nextNdx < len(paramsList) or len(pending)):
+          while(nextNdx < len(paramsList) and len(pending) < maxPending):
+            pending.append(pool.apply_async(decodeXMRGFile, (paramsList[nextNdx],)))
+            nextNdx += 1
+          #Always wait on the oldest file so the writes happen in order.
+          if(writer(pending.popleft().get())):
+            writtenCnt += 1
+        pool.close()
+      except:
+        pool.terminate()
+        pool.join()
+        raise
+      pool.join()
+    else:
+      for params in paramsList:
+        if(writer(decodeXMRGFile(params))):
+          writtenCnt += 1
+    elapsed = time.time() - startTime
+    if(elapsed > 0):
+      self.filesPerSec = len(paramsList) / elapsed
+    if(self.logger != None):
+      self.logger.info("Imported %d of %d files in %f seconds, %f files/sec."\
+                       % (writtenCnt, len(paramsList), elapsed, self.filesPerSec))
+    return(writtenCnt)
+
 class xmrgDB(object):
   """
   Function: __init__
@@ -561,6 +1424,8 @@ class xmrgDB(object):
     sql = "DELETE FROM precipitation_radar WHERE collection_date < strftime('%%Y-%%m-%%dT%%H:%%M:%%S', '%s');" % (olderThanDate)
     dbCursor = self.executeQuery(sql)
     if(dbCursor != None):
+      #Keep the hour manifest in step with the radar table.
+      radarHourManifest(self.db).deleteOlderThan(olderThanDate)
       try:
         self.db.commit()
         dbCursor.close()
@@ -628,8 +1493,14 @@ class xmrgDB(object):
        name the watersheds.
     startTime is the starting time in YYYY-MM-DDTHH:MM:SS format.
     endTime is the starting time in YYYY-MM-DDTHH:MM:SS format.
+    boundaryName is the name the polygon's cell weights were built under. If provided and the weights exist, they are
+      used instead of the spatial query.
   """
-  def calculateWeightedAvg(self, boundaryPolygon, startTime, endTime):
+  def calculateWeightedAvg(self, boundaryPolygon, startTime, endTime, boundaryName=None):
+    if(boundaryName != None):
+      weighted_avg = radarCellWeights(self.db).getWeightedAvg('polygon', boundaryName, startTime, endTime)
+      if(weighted_avg != None):
+        return(weighted_avg)
     weighted_avg = -9999
     polyString = self.buildPolygonString(boundaryPolygon)
     #Get the percentages that the intersecting radar grid make up of the watershed boundary.      
@@ -662,6 +1533,10 @@ class xmrgDB(object):
     return(weighted_avg)
   
   def calculateWeightedAvg2(self, polygonKey, startTime, endTime):
+    #If the cell weights have been built for the watershed, use them instead of the spatial query.
+    weighted_avg = radarCellWeights(self.db).getWeightedAvg('watershed_boundary', polygonKey, startTime, endTime)
+    if(weighted_avg != None):
+      return(weighted_avg)
     weighted_avg = -9999
     #Get the percentages that the intersecting radar grid make up of the watershed boundary.      
     sql = "SELECT * FROM(\
@@ -800,6 +1675,8 @@ if __name__ == '__main__':
                       help="If set, when importing the XMRG file, cells that had precipitation of 0 will be stored in the database.")
     parser.add_option("-p", "--Polygon", dest="polygon",
                       help="Polygon of interest to use for querying against the radar data." )
+    parser.add_option("-v", "--VerifyDecoder", dest="verifyDecoder", action= 'store_true',
+                      help="If set, the XMRG file is decoded with both the row by row and the vectorized readers and the grids are compared." )
     
     (options, args) = parser.parse_args()
     #if( options.xmlConfigFile == None ):
@@ -829,7 +1706,29 @@ if __name__ == '__main__':
     dataFile.openFile(options.xmrgFile)
     if( dataFile.readFileHeader() ):     
       print( "File Origin: X %d Y: %d Columns: %d Rows: %d" %(dataFile.XOR,dataFile.YOR,dataFile.MAXX,dataFile.MAXY))
-      if( dataFile.readAllRows() ):
+      if(options.verifyDecoder):
+        #Decode the grid with the row by row reader, then rewind to the start of the data and decode again
+        #with the vectorized reader. The two grids must be identical.
+        dataStart = dataFile.xmrgFile.tell()
+        startTime = time.time()
+        if(dataFile.readAllRows() == False):
+          print("readAllRows failed: %s" %(dataFile.lastErrorMsg))
+          sys.exit(-1)
+        rowGrid = dataFile.grid
+        rowTime = time.time() - startTime
+        dataFile.xmrgFile.seek(dataStart, os.SEEK_SET)
+        startTime = time.time()
+        if(dataFile.readAllRowsVectorized() == False):
+          print("readAllRowsVectorized failed: %s" %(dataFile.lastErrorMsg))
+          sys.exit(-1)
+        vectTime = time.time() - startTime
+        mismatches = numpy.count_nonzero(rowGrid != dataFile.grid)
+        print("readAllRows: %f seconds readAllRowsVectorized: %f seconds Mismatched cells: %d"\
+              %(rowTime, vectTime, mismatches))
+        if(mismatches):
+          sys.exit(-1)
+        sys.exit(0)
+      if( dataFile.readWindow(minLatLong, maxLatLong) ):
         #In the binary file, the data is stored as hundreths of mm, if we want to write the data as 
         #inches , need to divide by 2540.
         dataConvert = 100.0 
@@ -846,74 +1745,25 @@ if __name__ == '__main__':
         #Flag to specifiy if any non 0 values were found. No need processing the weighted averages 
         #below if nothing found.
         rainDataFound=False 
-        #If we are using a bounding box, let's get the row/col in hrap coords.
-        llHrap = None
-        urHrap = None
-        startCol = 0
-        startRow = 0
-        #If we are using a bounding box to clip out the input data we are interested in, convert those
-        #lat/longs into the HRAP grid to set where we start our import.
-        if( minLatLong != None and maxLatLong != None ):
-          llHrap = dataFile.latLongToHRAP(minLatLong,True,True)
-          urHrap = dataFile.latLongToHRAP(maxLatLong,True,True)
-          startCol = llHrap.column
-          startRow = llHrap.row
-        recsAdded = 0
-        for row in range(startRow,dataFile.MAXY):
-          for col in range(startCol,dataFile.MAXX):
-            val = dataFile.grid[row][col]
-            #If there is no precipitation value, or the value is erroneous 
-            if( val <= 0 ):
-              if(options.storeDryPrecipCells):
-                val = 0
-              else:
-                continue
-            else:
-              val /= dataConvert
-              
-            hrap = hrapCoord( dataFile.XOR + col, dataFile.YOR + row )
-            latlon = dataFile.hrapCoordToLatLong( hrap )                                
-            latlon.longitude *= -1
-            saveToDB = False
-            if( minLatLong != None and maxLatLong != None ):
-              if( dataFile.inBBOX( latlon, minLatLong, maxLatLong ) ):
-                saveToDB = True
-            else:
-              saveToDB = True
-            if(saveToDB):
-              #Build polygon points. Each grid point represents a 4km square, so we want to create a polygon
-              #that has each point in the grid for a given point.                  
-              hrapNewPt = hrapCoord( dataFile.XOR + col, dataFile.YOR + row + 1)
-              latlonUL = dataFile.hrapCoordToLatLong( hrapNewPt )
-              latlonUL.longitude *= -1
-              hrapNewPt = hrapCoord( dataFile.XOR + col + 1, dataFile.YOR + row)
-              latlonBR = dataFile.hrapCoordToLatLong( hrapNewPt )
-              latlonBR.longitude *= -1
-              hrapNewPt = hrapCoord( dataFile.XOR + col + 1, dataFile.YOR + row + 1)
-              latlonUR = dataFile.hrapCoordToLatLong( hrapNewPt )
-              latlonUR.longitude *= -1
-              wkt = "POLYGON((%f %f,%f %f,%f %f,%f %f,%f %f))"\
-                    %(latlon.longitude, latlon.latitude,
-                      latlonUL.longitude, latlonUL.latitude, 
-                      latlonUR.longitude, latlonUR.latitude, 
-                      latlonBR.longitude, latlonBR.latitude, 
-                      latlon.longitude, latlon.latitude, 
-                      )
-              sql = "INSERT INTO precipitation_radar \
-                    (insert_date,collection_date,latitude,longitude,precipitation,geom) \
-                    VALUES('%s','%s',%f,%f,%f,GeomFromText('%s',4326));" \
-                    %( datetime,filetime,latlon.latitude,latlon.longitude,val,wkt)
-              cursor = db.executeQuery( sql )
-              #Problem with the query, since we are working with transactions, we have to rollback.
-              if( cursor != None ):
-                recsAdded += 1
-              else:
-                print(db.lastErrorMsg)
-                db.lastErrorMsg = None
-                db.db.rollback()
-        #Commit the inserts.    
-        db.db.commit()
-        print('Added: %d records to database.' % (recsAdded))
+        #Get the cell corners for the grid.
+        mesh = hrapMeshCache().getMesh(dataFile, minLatLong, maxLatLong)
+        #If there is no precipitation value, or the value is erroneous, only keep the cell if we are storing dry cells.
+        if(options.storeDryPrecipCells):
+          saveCells = mesh.inBBOX
+        else:
+          saveCells = mesh.inBBOX & (dataFile.grid > 0)
+        precip = numpy.where(dataFile.grid > 0, dataFile.grid / dataConvert, 0.0)
+        cells = []
+        for (row, col) in zip(*numpy.nonzero(saveCells)):
+          cells.append((datetime, filetime,
+                        float(mesh.latitudes[row][col]), float(mesh.longitudes[row][col]),
+                        float(precip[row][col]), mesh.cellWKT(row, col)))
+        loader = precipRadarLoader(db.db)
+        recsAdded = loader.loadCells(cells, filetime)
+        if(recsAdded == -1):
+          print(loader.lastErrorMsg)
+          recsAdded = 0
+        print('Added: %d records to database. %f rows/sec.' % (recsAdded, loader.rowsPerSec))
 
         #Now let's take the polygon of interest, find out all the radar cells that intersect it, then 
         #calculate a weighted average.